@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import codecs
+import logging
+import sys
+
+import mmagic.core.exception as exception
+import mmagic.core.pipeline as pipeline
+import mmagic.core.profiler as profiler
+import mmagic.core.word_list as word_list
+from mmagic.core.engine import Engine
+
+# Runs the add-on's bulk operations on a collection file without the Anki
+# GUI, e.g.
+#
+#   python -m mmagic.cli collection.anki2 --populate --add-missing --check
+#   python -m mmagic.cli collection.anki2 --import hsk3.txt --with-components
+#
+# Anki must be on the Python path. Close Anki before running this on a
+# collection that it has open.
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m mmagic.cli',
+        description='Populate the Mandarin notes in an Anki collection.')
+    parser.add_argument('collection', help='path to the collection.anki2 file')
+    parser.add_argument('--import', dest='import_path', default=None, metavar='FILE',
+        help='add notes for the words in FILE, one per line, that have none')
+    parser.add_argument('--note-type', default=None,
+        help='note type of the imported notes (default: the current one)')
+    parser.add_argument('--with-components', action='store_true',
+        help='also import the missing components of the imported words')
+    parser.add_argument('--populate', action='store_true',
+        help='fill in empty fields from the dictionary')
+    parser.add_argument('--add-missing', action='store_true',
+        help='add notes for components and measure words that have none')
+    parser.add_argument('--check', action='store_true',
+        help='report notes with empty component lists or missing dependencies')
+    parser.add_argument('--health', action='store_true',
+        help='check the whole collection in one pass, including duplicates and cycles')
+    parser.add_argument('--tag', default=None,
+        help='tag the notes reported by --check or --health with this tag')
+    parser.add_argument('--batch-size', type=int, default=pipeline.DEFAULT_BATCH_SIZE,
+        help='number of notes per transaction (default %(default)s)')
+    parser.add_argument('--dry-run', action='store_true',
+        help='report the changes that would be made without writing them')
+    parser.add_argument('--processes', type=int, default=None,
+        help='worker processes for --populate when the dictionary snapshot is available '
+             '(default: one per CPU, 1 to disable)')
+    parser.add_argument('--profile', default=None, metavar='FILE',
+        help='save counts and timings to FILE as JSON')
+    parser.add_argument('--verbose', '-v', action='count', default=0,
+        help='log progress to stderr; give twice for debug messages')
+    args = parser.parse_args(argv)
+    if not (args.import_path or args.populate or args.add_missing or args.check or args.health):
+        parser.error('nothing to do: give at least one of --import, --populate, --add-missing, --check, --health')
+    if args.with_components and not args.import_path:
+        parser.error('--with-components needs --import')
+    if args.batch_size < 1:
+        parser.error('--batch-size must be at least 1')
+    if args.processes is not None and args.processes < 1:
+        parser.error('--processes must be at least 1')
+    return args
+
+def open_collection(path):
+    from anki import Collection
+    return Collection(path)
+
+# The add-on wraps Note.flush in main.py to keep the engine's indexes up to
+# date. Do the same here.
+def install_hooks(engine):
+    import anki.notes
+    from anki.hooks import wrap
+
+    def note_flushed(note, *args, **kwargs):
+        engine.note_flushed(note)
+
+    anki.notes.Note.flush = wrap(anki.notes.Note.flush, note_flushed, "after")
+
+# Prints a count per category and then the messages that were kept.
+def print_errors(errors, indent):
+    if len(errors) == 0:
+        return
+    for line in errors.summary():
+        print (indent + line).encode('utf-8')
+    for message in errors.get_message_list():
+        print (indent + '  ' + message).encode('utf-8')
+    if errors.omitted() > 0:
+        print '%s  ... and %d more'%(indent, errors.omitted())
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    levels = [logging.WARNING, logging.INFO, logging.DEBUG]
+    logging.basicConfig(level=levels[min(args.verbose, 2)], format=profiler.LOG_FORMAT)
+    import_list = None
+    if args.import_path is not None:
+        import_list = word_list.read_word_list(args.import_path)
+    collection = open_collection(args.collection)
+    try:
+        import_model = None
+        if import_list is not None:
+            if args.note_type is not None:
+                import_model = collection.models.byName(args.note_type)
+            else:
+                import_model = collection.models.current()
+            try:
+                word_list.check_model(collection, import_model)
+            except exception.MagicException as e:
+                print >>sys.stderr, e
+                return 2
+        engine = Engine(collection)
+        install_hooks(engine)
+        session = engine.begin_session(dry_run=args.dry_run)
+        results = pipeline.run(
+            collection,
+            populate_notes=args.populate,
+            add_missing=args.add_missing,
+            check=args.check,
+            tag=args.tag,
+            batch_size=args.batch_size,
+            processes=args.processes,
+            engine=engine,
+            health_report=args.health,
+            import_list=import_list,
+            import_model=import_model,
+            import_components=args.with_components)
+        if args.dry_run:
+            changes = session.describe()
+        errors = engine.end_session()
+    finally:
+        collection.close()
+    if args.profile is not None:
+        with codecs.open(args.profile, 'w', 'utf-8') as output:
+            output.write(profiler.to_json(engine.profiler_report()))
+
+    failed = False
+    for result in results:
+        print result
+        print_errors(result.errors, '  ')
+        failed = failed or len(result.errors) > 0
+    print_errors(errors, '')
+    if args.dry_run:
+        print 'Dry run. %d changes not written:'%len(changes)
+        for line in changes:
+            print ('  ' + line).encode('utf-8')
+    return 1 if failed or len(errors) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
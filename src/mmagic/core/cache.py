@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import threading
+
+# A bounded, thread-safe cache that evicts the least recently used entry
+# when it is full. It has no dependencies of its own, so modules such as
+# mmagic.core.cjk can use it without loading zhonglib.
+
+DEFAULT_CAPACITY = 20000
+
+class LRUCache:
+
+    # Exceptions of the types in 'cached_errors' are cached along with
+    # ordinary results.
+    def __init__(self, capacity=DEFAULT_CAPACITY, cached_errors=()):
+        assert capacity > 0
+        self.capacity = capacity
+        self.cached_errors = cached_errors
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Returns the cached value for the key. If there is none, 'compute' is
+    # called with the key to calculate it. A cached exception is raised again
+    # on every lookup of its key.
+    def get(self, key, compute):
+        with self.lock:
+            cached = self.take(key)
+        if cached is None:
+            cached = self.store(key, compute)
+        value, error = cached
+        if error is not None:
+            raise error
+        return value
+
+    # Returns a dictionary from each of the keys to its value, as get would.
+    # Each distinct key is looked up once, and the hits are all found under
+    # one acquisition of the lock. Keys with a cached exception are left out;
+    # get raises it.
+    def get_many(self, keys, compute):
+        found = {}
+        with self.lock:
+            for key in set(keys):
+                found[key] = self.take(key)
+        result = {}
+        for key, cached in found.iteritems():
+            if cached is None:
+                cached = self.store(key, compute)
+            value, error = cached
+            if error is None:
+                result[key] = value
+        return result
+
+    # Returns the cached (value, error) pair for the key, or None. Call with
+    # the lock held.
+    def take(self, key):
+        cached = self.entries.pop(key, None)
+        if cached is not None:
+            self.hits += 1
+            # Re-inserting moves the key to the most recently used end.
+            self.entries[key] = cached
+        else:
+            self.misses += 1
+        return cached
+
+    # Calculates the key's value and caches it. Returns a (value, error)
+    # pair. Called without the lock, so two threads may occasionally compute
+    # the same value, which is harmless.
+    def store(self, key, compute):
+        try:
+            cached = (compute(key), None)
+        except self.cached_errors as e:
+            cached = (None, e)
+        with self.lock:
+            if key not in self.entries and len(self.entries) >= self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            self.entries[key] = cached
+        return cached
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+
+    def statistics(self):
+        return {
+            'size': len(self.entries),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import re
+import sys
+
+import mmagic.core.cache as cache
+
+# Finds the CJK words in Decomposition and Measure Word fields.
+#
+# A word is a maximal run of CJK characters. tokenise returns each word as a
+# (start, end, word) span, so a field can be rewritten by splicing new text
+# in at the spans rather than by rebuilding it from a format string, which
+# would trip over any '%' in the field.
+#
+# Fields are tokenised in a single scan and the spans are cached by field
+# content. The same components turn up in field after field, so most
+# lookups are hits.
+
+# CJK radicals supplement and Kangxi radicals, CJK strokes, extension A,
+# unified ideographs and compatibility ideographs. Components are sometimes
+# radicals or strokes rather than characters.
+_BMP_RANGES = u'⺀-⿟㇀-㇯㐀-䶿一-鿿豈-﫿'
+
+if sys.maxunicode > 0xFFFF:
+    # Extensions B onwards and the compatibility supplement.
+    _PATTERN = u'[%s\U00020000-\U0002fa1f]+'%_BMP_RANGES
+else:
+    # On narrow builds characters outside the BMP are surrogate pairs.
+    _PATTERN = u'(?:[%s]|[\ud840-\ud87e][\udc00-\udfff])+'%_BMP_RANGES
+
+_WORD = re.compile(_PATTERN)
+
+_spans = cache.LRUCache()
+
+def _scan(text):
+    return tuple((m.start(), m.end(), m.group()) for m in _WORD.finditer(text))
+
+# Returns a tuple of (start, end, word) spans, one per word, in order.
+def tokenise(text):
+    return _spans.get(text, _scan)
+
+def get_words(text):
+    return [word for start, end, word in tokenise(text)]
+
+# Like get_words, but bypasses the cache. For bulk reads that see each field
+# once, where caching would only push out the fields that do repeat.
+def scan_words(text):
+    return _WORD.findall(text)
+
+# Returns the text with each word replaced by replace(word). 'spans' must
+# come from tokenise(text).
+def splice(text, spans, replace):
+    if not spans:
+        return text
+    parts = []
+    position = 0
+    for start, end, word in spans:
+        parts.append(text[position:start])
+        parts.append(replace(word))
+        position = end
+    parts.append(text[position:])
+    return u''.join(parts)
+
+def statistics():
+    return _spans.statistics()
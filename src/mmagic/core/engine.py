@@ -0,0 +1,623 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import operator
+import threading
+import time
+
+import anki.notes
+import mmagic.core.cjk as cjk
+import mmagic.core.exception as exception
+import mmagic.core.graph as graph
+import mmagic.core.index as index
+import mmagic.core.lookup as lookup
+import mmagic.core.note_cache as note_cache
+import mmagic.core.populate as populate
+import mmagic.core.profiler as profiler
+import mmagic.core.session as session
+import zhonglib as zl
+from mmagic.core.fields import MANDARIN_FIELDS, DECOMPOSITION_FIELDS, MEASURE_WORD_FIELDS
+from mmagic.core.formatting import add_missing_note_highlight
+from mmagic.core.notes import get_mandarin_text, set_mandarin_field,\
+        has_measure_word_field, set_measure_word_field,\
+        has_decomposition_field, set_decomposition_field,\
+        find_note_ids_for_word, note_exists_for_mandarin,\
+        get_decomposition_list, get_measure_word_list, extract_referenced_words,\
+        get_referenced_words, get_field_spans
+
+# The add-on's core logic: populating notes from the dictionary, working out
+# dependencies between notes and adding missing ones. None of it depends on
+# the Anki GUI, so it can be driven from the add-on or from the command line.
+#
+# The collection only needs to provide the following subset of the
+# anki.collection.Collection interface:
+#
+#   getNote(id)         returns an anki.notes.Note
+#   addNote(note)       flushes a new note and returns the number of cards
+#   models.all()        the note types
+#   decks.id(name)      the id of a deck
+#   tags.bulkAdd(ids, tags)
+#   tags.bulkRem(ids, tags)
+#   db.execute(sql)     used to build the word indexes in one pass
+#   db.first(sql)       used to check that the word indexes are current
+#   db.executemany(sql, rows)
+#                       used to reposition new cards in one write
+#   usn()               the update sequence number for changed cards
+#   save()              commits the current transaction
+#
+# Whoever owns the collection must call note_flushed() after a note is
+# flushed and notes_removed() after notes are deleted so that the indexes
+# stay up to date. Changes made any other way, e.g. by Anki's importers,
+# are picked up at the start of the next operation, when indexes that may
+# have missed them are rebuilt. See check_indexes.
+#
+# Tagging notes also changes them behind the indexes' back, so the engine
+# marks the indexes current after it tags notes itself.
+#
+# Bulk actions open a BatchSession (see mmagic.core.session) with
+# begin_session and close it with end_session. While it is open, note
+# flushes, new notes and tags are queued and written together at the end.
+# Write through flush_note, add_tags, remove_tags and add_mandarin_note
+# rather than the collection so that this works.
+#
+# Actions are bracketed by begin_operation and end_operation. In between,
+# notes that are only read are loaded in bulk and cached; see
+# mmagic.core.note_cache. Use get_note_view for notes that are only read
+# and get_note for notes that are changed.
+#
+# The engine's Profiler counts note loads, flushes and word lookups and
+# times the stages of populating a note. See profiler_report.
+
+class Engine:
+
+    def __init__(self, collection=None):
+        self.collection = collection
+        # Loading the dictionary takes a few seconds. It is done on first
+        # use. Use get_lookup() rather than accessing this directly.
+        self.lookup = None
+        self.dictionary_lock = threading.Lock()
+        self.word_index = None
+        self.reference_index = None
+        # Words whose notes have been added or removed since the status
+        # colours of the notes that refer to them were last refreshed.
+        self.recolour_words = set()
+        # Stage name -> seconds taken. Used to keep an eye on startup time.
+        self.startup_times = {}
+        # The open BatchSession, if any.
+        self.session = None
+        # The NoteCache of the current operation, if any.
+        self.note_cache = None
+        # Number of begin_operation calls not yet matched by end_operation.
+        self.operation_depth = 0
+        self.profiler = profiler.Profiler()
+
+    def get_collection(self):
+        return self.collection
+
+    def get_note(self, note_id):
+        if self.session is not None:
+            note = self.session.get_note(note_id)
+            if note is not None:
+                return note
+        self.profiler.count('getNote')
+        return self.get_collection().getNote(note_id)
+
+    # Returns a read-only view of the note. Within an operation the view
+    # comes from the note cache. Don't change or flush it.
+    def get_note_view(self, note_id):
+        if self.session is not None:
+            note = self.session.get_note(note_id)
+            if note is not None:
+                return note
+        if self.note_cache is not None:
+            return self.note_cache.get(note_id)
+        self.profiler.count('getNote')
+        return self.get_collection().getNote(note_id)
+
+    # Starts an operation. The given notes are loaded in bulk straight away.
+    # Operations nest. A nested operation shares the cache of the one it is
+    # part of.
+    def begin_operation(self, note_ids=()):
+        if self.operation_depth == 0:
+            self.check_indexes()
+            self.note_cache = note_cache.NoteCache(self.get_collection())
+        self.operation_depth += 1
+        self.prefetch_notes(note_ids)
+
+    def end_operation(self):
+        self.operation_depth -= 1
+        if self.operation_depth == 0:
+            self.profiler.count('note cache queries', self.note_cache.queries)
+            self.note_cache = None
+
+    # Loads the given notes in bulk if an operation is under way.
+    def prefetch_notes(self, note_ids):
+        if self.note_cache is not None:
+            self.note_cache.prefetch(note_ids)
+
+    # Any session that is still open is abandoned along with its changes.
+    def begin_session(self, dry_run=False):
+        self.session = session.BatchSession(self.get_collection(), dry_run)
+        return self.session
+
+    # Commits the open session and closes it. Returns an ErrorCollector
+    # holding any problems.
+    def end_session(self):
+        current = self.session
+        self.session = None
+        with self.profiler.timed('commit session'):
+            errors = current.commit()
+        self.mark_indexes_current()
+        return errors
+
+    def flush_note(self, note):
+        if self.session is not None:
+            self.session.update_note(note)
+        else:
+            note.flush()
+
+    def add_tags(self, note_ids, tag):
+        if self.session is not None:
+            self.session.add_tags(note_ids, tag)
+        else:
+            self.get_collection().tags.bulkAdd(note_ids, tag)
+            self.mark_indexes_current()
+
+    def remove_tags(self, note_ids, tag):
+        if self.session is not None:
+            self.session.remove_tags(note_ids, tag)
+        else:
+            self.get_collection().tags.bulkRem(note_ids, tag)
+            self.mark_indexes_current()
+
+    def get_lookup(self):
+        if self.lookup is None:
+            self.load_dictionary()
+        return self.lookup
+
+    # Safe to call from any thread. If the dictionary is already being
+    # loaded on another thread, this waits for it to finish.
+    def load_dictionary(self):
+        with self.dictionary_lock:
+            if self.lookup is not None:
+                return
+            start = time.time()
+            # Assigned last because get_lookup() checks it without the lock.
+            self.lookup = lookup.open_lookup()
+            self.record_startup_time('dictionary', time.time() - start)
+
+    def record_startup_time(self, stage, seconds):
+        self.startup_times[stage] = seconds
+        profiler.logger.info('%s took %.3fs', stage, seconds)
+
+    # Returns the profiler's report along with the startup times and the
+    # statistics of the lookup caches. See mmagic.core.profiler.
+    def profiler_report(self):
+        extra = {'startup': dict(self.startup_times)}
+        if self.lookup is not None:
+            extra['lookups'] = self.lookup.statistics()
+        return self.profiler.report(extra)
+
+    # The indexes are built once per collection, i.e. once per profile. They
+    # are kept up to date by the note_flushed and notes_removed hooks.
+    def get_word_index(self):
+        collection = self.get_collection()
+        if self.word_index is None or self.word_index.collection is not collection:
+            self.word_index = index.WordIndex(collection, MANDARIN_FIELDS)
+        return self.word_index
+
+    # Maps a word to the notes that refer to it in their Decomposition or
+    # Measure Word fields, i.e. the notes whose status colour depends on
+    # whether the word has a note.
+    def get_reference_index(self):
+        collection = self.get_collection()
+        if self.reference_index is None or self.reference_index.collection is not collection:
+            self.reference_index = index.ReferenceIndex(
+                collection,
+                DECOMPOSITION_FIELDS | MEASURE_WORD_FIELDS,
+                extract_referenced_words)
+        return self.reference_index
+
+    def invalidate_word_index(self):
+        self.word_index = None
+        self.reference_index = None
+        self.recolour_words = set()
+
+    # Throws away the indexes that may have missed changes made without
+    # note_flushed or notes_removed being called. They are rebuilt on their
+    # next lookup. See mmagic.core.index.
+    def check_indexes(self):
+        for field_index in (self.word_index, self.reference_index):
+            if field_index is not None and field_index.collection is self.get_collection()\
+                    and not field_index.is_current():
+                profiler.logger.info('collection changed, rebuilding the %s',
+                        field_index.__class__.__name__)
+                field_index.invalidate()
+
+    # Call after the engine's own writes. Everything written since the last
+    # check went through the hooks, so the indexes are up to date.
+    def mark_indexes_current(self):
+        for field_index in (self.word_index, self.reference_index):
+            if field_index is not None and field_index.collection is self.get_collection():
+                field_index.mark_current()
+
+    def note_flushed(self, note):
+        self.profiler.count('flush')
+        if self.note_cache is not None and note.col is self.note_cache.collection:
+            self.note_cache.discard(note.id)
+        if self.word_index is not None and note.col is self.word_index.collection:
+            self.schedule_recolour(self.word_index.update_note(note))
+        if self.reference_index is not None and note.col is self.reference_index.collection:
+            self.reference_index.update_note(note)
+
+    def notes_removed(self, collection, note_ids):
+        if self.note_cache is not None and collection is self.note_cache.collection:
+            for note_id in note_ids:
+                self.note_cache.discard(note_id)
+        if self.word_index is not None and collection is self.word_index.collection:
+            self.schedule_recolour(self.word_index.remove_notes(note_ids))
+        if self.reference_index is not None and collection is self.reference_index.collection:
+            self.reference_index.remove_notes(note_ids)
+
+    # The given words have gained their first note or lost their last one.
+    # The notes that refer to them need recolouring. They are queued here so
+    # that adding a batch of notes leads to one batch of recolouring rather
+    # than one per note. Call recolour_dependents() to process the queue.
+    def schedule_recolour(self, words):
+        self.recolour_words.update(words)
+
+    # Returns the number of notes whose colouring changed.
+    #
+    # The changed notes are written together. If a session is open, they
+    # are queued in it. Otherwise a session is opened for them and
+    # committed once they have all been recoloured.
+    def recolour_dependents(self):
+        words = self.recolour_words
+        self.recolour_words = set()
+        if not words or self.get_collection() is None:
+            return 0
+        reference_index = self.get_reference_index()
+        note_ids = set()
+        for word in words:
+            note_ids.update(reference_index.find(word))
+        updated = 0
+        own_session = self.session is None
+        if own_session:
+            self.begin_session()
+        with self.profiler.timed('recolour dependents'):
+            try:
+                for note_id in sorted(note_ids):
+                    if self.recolour_note(note_id):
+                        updated += 1
+            finally:
+                if own_session:
+                    errors = self.end_session()
+        if own_session and len(errors) > 0:
+            profiler.logger.warning('recolouring dependents: %s', errors)
+        return updated
+
+    # Refreshes the status colour of a note. The note is only flushed if its
+    # colouring actually changed. Returns True if it did.
+    def recolour_note(self, note_id):
+        note = self.get_note(note_id)
+        old_fields = list(note.fields)
+        try:
+            self.refresh_status_colour(note)
+        except exception.MagicException:
+            # The note type isn't set up properly. Populating the note will
+            # report this.
+            return False
+        if note.fields == old_fields:
+            return False
+        self.flush_note(note)
+        return True
+
+    # Returns a pair: (result, errors). The result holds the given notes and
+    # every note they depend on, directly or indirectly, each listed once.
+    #
+    # Notes reached from more than one of the given notes, or along more than
+    # one path, are only visited once. Likewise, a problem with a dependency
+    # is only reported once no matter how many notes refer to it.
+    #
+    # To share this across several calls, pass in the same 'visited' and
+    # 'reported_words' sets each time.
+    def get_transitive_dependencies(self, note_ids, visited=None, reported_words=None):
+        word_index = self.get_word_index()
+        errors = exception.ErrorCollector()
+        if reported_words is None:
+            reported_words = set()
+
+        def get_dependency_ids(note_id):
+            note = self.get_note_view(note_id)
+            dependencies = get_decomposition_list(note)
+            if dependencies == None:
+                raise exception.EmptyComponents(get_mandarin_text(note))
+            result = []
+            for dependency in dependencies:
+                dependency_ids = find_note_ids_for_word(word_index, dependency)
+                if len(dependency_ids) == 1:
+                    result.append(dependency_ids[0])
+                    continue
+                if dependency in reported_words:
+                    continue
+                reported_words.add(dependency)
+                if len(dependency_ids) > 1:
+                    errors.append(exception.TooManyNotes(dependency))
+                else:
+                    errors.append(exception.MissingNote(dependency))
+            return result
+
+        all_notes, walk_errors = graph.walk(
+                note_ids, get_dependency_ids, visited, self.prefetch_notes)
+        errors.append(walk_errors)
+        return (all_notes, errors)
+
+    # Returns (result, errors pair) where result is a dictionary with
+    # the word as key and the note_id as value
+    def get_note_ids_for_words(self, words):
+        result = {}
+        errors = exception.ErrorCollector()
+        for word in words:
+            self.profiler.count('word index lookups')
+            note_ids = find_note_ids_for_word(self.get_word_index(), word)
+            if len(note_ids) > 1:
+                errors.append(exception.TooManyNotes(word))
+                continue
+            if len(note_ids) == 0:
+                errors.append(exception.MissingNote(word))
+                continue
+            result[word] = note_ids[0]
+        return (result, errors)
+
+    # Notes waiting to be added in the open session count too.
+    def word_has_notes(self, word):
+        if self.session is not None and self.session.has_added_note_for(word):
+            return True
+        self.profiler.count('word index lookups')
+        return note_exists_for_mandarin(self.get_word_index(), word)
+
+    def note_has_empty_dependencies(self, note_id):
+        return get_decomposition_list(self.get_note_view(note_id)) == None
+
+    def note_has_missing_dependencies(self, note_id):
+        result = False
+        dependencies = []
+        note = self.get_note_view(note_id)
+        if has_decomposition_field(note):
+            dependencies += get_referenced_words(note, DECOMPOSITION_FIELDS)
+        if has_measure_word_field(note):
+            dependencies += get_referenced_words(note, MEASURE_WORD_FIELDS)
+        notes_exist = map(lambda word: self.word_has_notes(word), dependencies)
+        all_exist = reduce(operator.and_, notes_exist, True)
+        result = not all_exist
+        return result
+
+    def add_status_colour_to_word(self, word):
+        if not self.word_has_notes(word):
+            word = add_missing_note_highlight(word)
+        return word
+
+    def refresh_status_colour(self, note):
+        if has_decomposition_field(note):
+            text, spans = get_field_spans(note, DECOMPOSITION_FIELDS)
+            set_decomposition_field(note, cjk.splice(text, spans, self.add_status_colour_to_word))
+        if has_measure_word_field(note):
+            text, spans = get_field_spans(note, MEASURE_WORD_FIELDS)
+            set_measure_word_field(note, cjk.splice(text, spans, self.add_status_colour_to_word))
+
+    # This function does not flush the note. 'flush' has to be called (either
+    # directly or indirectly) from the caller. See 'add_mandarin_note' for
+    # the only instance where it is called indirectly.
+    #
+    # Bulk operations that want to do the dictionary work elsewhere use the
+    # steps in mmagic.core.populate directly and finish with
+    # finish_populating_note.
+    def populate_note(self, note):
+        with self.profiler.timed('populate: read'):
+            request = populate.read_request(note)
+        with self.profiler.timed('populate: compute'):
+            updates, messages = populate.compute_updates(self.get_lookup(), request)
+        self.finish_populating_note(note, updates, messages)
+
+    # Writes the results of populate.compute_updates to the note and
+    # refreshes its status colour. Raises MagicException if the computation
+    # reported problems. Does not flush the note.
+    def finish_populating_note(self, note, updates, messages):
+        with self.profiler.timed('populate: apply'):
+            errors = populate.apply_updates(note, updates, messages)
+            self.refresh_status_colour(note)
+        errors.raise_if_not_empty()
+
+    # Returns a new note of the given type for the word. It is neither
+    # populated nor added. It goes in the Default deck unless 'deck_id' is
+    # given. Callers adding many notes look the deck up once.
+    def new_mandarin_note(self, model, text, deck_id=None):
+        if deck_id is None:
+            deck_id = self.get_collection().decks.id('Default')
+        model['did'] = deck_id
+        note = anki.notes.Note(self.get_collection(), model)
+        set_mandarin_field(note, text)
+        return note
+
+    # Adds a note made by new_mandarin_note to the collection, or to the
+    # open session. Raises MagicException if it produces no cards.
+    def add_new_note(self, note):
+        if self.session is not None:
+            # Added when the session is committed. Any problem with that is
+            # reported then.
+            self.session.add_note(note)
+            return
+        # The following will flush the note which is why we don't have to
+        # do it ourselves. In fact, we have to avoid it doing it ourselves
+        # because col.addNote() may fail if no cards are produced.  If this
+        # is the case, then the note must not be flushed because the database
+        # ends up with a note with no cards, which will not show up on the
+        # browser.  In that case, you don't even know that there's a dodgy
+        # note unless you dive directly into the database.
+        cards_added = self.get_collection().addNote(note)
+        if cards_added == 0:
+            raise exception.MagicException(
+                'No cards were added for "' + get_mandarin_text(note) + '". ' +
+                "Try adding manually for further clues."
+            )
+
+    def add_mandarin_note(self, model, text):
+        errors = exception.ErrorCollector()
+        note = self.new_mandarin_note(model, text)
+        try:
+            self.populate_note(note)
+        except exception.MagicException as e:
+            errors.append(e)
+        try:
+            self.add_new_note(note)
+        except exception.MagicException as e:
+            errors.append(e)
+        errors.raise_if_not_empty()
+        return note
+
+    # Returns a dependency graph for all transitive components of the given
+    # word.  If a note exists for a given word, its dependency information is
+    # used.  If not, the zhonglib  decomposition data is used.
+    #
+    # Cycles do not break this function because it only looks at each node
+    # once.  However, it won't tell you if there's a cycle. The graph produced
+    # here can be passed to graph.sort_levels, which reports cycles.
+    #
+    # Words in 'known', a graph built earlier, are not looked at again and
+    # are left out of the result. Pass the graph built so far to extend it
+    # without resolving the same words twice.
+
+    # Returns (graph, errors) pair
+    def build_dependency_graph(self, word, known=None):
+        if known is None:
+            known = {}
+        result = {}
+        queue = collections.deque([word])
+        # Words that have been queued. In a DAG the same word can be reached
+        # along more than one path, but it is only queued once.
+        queued = set(queue)
+
+        errors = exception.ErrorCollector()
+
+        # Do breadth-first traversal of dependency graph.
+        while queue:
+            word = queue.popleft()
+            if word in known:
+                continue
+            note_ids = find_note_ids_for_word(self.get_word_index(), word)
+            if len(note_ids) > 1:
+            # There is more than one note for this word
+                raise exception.TooManyNotes(word)
+            elif len(note_ids) == 1:
+            # There is exactly one note for this word.
+            # Extract its component list.
+                note = self.get_note_view(note_ids[0])
+                dependencies = get_decomposition_list(note)
+                if dependencies == None:
+                    raise exception.EmptyComponents(word)
+            else:
+            # There are no notes for this word. Use the decomposition data
+            # to find it dependencies.
+                try:
+                    dependencies = self.get_lookup().decompose(word, zl.TRADITIONAL)
+                except zl.ZhonglibException as e:
+                    dependencies = []
+                    errors.append(e)
+            result[word] = dependencies
+            for dependency in dependencies:
+                if dependency not in queued and dependency not in known:
+                    queued.add(dependency)
+                    queue.append(dependency)
+        return (result, errors)
+
+    # Adds the note's word, its measure words and everything they depend on
+    # to 'dependency_graph'. The measure words count as dependencies of the
+    # word. 'models' maps each word added to the graph to the note type of
+    # the note that first led to it. New notes for the word get that type.
+    #
+    # If the graph for the word or a measure word can't be built, none of it
+    # is added. The problem is raised once the rest has been added.
+    def add_to_dependency_graph(self, note, dependency_graph, models):
+        errors = exception.ErrorCollector()
+        word = get_mandarin_text(note)
+        measure_words = []
+        if has_measure_word_field(note):
+            measure_words = get_measure_word_list(note)
+
+        for root in [word] + measure_words:
+            try:
+                part, part_errors = self.build_dependency_graph(root, dependency_graph)
+            except exception.MagicException as e:
+                errors.append(e)
+                continue
+            # Even if there are errors, we continue with what we have. At
+            # least some of the notes will get created. That's better than
+            # doing nothing at all.
+            errors.append(part_errors)
+            for part_word in part:
+                models.setdefault(part_word, note.model())
+            dependency_graph.update(part)
+
+        if word in dependency_graph:
+            # Only measure words whose graph could be built.
+            extra = [w for w in measure_words
+                    if w in dependency_graph and w not in dependency_graph[word]]
+            if extra:
+                dependency_graph[word] = dependency_graph[word] + extra
+        errors.raise_if_not_empty()
+
+    # Returns a pair: (result, errors). The result holds the words in the
+    # graph that have no notes, each listed once and after the words it
+    # depends on. The words in 'exclude' are left out.
+    #
+    # Words caught up in a cycle, or depending on one, can't be ordered and
+    # are left out too. The cycles are reported in the errors, so callers
+    # can still add notes for the rest.
+    def get_missing_words(self, dependency_graph, exclude):
+        ordering = graph.sort_levels(dependency_graph)
+        exclude = set(exclude)
+        result = [word for word in ordering.order()
+                  if word not in exclude and not self.word_has_notes(word)]
+        return (result, ordering.get_errors())
+
+    # Builds one dependency graph for all the notes and then adds a note for
+    # every missing word in it, in dependency order. Each missing word gets
+    # exactly one note, however many of the given notes depend on it.
+    #
+    # No note is created for the words of the given notes themselves. If the
+    # '+' button is pressed from the 'Add Note' dialog, the note will not yet
+    # exist for that word. Creating it would make the 'Add Note' dialog
+    # detect a duplicate because the note has been added 'under its feet' so
+    # to speak.
+    def add_missing_dependencies_for_notes(self, notes):
+        errors = exception.ErrorCollector()
+        dependency_graph = {}
+        models = {}
+        words = []
+        for note in notes:
+            try:
+                words.append(get_mandarin_text(note))
+                self.add_to_dependency_graph(note, dependency_graph, models)
+            except exception.MagicException as e:
+                errors.append(e)
+
+        missing_words, missing_errors = self.get_missing_words(dependency_graph, words)
+        errors.append(missing_errors)
+
+        self.get_lookup().lookup_words(missing_words)
+        for word in missing_words:
+            try:
+                self.add_mandarin_note(models[word], word)
+            except exception.MagicException as e:
+                errors.append(e)
+
+        # Missing components (may) have been added. Have to update the colour
+        # of words in the text to reflect this.
+        for note in notes:
+            self.refresh_status_colour(note)
+            self.flush_note(note)
+
+        errors.raise_if_not_empty()
+
+    def add_missing_dependencies_for_note(self, note):
+        self.add_missing_dependencies_for_notes([note])
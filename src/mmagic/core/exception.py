@@ -1,46 +1,155 @@
+import collections
+
+# Problems are grouped into categories so that a bulk action over thousands
+# of notes can report how many of each kind it ran into rather than listing
+# every one.
+MISSING_NOTE = 'missing note'
+TOO_MANY_NOTES = 'too many notes'
+EMPTY_COMPONENTS = 'empty components'
+DICTIONARY_MISS = 'dictionary miss'
+CYCLE = 'dependency cycle'
+OTHER = 'other'
+
+# The order in which categories are reported.
+CATEGORIES = (MISSING_NOTE, TOO_MANY_NOTES, EMPTY_COMPONENTS, CYCLE, DICTIONARY_MISS, OTHER)
+
+# Maximum number of messages an ErrorCollector keeps per category. Any more
+# are counted but not kept.
+MAX_EXAMPLES = 200
 
 class MagicException(Exception):
 
+    category = OTHER
+
     def __init__(self, message):
+        super(MagicException, self).__init__(message)
         self.message = message
 
     def message(self):
         return self.message
 
     def __str__(self):
-        return message
+        return unicode(self.message).encode('utf-8')
 
     def get_message_list(self):
         return [self.message]
 
-class MultiException(MagicException):
+    # Returns a list of (category, message) pairs.
+    def get_problems(self):
+        return [(self.category, self.message)]
+
+class MissingNote(MagicException):
+
+    category = MISSING_NOTE
+
+    def __init__(self, word):
+        super(MissingNote, self).__init__('No note for "%s"'%word)
+
+class TooManyNotes(MagicException):
+
+    category = TOO_MANY_NOTES
+
+    def __init__(self, word):
+        super(TooManyNotes, self).__init__('More than one note for "%s"'%word)
+
+class EmptyComponents(MagicException):
+
+    category = EMPTY_COMPONENTS
+
+    def __init__(self, word):
+        super(EmptyComponents, self).__init__('"%s" has missing component list'%word)
+
+# Collects the problems found by an action. Appending another collector
+# merges its problems in, so collectors never nest, however the action is
+# broken up.
+#
+# A problem that has already been collected is ignored. Each category keeps
+# the first max_examples distinct messages; the rest are only counted. To
+# keep memory bounded, the messages that weren't kept are remembered by hash
+# only, so two different messages may very occasionally be counted as one.
+class ErrorCollector(MagicException):
 
-    def __init__(self):
-        self.exceptions = []
+    def __init__(self, max_examples=MAX_EXAMPLES):
+        super(ErrorCollector, self).__init__(u'')
+        self.max_examples = max_examples
+        # category -> hashes of the distinct messages seen
+        self.seen = collections.defaultdict(set)
+        # category -> the first max_examples distinct messages
+        self.examples = collections.defaultdict(list)
 
+    # The number of distinct problems.
     def __len__(self):
-        return len(self.exceptions)
+        return sum(len(hashes) for hashes in self.seen.itervalues())
 
     def __str__(self):
-        return str(self.get_message_list())
+        return u'; '.join(self.summary()).encode('utf-8')
+
+    # The problems change as they are collected, so args is worked out when
+    # it is asked for rather than fixed when the collector is made.
+    @property
+    def args(self):
+        return (u'; '.join(self.summary()),)
 
-    def append(self, exception):
-        if isinstance(exception, MagicException):
-            self.exceptions.append(exception)
+    def append(self, error):
+        if isinstance(error, ErrorCollector):
+            self.merge(error)
+        elif isinstance(error, MagicException):
+            self.add(error.category, error.message)
         else:
-            self.exceptions.append(MagicException(unicode(exception)))
+            self.add(OTHER, unicode(error))
+
+    # Returns True if the problem hadn't been collected before.
+    def add(self, category, message):
+        hashes = self.seen[category]
+        key = hash(message)
+        if key in hashes:
+            return False
+        hashes.add(key)
+        examples = self.examples[category]
+        if len(examples) < self.max_examples:
+            examples.append(message)
+        return True
+
+    def merge(self, other):
+        for category, messages in other.examples.iteritems():
+            for message in messages:
+                self.add(category, message)
+        # Problems the other collector only counted.
+        for category, hashes in other.seen.iteritems():
+            self.seen[category].update(hashes)
 
+    # The number of distinct problems in the category.
+    def count(self, category):
+        return len(self.seen.get(category, ()))
+
+    # The categories that have problems, in reporting order.
+    def categories(self):
+        present = [c for c in self.seen if self.seen[c]]
+        return [c for c in CATEGORIES if c in present] +\
+               sorted(c for c in present if c not in CATEGORIES)
+
+    # Returns the messages that were kept, by category.
     def get_message_list(self):
         result = []
-        for ex in self.exceptions:
-            result += ex.get_message_list()
+        for category in self.categories():
+            result.extend(self.examples[category])
         return result
 
+    def get_problems(self):
+        result = []
+        for category in self.categories():
+            result.extend((category, message) for message in self.examples[category])
+        return result
+
+    # Returns one line per category, e.g. '12 missing note'.
+    def summary(self):
+        return [u'%d %s'%(self.count(category), category) for category in self.categories()]
+
+    # The number of problems that were counted but whose messages weren't
+    # kept.
+    def omitted(self):
+        return len(self) - sum(len(messages) for messages in self.examples.itervalues())
+
     def raise_if_not_empty(self):
         if len(self) > 0:
             raise self
-
-class TooManyNotes(MagicException):
-
-    def __init__(self, word):
-        super(TooManyNotes, self).__init__('More than one note for "%s"'%word)
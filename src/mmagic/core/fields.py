@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import mmagic.core.exception as exception
+
+MANDARIN_FIELDS=frozenset({'Front', u'漢字', 'Hanzi', 'Chinese', 'Mandarin', 'Radical'})
+ENGLISH_FIELDS=frozenset({'Back', 'English', 'Meaning'})
+PINYIN_FIELDS=frozenset({u'拼音', u'pīnyīn', u'Pīnyīn', 'Pinyin', 'Pronunciation'})
+DECOMPOSITION_FIELDS=frozenset({'Decomposition'})
+MEASURE_WORD_FIELDS=frozenset({'Measure Word', 'Measure Words', 'Classifier', 'Classifiers', u'量詞'})
+
+# The logical roles a field can play. Each role is identified by its set of
+# possible field names.
+ROLES=(MANDARIN_FIELDS, ENGLISH_FIELDS, PINYIN_FIELDS, DECOMPOSITION_FIELDS, MEASURE_WORD_FIELDS)
+
+#------------------------------------------------------------------------------
+#
+
+# From a set of possible field names, this function returns the actual field
+# used in a note type with the given field names.
+#
+# MagicException is thrown if there is no matching field or there is more than
+# one match.
+def calculate_field_name(note_type, field_names, possible_fields):
+    # Have to make this is a mutable set. Hence the explicit construction.
+    candidates = set(possible_fields & set(field_names))
+    if len(candidates) > 1:
+        message ='Note type "' + note_type + '" has the following fields: '
+        message += '"%s"'%candidates.pop()
+        while len(candidates) > 0:
+            message += ', "%s"'%candidates.pop()
+        message += '. It should have at most one of them.'
+        raise exception.MagicException(message)
+    if len(candidates) == 0:
+        message = 'Note type "' + note_type + '" does not have any of the following fields: '
+        field_set = set(possible_fields)
+        message += '"%s"'%field_set.pop()
+        while len(field_set) > 0:
+            message += ', "%s"'%field_set.pop()
+        message += '. It should have one of them.'
+        raise exception.MagicException(message)
+    return candidates.pop()
+
+#------------------------------------------------------------------------------
+# Field resolution
+
+# The result of resolving a role against a note type. If the role could not
+# be resolved, 'error' holds the MagicException to raise and 'name' and
+# 'ordinal' are None.
+class Resolution:
+
+    def __init__(self, name, ordinal, error, has_candidates):
+        self.name = name
+        self.ordinal = ordinal
+        self.error = error
+        self.has_candidates = has_candidates
+
+# Maps each role to a field of a note type. Every note of a given note type
+# resolves its fields in the same way, so this is worked out once per note
+# type rather than once per field access.
+class FieldMap:
+
+    def __init__(self, model):
+        self.model_id = model['id']
+        self.modified = model['mod']
+        self.note_type = model['name']
+        self.ordinals = dict((f['name'], f['ord']) for f in model['flds'])
+        self.resolutions = {}
+        for role in ROLES:
+            self.resolve(role)
+
+    def resolve(self, possible_fields):
+        result = self.resolutions.get(possible_fields)
+        if result is None:
+            has_candidates = len(possible_fields & set(self.ordinals)) > 0
+            try:
+                name = calculate_field_name(self.note_type, self.ordinals, possible_fields)
+                result = Resolution(name, self.ordinals[name], None, has_candidates)
+            except exception.MagicException as e:
+                result = Resolution(None, None, e, has_candidates)
+            self.resolutions[possible_fields] = result
+        return result
+
+# model id -> FieldMap
+_field_maps = {}
+
+# Returns the FieldMap for the note type of the given note. A cached map is
+# reused as long as the note type has not been modified since it was built.
+def get_field_map(note):
+    model = note.model()
+    result = _field_maps.get(model['id'])
+    if result is None or result.modified != model['mod']:
+        result = FieldMap(model)
+        _field_maps[model['id']] = result
+    return result
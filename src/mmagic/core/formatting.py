@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import zhonglib as zl
+
+#------------------------------------------------------------------------------
+# Formatting routines
+
+def format_list(the_list):
+    if len(the_list) == 0:
+        return ''
+    result = ''
+    assert len(the_list) > 0
+    result += the_list[0]
+    for idx in xrange(1, len(the_list)):
+        result += ', ' + the_list[idx]
+    return result
+
+def format_entry_english(entry):
+    result = entry.english[0]
+    for idx in xrange(1, len(entry.english)):
+        result += "; "
+        result += entry.english[idx]
+    return result
+
+def format_english(dictionary_entries):
+    if len(dictionary_entries) == 1:
+        result = format_entry_english(dictionary_entries[0])
+    else:
+        # Each entry is put on a separate line with an integer identifier.
+        result = '[1] ' + format_entry_english(dictionary_entries[0])
+        for idx in xrange(1, len(dictionary_entries)):
+            id = idx+1
+            result += '<br>['+str(id)+'] ' + format_entry_english(dictionary_entries[idx])
+    return result
+
+def format_pinyin(text):
+    return zl.format_pinyin_sequence(zl.parse_cedict_pinyin(text))
+
+def format_pinyin_list(dictionary_entries):
+    if len(dictionary_entries) == 1:
+        result = format_pinyin(dictionary_entries[0].pinyin)
+    else:
+        # Each goes on a separate line with an integer identifier that matches
+        # that in English field.
+        result = '[1] ' + format_pinyin(dictionary_entries[0].pinyin)
+        for idx in xrange(1, len(dictionary_entries)):
+            id = idx+1
+            result += '<br>['+str(id)+'] ' + format_pinyin(dictionary_entries[idx].pinyin)
+    return result
+
+def format_entry_measure_words(is_first, ordinal, dictionary_entry):
+    measure_words = dictionary_entry.traditional_measure_words
+    if len(measure_words) == 0:
+        return ''
+    result = ''
+    if not is_first:
+        result += '<br>'
+    result += '[' + str(ordinal) + '] ' + format_list(measure_words)
+    return result
+
+def format_measure_words(dictionary_entries):
+    if len(dictionary_entries) == 1:
+        result = format_list(dictionary_entries[0].traditional_measure_words)
+    else:
+        # Each goes on a separate line with an integer identifier that matches
+        # that in English field.
+        result = ''
+        is_first = True
+        for idx in xrange(0, len(dictionary_entries)):
+            formatted_measure_words = format_entry_measure_words(\
+                is_first,\
+                idx+1,\
+                dictionary_entries[idx]
+            )
+            result += formatted_measure_words
+            is_first = len(formatted_measure_words) == 0
+    return result
+
+def add_highlight(text, colour):
+    return '<font color='+colour+'>'+text +'</font>'
+
+def add_missing_note_highlight(text):
+    return add_highlight(text, 'red')
+
+def format_decomposition(decomposition):
+    if len(decomposition) == 0:
+        return 'None'
+    return format_list(decomposition)
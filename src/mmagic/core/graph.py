@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+import mmagic.core.exception as exception
+
+# Graph traversal and sorting routines. The traversals don't need the graph
+# to be held explicitly. Instead, the caller supplies a function that
+# returns the successors of a node. This allows the graph to be discovered
+# as it is walked. The sorts take a dependency graph held in a dictionary.
+#
+# Everything is iterative so nothing is limited by the recursion depth.
+
+# Returns (nodes, errors) where nodes holds every node reachable from the
+# given roots, including the roots themselves. Each node is listed once,
+# in the order in which it is first reached.
+#
+# 'get_successors' is called once per node. If it raises MagicException,
+# the exception is added to errors and the node is treated as having no
+# successors.
+#
+# If 'visited' is given, nodes in it are skipped and the nodes reached are
+# added to it. Passing the same set to several walks means that shared
+# parts of the graph are only walked once.
+#
+# If 'prefetch' is given, it is called with lists of nodes before
+# get_successors is called for any of them, so that whatever get_successors
+# needs can be loaded in bulk. The graph is then discovered a level at a
+# time, so prefetch is called once per level rather than once per node. The
+# result is the same either way.
+def walk(roots, get_successors, visited=None, prefetch=None):
+    if visited is None:
+        visited = set()
+    errors = exception.ErrorCollector()
+    if prefetch is None:
+        lookup = get_successors
+    else:
+        known = discover(roots, get_successors, visited, prefetch, errors)
+        def lookup(node):
+            return known[node]
+    result = []
+    # Reverse so that the roots are visited in the order given.
+    stack = list(roots)
+    stack.reverse()
+    while stack:
+        node = stack.pop()
+        if node in visited:
+            # This is not necessarily a cycle. In a DAG the same node can be
+            # reached along more than one path.
+            continue
+        visited.add(node)
+        result.append(node)
+        try:
+            successors = lookup(node)
+        except exception.MagicException as e:
+            errors.append(e)
+            continue
+        for successor in reversed(successors):
+            if successor not in visited:
+                stack.append(successor)
+    return (result, errors)
+
+# Calls get_successors for every node reachable from the roots that isn't in
+# 'visited', a level at a time, calling prefetch for each level first.
+# Returns a dictionary from node to successors. Nodes whose get_successors
+# failed have no successors and their errors are added to 'errors'.
+def discover(roots, get_successors, visited, prefetch, errors):
+    result = {}
+    level = [node for node in roots if node not in visited]
+    while level:
+        # A node can be reached from the level it is on.
+        level = [node for node in unique(level) if node not in result]
+        if not level:
+            break
+        prefetch(level)
+        next_level = []
+        for node in level:
+            try:
+                result[node] = get_successors(node)
+            except exception.MagicException as e:
+                errors.append(e)
+                result[node] = []
+                continue
+            for successor in result[node]:
+                if successor not in visited and successor not in result:
+                    next_level.append(successor)
+        level = next_level
+    return result
+
+# Returns the items of the list in order with duplicates removed.
+def unique(items):
+    seen = set()
+    result = []
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            result.append(item)
+    return result
+
+# Returns the cycles in the graph reachable from the given nodes as a list
+# of strongly connected components, each a list of nodes. Only components
+# that really are cycles are returned: those with more than one node and
+# single nodes that are their own successor.
+#
+# This is Tarjan's algorithm, made iterative. 'get_successors' is called
+# once per node, plus once more for each single-node component.
+def find_cycles(nodes, get_successors):
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    result = []
+
+    def visit(node):
+        index[node] = lowlink[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        work.append((node, iter(get_successors(node))))
+
+    for root in nodes:
+        if root in index:
+            continue
+        work = []
+        visit(root)
+        while work:
+            node, successors = work[-1]
+            descended = False
+            for successor in successors:
+                if successor not in index:
+                    visit(successor)
+                    descended = True
+                    break
+                if successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            if descended:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+            if lowlink[node] != index[node]:
+                continue
+            component = []
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component.append(member)
+                if member == node:
+                    break
+            if len(component) > 1 or node in get_successors(node):
+                component.reverse()
+                result.append(component)
+    return result
+
+# Returns a shortest list of nodes [a, b, ..., a] that leads from the first
+# node of the component back to itself. 'component' is one of the lists
+# returned by find_cycles.
+def find_cycle_path(component, get_successors):
+    start = component[0]
+    members = set(component)
+    # node -> the node it was reached from
+    parents = {}
+    level = [start]
+    while level:
+        next_level = []
+        for node in level:
+            for successor in get_successors(node):
+                if successor == start:
+                    path = [node]
+                    while path[-1] != start:
+                        path.append(parents[path[-1]])
+                    path.reverse()
+                    return path + [start]
+                if successor in members and successor not in parents:
+                    parents[successor] = node
+                    next_level.append(successor)
+        level = next_level
+    # Not reached for a component from find_cycles.
+    return list(component)
+
+def format_cycle(path):
+    return u' → '.join(path)
+
+#------------------------------------------------------------------------------
+# Topological sorting
+#
+# A dependency graph maps each node to the list of nodes it depends on.
+# Nodes that only appear as dependencies count as nodes without
+# dependencies of their own.
+
+# The outcome of sort_levels.
+class Ordering:
+
+    def __init__(self, levels, cycles, blocked):
+        # Level 0 holds the nodes without dependencies. Every node in level n
+        # depends only on nodes in levels before n, so the nodes of a level
+        # don't depend on each other.
+        self.levels = levels
+        # Paths [a, b, ..., a], one for each set of nodes that depend on
+        # each other. See find_cycle_path.
+        self.cycles = cycles
+        # Nodes that aren't in a cycle but depend on one, directly or
+        # indirectly. Neither they nor the nodes in cycles are in a level.
+        self.blocked = blocked
+
+    # Returns every node in a level, dependencies first.
+    def order(self):
+        result = []
+        for level in self.levels:
+            result.extend(level)
+        return result
+
+    # Returns an ErrorCollector with a problem for each cycle.
+    def get_errors(self):
+        errors = exception.ErrorCollector()
+        for path in self.cycles:
+            errors.add(exception.CYCLE, u'Components depend on each other: %s'%format_cycle(path))
+        return errors
+
+# Sorts the graph with Kahn's algorithm, a level at a time. Within a level,
+# nodes are sorted by 'key' (the nodes themselves by default), so the
+# result doesn't depend on dictionary order. The nodes that can't be sorted
+# because of cycles are reported rather than raised. Runs in time linear in
+# the size of the graph, without recursion.
+def sort_levels(dependency_graph, key=None):
+    # node -> the nodes that depend on it
+    dependents = {}
+    # node -> number of its dependencies that aren't in a level yet
+    remaining = {}
+    for node, dependencies in dependency_graph.iteritems():
+        dependencies = set(dependencies)
+        remaining[node] = len(dependencies)
+        for dependency in dependencies:
+            dependents.setdefault(dependency, []).append(node)
+            remaining.setdefault(dependency, 0)
+
+    levels = []
+    level = sorted((node for node, count in remaining.iteritems() if count == 0), key=key)
+    while level:
+        levels.append(level)
+        next_level = []
+        for node in level:
+            for dependent in dependents.get(node, ()):
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    next_level.append(dependent)
+        level = sorted(next_level, key=key)
+
+    unsorted = sorted((node for node, count in remaining.iteritems() if count > 0), key=key)
+    if not unsorted:
+        return Ordering(levels, [], [])
+
+    def get_unsorted_dependencies(node):
+        return [d for d in dependency_graph.get(node, ()) if remaining[d] > 0]
+
+    components = find_cycles(unsorted, get_unsorted_dependencies)
+    in_cycles = set()
+    cycles = []
+    for component in components:
+        in_cycles.update(component)
+        component.sort(key=key)
+        cycles.append(find_cycle_path(component, get_unsorted_dependencies))
+    blocked = [node for node in unsorted if node not in in_cycles]
+    return Ordering(levels, cycles, blocked)
+
+# Returns the nodes of the graph, dependencies first. Raises an
+# ErrorCollector describing the cycles if there are any.
+def topological_sort(dependency_graph, key=None):
+    ordering = sort_levels(dependency_graph, key)
+    ordering.get_errors().raise_if_not_empty()
+    return ordering.order()
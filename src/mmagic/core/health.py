@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import mmagic.core.exception as exception
+import mmagic.core.graph as graph
+from mmagic.core.notes import get_mandarin_text, has_decomposition_field,\
+        get_decomposition_list
+
+# A consistency check of the whole collection in one pass.
+#
+# Duplicated headwords and missing components and measure words come
+# straight from the engine's word and reference indexes, which are each
+# built with a single query. Only the component lists need the notes
+# themselves. Those are loaded in bulk, once each, and turned into an
+# in-memory component graph whose cycles are found as strongly connected
+# components.
+#
+#   scan = HealthScan(engine)
+#   for note_id in scan.note_ids():
+#       scan.add_note(note_id)
+#   report = scan.finish()
+#
+# Call it within an engine operation so that the notes are loaded in bulk.
+
+class HealthReport:
+
+    def __init__(self):
+        self.note_count = 0
+        self.seconds = 0.0
+        # Ids of the notes whose component list is empty.
+        self.empty_components = []
+        # word -> ids of the notes that refer to it
+        self.missing = {}
+        # word -> ids of its notes
+        self.duplicates = {}
+        # Lists of words that depend on each other.
+        self.cycles = []
+        # word -> ids of its notes, for the words in cycles
+        self.cycle_note_ids = {}
+        # One problem per empty list, missing word, duplicate and cycle.
+        self.errors = exception.ErrorCollector()
+
+    # Returns the ids of all the notes involved in a problem.
+    def offenders(self):
+        result = set(self.empty_components)
+        for note_ids in self.missing.itervalues():
+            result.update(note_ids)
+        for note_ids in self.duplicates.itervalues():
+            result.update(note_ids)
+        for note_ids in self.cycle_note_ids.itervalues():
+            result.update(note_ids)
+        return sorted(result)
+
+    def summary(self):
+        return [
+            '%d notes checked in %.1fs'%(self.note_count, self.seconds),
+            '%d notes with an empty component list'%len(self.empty_components),
+            '%d words referred to without a note'%len(self.missing),
+            '%d words with more than one note'%len(self.duplicates),
+            '%d dependency cycles'%len(self.cycles),
+        ]
+
+class HealthScan:
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.start = time.time()
+        self.report = HealthReport()
+        self.word_index = engine.get_word_index()
+        # word -> the words in its component list that have notes
+        self.dependency_graph = {}
+
+    # The notes to pass to add_note.
+    def note_ids(self):
+        return sorted(self.word_index.note_ids())
+
+    # Raises MagicException if the note can't be read.
+    def add_note(self, note_id):
+        self.report.note_count += 1
+        note = self.engine.get_note_view(note_id)
+        if not has_decomposition_field(note):
+            return
+        dependencies = get_decomposition_list(note)
+        if dependencies is None:
+            self.report.empty_components.append(note_id)
+            self.report.errors.append(exception.EmptyComponents(get_mandarin_text(note)))
+            return
+        successors = self.dependency_graph.setdefault(get_mandarin_text(note), [])
+        for dependency in dependencies:
+            if self.word_index.contains(dependency) and dependency not in successors:
+                successors.append(dependency)
+
+    def finish(self):
+        report = self.report
+        for word, note_ids in self.word_index.words.iteritems():
+            if len(note_ids) > 1:
+                report.duplicates[word] = sorted(note_ids)
+                report.errors.append(exception.TooManyNotes(word))
+
+        reference_index = self.engine.get_reference_index()
+        reference_index.ensure_built()
+        for word, note_ids in reference_index.words.iteritems():
+            if not self.engine.word_has_notes(word):
+                report.missing[word] = sorted(note_ids)
+                report.errors.append(exception.MissingNote(word))
+
+        dependency_graph = self.dependency_graph
+        report.cycles = graph.find_cycles(
+                sorted(dependency_graph), lambda word: dependency_graph.get(word, []))
+        for cycle in report.cycles:
+            for word in cycle:
+                report.cycle_note_ids[word] = self.word_index.find(word)
+            path = graph.find_cycle_path(cycle, lambda word: dependency_graph.get(word, []))
+            report.errors.add(exception.CYCLE,
+                    u'Components depend on each other: %s'%graph.format_cycle(path))
+
+        report.seconds = time.time() - self.start
+        return report
+
+# Scans the whole collection. Problems reading individual notes are added to
+# the report's errors.
+def scan(engine):
+    health_scan = HealthScan(engine)
+    note_ids = health_scan.note_ids()
+    engine.begin_operation(note_ids)
+    try:
+        for note_id in note_ids:
+            try:
+                health_scan.add_note(note_id)
+            except exception.MagicException as e:
+                health_scan.report.errors.append(e)
+    finally:
+        engine.end_operation()
+    return health_scan.finish()
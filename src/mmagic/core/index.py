@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+import anki.utils
+
+# In-memory indexes from words to the ids of the notes that mention them in
+# a given set of fields.
+#
+# Searching the collection with findNotes('Field:"word"') scans every note
+# once per field name. An index is built with a single pass over the notes
+# table and is then kept up to date as notes are flushed or removed.
+#
+# Indexes are built lazily on the first lookup.
+#
+# Some of Anki's own actions write to the notes table directly, without
+# flushing notes: importing, find and replace and changing note types. Such
+# a write sets the notes' modification time. An index keeps the number of
+# notes of the types it covers and their latest modification time in step
+# with the notes it is told about. If the notes table disagrees, the index
+# may have missed a write and has to be rebuilt. See is_current.
+#
+# Modification times are in seconds, so a direct write in the same second
+# as the last flush the index was told about, and that adds no notes, goes
+# unnoticed.
+
+# Returns a dictionary from model id to the ordinals of the fields in that
+# model whose names are in the field set.
+def get_field_ordinals(collection, field_set):
+    result = {}
+    for model in collection.models.all():
+        ordinals = [f['ord'] for f in model['flds'] if f['name'] in field_set]
+        if ordinals:
+            result[model['id']] = ordinals
+    return result
+
+class FieldIndex:
+
+    def __init__(self, collection, field_set):
+        self.collection = collection
+        self.field_set = field_set
+        # word -> set of note ids
+        self.words = None
+        # note id -> set of words indexed for that note. Used to remove stale
+        # entries when a note changes.
+        self.note_words = None
+        # The ids of the note types whose notes are indexed and of those
+        # notes, and the (count, latest mod) of those notes as the index
+        # expects the notes table to have them.
+        self.model_ids = None
+        self.known_ids = None
+        self.signature = None
+
+    # Returns the words to index for the given field value. By default the
+    # whole value is one word.
+    def extract_words(self, value):
+        return [self.normalise(value)]
+
+    # Converts a word to the form in which it is stored in the index.
+    def normalise(self, word):
+        return word
+
+    def is_built(self):
+        return self.words is not None
+
+    def invalidate(self):
+        self.words = None
+        self.note_words = None
+        self.model_ids = None
+        self.known_ids = None
+        self.signature = None
+
+    # Returns (count, latest mod) of the notes of the indexed types, read
+    # from the collection in one query.
+    def read_signature(self):
+        if not self.model_ids:
+            return (0, None)
+        count, latest = self.collection.db.first(
+            'select count(), max(mod) from notes where mid in %s'
+            % anki.utils.ids2str(self.model_ids))
+        return (count, latest)
+
+    # Returns False if notes of the indexed types may have been written in a
+    # way that bypassed update_note and remove_notes since the index was
+    # built or last marked current.
+    def is_current(self):
+        if not self.is_built():
+            return True
+        return self.read_signature() == self.signature
+
+    # Call after writes that the index has already been told about but that
+    # it can't follow itself, such as tagging notes, which also sets their
+    # modification time.
+    def mark_current(self):
+        if self.is_built():
+            self.signature = self.read_signature()
+
+    def calculate_field_ordinals(self):
+        return get_field_ordinals(self.collection, self.field_set)
+
+    def build(self):
+        self.words = {}
+        self.note_words = {}
+        self.known_ids = set()
+        ordinals = self.calculate_field_ordinals()
+        self.model_ids = set(ordinals)
+        latest = None
+        if ordinals:
+            query = 'select id, mid, flds, mod from notes where mid in %s'\
+                % anki.utils.ids2str(ordinals.keys())
+            for note_id, model_id, fields, mod in self.collection.db.execute(query):
+                self.known_ids.add(note_id)
+                if latest is None or mod > latest:
+                    latest = mod
+                values = anki.utils.splitFields(fields)
+                for ordinal in ordinals[model_id]:
+                    self.add_entries(note_id, self.extract_words(values[ordinal]))
+        self.signature = (len(self.known_ids), latest)
+
+    def ensure_built(self):
+        if not self.is_built():
+            self.build()
+
+    def add_entries(self, note_id, words):
+        for word in words:
+            self.words.setdefault(word, set()).add(note_id)
+            self.note_words.setdefault(note_id, set()).add(word)
+
+    # Returns the words that no longer have any notes.
+    def remove_entries(self, note_id):
+        result = []
+        for word in self.note_words.pop(note_id, ()):
+            note_ids = self.words.get(word)
+            if note_ids is None:
+                continue
+            note_ids.discard(note_id)
+            if not note_ids:
+                del self.words[word]
+                result.append(word)
+        return result
+
+    # Returns a sorted list of the ids of notes for the given word.
+    def find(self, word):
+        self.ensure_built()
+        return sorted(self.words.get(self.normalise(word), ()))
+
+    def contains(self, word):
+        self.ensure_built()
+        return self.normalise(word) in self.words
+
+    # Returns the ids of all notes that have at least one word indexed.
+    def note_ids(self):
+        self.ensure_built()
+        return self.note_words.keys()
+
+    # Call after a note has been added or flushed.
+    #
+    # Returns the words that either gained their first note or lost their
+    # last note as a result.
+    def update_note(self, note):
+        if not self.is_built():
+            return []
+        if note.mid in self.model_ids:
+            self.known_ids.add(note.id)
+            count, latest = self.signature
+            if latest is None or note.mod > latest:
+                latest = note.mod
+            self.signature = (len(self.known_ids), latest)
+        new_words = set()
+        for name in note.keys():
+            if name in self.field_set:
+                new_words.update(self.extract_words(note[name]))
+        affected = new_words | self.note_words.get(note.id, set())
+        existed = dict((word, word in self.words) for word in affected)
+        self.remove_entries(note.id)
+        self.add_entries(note.id, new_words)
+        return [word for word in affected if (word in self.words) != existed[word]]
+
+    # Call after notes have been deleted from the collection. If one of them
+    # was the latest to be changed, the index no longer matches the notes
+    # table and is rebuilt when it is next checked.
+    #
+    # Returns the words that no longer have any notes.
+    def remove_notes(self, note_ids):
+        if not self.is_built():
+            return []
+        self.known_ids.difference_update(note_ids)
+        self.signature = (len(self.known_ids), self.signature[1])
+        result = []
+        for note_id in note_ids:
+            result += self.remove_entries(note_id)
+        return result
+
+# Maps the value of a Mandarin field to the notes that hold that value. This
+# matches the semantics of the field search it replaces: the whole field
+# value must match and the comparison ignores case.
+class WordIndex(FieldIndex):
+
+    def normalise(self, word):
+        return word.lower()
+
+# Maps a word to the notes that refer to it in their component or measure
+# word fields. 'tokenise' takes a field value and returns the words in it.
+class ReferenceIndex(FieldIndex):
+
+    def __init__(self, collection, field_set, tokenise):
+        FieldIndex.__init__(self, collection, field_set)
+        self.tokenise = tokenise
+
+    def extract_words(self, value):
+        return set(self.tokenise(value))
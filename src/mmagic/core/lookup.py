@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import mmagic.core.cache as cache
+import mmagic.core.snapshot as snapshot
+import zhonglib as zl
+from mmagic.core.formatting import format_english, format_pinyin_list, format_measure_words
+
+# Caching layer over the zhonglib dictionary, decomposition and segmentation
+# routines. Bulk operations look up the same words and components over and
+# over again. The results of these lookups never change while the add-on is
+# running so they can safely be cached.
+#
+# Each kind of lookup has its own bounded cache. When a cache is full, the
+# least recently used result is evicted; see mmagic.core.cache.
+#
+# The caches may be shared between the main thread and worker threads.
+#
+# Populating a note needs a word's dictionary entries formatted as the
+# English, pinyin and measure word fields. The formatted strings are cached
+# per word too, so shared components and common measure words such as 個,
+# 張 and 條 are looked up and formatted once. lookup_words does this for a
+# whole batch of words at a time.
+
+DEFAULT_CAPACITY = cache.DEFAULT_CAPACITY
+
+# Some character components are only defined in the dictionary as
+# simplified, so words are looked up in both forms at once.
+ALL_FORMS = zl.TRADITIONAL | zl.SIMPLIFIED
+
+# Lists are cached as tuples and copied on the way out so that callers are
+# free to modify what they get back.
+def _frozen(compute):
+    return lambda key: tuple(compute(key))
+
+# A word's dictionary entries formatted for the fields of a note.
+class WordStrings:
+
+    def __init__(self, english, pinyin, measure_words):
+        self.english = english
+        self.pinyin = pinyin
+        self.measure_words = measure_words
+
+class Lookup:
+
+    def __init__(self, dictionary, capacity=DEFAULT_CAPACITY):
+        self.dictionary = dictionary
+        errors = (zl.ZhonglibException,)
+        self.caches = {
+            'find': cache.LRUCache(capacity, errors),
+            'decompose': cache.LRUCache(capacity, errors),
+            'decompose_character': cache.LRUCache(capacity, errors),
+            'decompose_word': cache.LRUCache(capacity, errors),
+            'segment': cache.LRUCache(capacity, errors),
+            'strings': cache.LRUCache(capacity, errors),
+        }
+
+    def find(self, word, flags, include_english=False):
+        return list(self.caches['find'].get(
+            (word, flags, include_english),
+            _frozen(lambda key: self.dictionary.find(
+                key[0], key[1], include_english=key[2]))))
+
+    def decompose(self, word, flags):
+        return list(self.caches['decompose'].get(
+            (word, flags),
+            _frozen(lambda key: zl.decompose(*key))))
+
+    def decompose_character(self, character):
+        return list(self.caches['decompose_character'].get(
+            character,
+            _frozen(zl.decompose_character)))
+
+    def decompose_word(self, word):
+        return list(self.caches['decompose_word'].get(
+            word,
+            _frozen(zl.decompose_word)))
+
+    def segment(self, text, flags):
+        return list(self.caches['segment'].get(
+            (text, flags),
+            _frozen(lambda key: zl.segment(*key))))
+
+    # Returns the WordStrings for the word, or None if the dictionary has no
+    # entry for it in either form.
+    def get_strings(self, word):
+        return self.caches['strings'].get(word, self.format_word)
+
+    # Returns a dictionary from each of the words to what get_strings
+    # returns for it. Each distinct word is looked up once. Words that can't
+    # be looked up are left out; get_strings raises the problem.
+    def lookup_words(self, words):
+        return self.caches['strings'].get_many(words, self.format_word)
+
+    def format_word(self, word):
+        entries = self.find(word, ALL_FORMS, include_english=False)
+        if not entries:
+            return None
+        return WordStrings(
+            format_english(entries),
+            format_pinyin_list(entries),
+            format_measure_words(entries))
+
+    # True if the dictionary is a memory-mapped snapshot. Other processes
+    # that open the same snapshot share its pages.
+    def is_memory_mapped(self):
+        return isinstance(self.dictionary, snapshot.SnapshotDictionary)
+
+    # Discards every cached result. Call this if the underlying dictionary or
+    # decomposition data changes.
+    def invalidate(self):
+        for cache in self.caches.itervalues():
+            cache.invalidate()
+
+    # Returns a dictionary from lookup name to the statistics of its cache.
+    def statistics(self):
+        return dict((name, cache.statistics()) for name, cache in self.caches.iteritems())
+
+# Returns a Lookup over the precompiled dictionary snapshot if there is one,
+# otherwise over zhonglib's standard dictionary. The snapshot is only
+# available if a CEDICT file can be found; see mmagic.core.snapshot.
+def open_lookup(capacity=DEFAULT_CAPACITY):
+    dictionary = snapshot.load_dictionary()
+    if dictionary is None:
+        dictionary = zl.standard_dictionary()
+    return Lookup(dictionary, capacity)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import anki.utils
+
+# Bulk loading of notes for read-only use.
+#
+# collection.getNote(id) runs a query per note and builds a full
+# anki.notes.Note. Most actions only read notes, often the same ones many
+# times over: the graph walkers revisit shared components and the Skritter
+# export loads every selected note twice. A NoteCache loads notes many at a
+# time straight from the notes table and keeps them for the length of one
+# action, so each note is read from the database at most once per action.
+
+# Maximum number of ids per query. Keeps the SQL statement a sensible size.
+LOAD_CHUNK_SIZE = 500
+
+# A read-only copy of a note. Supports the parts of the anki.notes.Note
+# interface that the field helpers in mmagic.core.notes read: id, mid,
+# fields, tags, col, model(), keys(), __getitem__ and __contains__. It
+# can't be flushed.
+class NoteRecord(object):
+
+    # _mmagic_view holds the record's NoteView. See mmagic.core.note_view.
+    __slots__ = ('col', 'id', 'mid', 'fields', 'tags', '_mmagic_view')
+
+    def __init__(self, col, id, mid, fields, tags):
+        self.col = col
+        self.id = id
+        self.mid = mid
+        self.fields = fields
+        self.tags = tags
+        self._mmagic_view = None
+
+    def model(self):
+        return self.col.models.get(self.mid)
+
+    def keys(self):
+        return [f['name'] for f in self.model()['flds']]
+
+    def __getitem__(self, key):
+        for f in self.model()['flds']:
+            if f['name'] == key:
+                return self.fields[f['ord']]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def hasTag(self, tag):
+        return tag.lower() in (t.lower() for t in self.tags)
+
+# Returns a dictionary from note id to NoteRecord for those of the given
+# notes that exist.
+def load_notes(collection, note_ids):
+    result = {}
+    note_ids = list(note_ids)
+    for first in xrange(0, len(note_ids), LOAD_CHUNK_SIZE):
+        query = 'select id, mid, flds, tags from notes where id in %s'\
+            % anki.utils.ids2str(note_ids[first:first+LOAD_CHUNK_SIZE])
+        for note_id, model_id, fields, tags in collection.db.execute(query):
+            result[note_id] = NoteRecord(collection, note_id, model_id,
+                    tuple(anki.utils.splitFields(fields)), tuple(tags.split()))
+    return result
+
+class NoteCache:
+
+    def __init__(self, collection):
+        self.collection = collection
+        # note id -> NoteRecord
+        self.records = {}
+        # Number of queries run. Used to check that loading really is done
+        # in bulk.
+        self.queries = 0
+
+    # Loads whichever of the given notes aren't already cached.
+    def prefetch(self, note_ids):
+        missing = [i for i in note_ids if i not in self.records]
+        if not missing:
+            return
+        self.queries += (len(missing) + LOAD_CHUNK_SIZE - 1) / LOAD_CHUNK_SIZE
+        self.records.update(load_notes(self.collection, missing))
+
+    # Behaves like collection.getNote but returns a NoteRecord. Raises
+    # KeyError if there is no such note.
+    def get(self, note_id):
+        result = self.records.get(note_id)
+        if result is None:
+            self.prefetch([note_id])
+            result = self.records[note_id]
+        return result
+
+    # Call when a note has been changed or deleted.
+    def discard(self, note_id):
+        self.records.pop(note_id, None)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import anki.utils
+import mmagic.core.cjk as cjk
+import mmagic.core.fields as note_fields
+from mmagic.core.fields import DECOMPOSITION_FIELDS, MEASURE_WORD_FIELDS
+
+# A parsed view of a note. The helpers in mmagic.core.notes read fields
+# through it, so each field of a note is stripped of HTML and tokenised at
+# most once, however many helpers look at it.
+#
+# Views are created on demand by get_view and kept on the note object
+# itself. A view is thrown away as soon as the note's fields or note type no
+# longer match the ones it was built from, whether they were changed through
+# set_field or directly.
+
+# The attribute of the note that holds its view.
+VIEW_ATTRIBUTE = '_mmagic_view'
+
+# Marks a list that hasn't been worked out yet.
+_UNSET = object()
+
+class NoteView(object):
+
+    __slots__ = ('fields', 'field_map', 'stripped', 'decomposition', 'measure_words')
+
+    def __init__(self, note):
+        # A copy of the field values the view was built from.
+        self.fields = note.fields[:]
+        self.field_map = note_fields.get_field_map(note)
+        # role -> field value without HTML
+        self.stripped = {}
+        self.decomposition = _UNSET
+        self.measure_words = _UNSET
+
+    # Field maps are per note type and version. A note type that is changed
+    # while the view exists is not picked up, but changing a note type
+    # rewrites the fields of its notes anyway.
+    def is_current(self, note):
+        return self.fields == note.fields and self.field_map.model_id == note.mid
+
+    # Returns a (name, ordinal) pair. Raises MagicException if the note type
+    # doesn't have exactly one field for the role.
+    def resolve(self, role):
+        resolution = self.field_map.resolve(role)
+        if resolution.error is not None:
+            raise resolution.error
+        return (resolution.name, resolution.ordinal)
+
+    def has_field(self, role):
+        return self.field_map.resolve(role).has_candidates
+
+    def get_raw(self, role):
+        name, ordinal = self.resolve(role)
+        return self.fields[ordinal]
+
+    def get_stripped(self, role):
+        result = self.stripped.get(role)
+        if result is None:
+            result = anki.utils.stripHTML(self.get_raw(role))
+            self.stripped[role] = result
+        return result
+
+    def is_empty(self, role):
+        return self.has_field(role) and len(self.get_stripped(role)) == 0
+
+    # Returns the spans of the CJK words in the field without HTML. See
+    # mmagic.core.cjk.
+    def get_spans(self, role):
+        return cjk.tokenise(self.get_stripped(role))
+
+    def get_words(self, role):
+        return [word for start, end, word in self.get_spans(role)]
+
+    # See notes.get_decomposition_list. The list is shared; callers copy it.
+    def get_decomposition_list(self):
+        if self.decomposition is _UNSET:
+            field = self.get_stripped(DECOMPOSITION_FIELDS).strip()
+            if len(field) == 0:
+                self.decomposition = None
+            elif field == 'None':
+                self.decomposition = []
+            else:
+                self.decomposition = list(self.get_words(DECOMPOSITION_FIELDS))
+        return self.decomposition
+
+    # See notes.get_measure_word_list. The list is shared; callers copy it.
+    def get_measure_word_list(self):
+        if self.measure_words is _UNSET:
+            field = self.get_stripped(MEASURE_WORD_FIELDS).strip()
+            if len(field) == 0:
+                self.measure_words = []
+            else:
+                self.measure_words = list(self.get_words(MEASURE_WORD_FIELDS))
+        return self.measure_words
+
+def get_view(note):
+    result = getattr(note, VIEW_ATTRIBUTE, None)
+    if result is None or not result.is_current(note):
+        result = NoteView(note)
+        setattr(note, VIEW_ATTRIBUTE, result)
+    return result
+
+# Call after changing a field of the note.
+def invalidate(note):
+    setattr(note, VIEW_ATTRIBUTE, None)
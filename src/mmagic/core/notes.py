@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import anki.utils
+import mmagic.core.cjk as cjk
+import mmagic.core.exception as exception
+import mmagic.core.note_view as note_view
+from mmagic.core.fields import MANDARIN_FIELDS, ENGLISH_FIELDS, PINYIN_FIELDS,\
+        DECOMPOSITION_FIELDS, MEASURE_WORD_FIELDS
+
+# Helpers for reading and writing the Mandarin-related fields of a note.
+
+#------------------------------------------------------------------------------
+# Field access
+
+# Fields are read through the note's NoteView (see mmagic.core.note_view),
+# so each field is only stripped of HTML once per version of the note.
+
+def get_field(note, fields, fail_if_empty=False, strip_html=True):
+    view = note_view.get_view(note)
+    if fail_if_empty and len(view.get_raw(fields)) == 0:
+        field_name, ordinal = view.resolve(fields)
+        raise exception.MagicException(field_name + ' field is empty')
+    if strip_html:
+        return view.get_stripped(fields)
+    return view.get_raw(fields)
+
+def has_field(note, fields):
+    return note_view.get_view(note).has_field(fields)
+
+def has_empty_field(note, fields):
+    return note_view.get_view(note).is_empty(fields)
+
+def set_field(note, fields, value):
+    field_name, ordinal = note_view.get_view(note).resolve(fields)
+    if note.fields[ordinal] != value:
+        note.fields[ordinal] = value
+        note_view.invalidate(note)
+
+def get_mandarin_text(note, fail_if_empty=False):
+    return get_field(note, MANDARIN_FIELDS, fail_if_empty).strip().rstrip()
+
+def set_mandarin_field(note, value):
+    set_field(note, MANDARIN_FIELDS, value)
+
+def get_english_definition(note, fail_if_empty=False):
+    return get_field(note, ENGLISH_FIELDS, fail_if_empty)
+
+def has_english_field(note):
+    return has_field(note, ENGLISH_FIELDS)
+
+def has_empty_english_field(note):
+    return has_empty_field(note, ENGLISH_FIELDS)
+
+def set_english_field(note, value):
+    set_field(note, ENGLISH_FIELDS, value)
+
+#------------------------------------------------------------------------------
+# Pinyin
+
+def has_pinyin_field(note):
+    return has_field(note, PINYIN_FIELDS)
+
+def has_empty_pinyin_field(note):
+    return has_empty_field(note, PINYIN_FIELDS)
+
+def set_pinyin_field(note, value):
+    set_field(note, PINYIN_FIELDS, value)
+
+def get_pinyin_field(note):
+    return get_field(note, PINYIN_FIELDS)
+
+#------------------------------------------------------------------------------
+# Measure word
+
+def has_measure_word_field(note):
+    return has_field(note, MEASURE_WORD_FIELDS)
+
+def has_empty_measure_word_field(note):
+    return has_empty_field(note, MEASURE_WORD_FIELDS)
+
+def get_measure_word_field(note):
+    return get_field(note, MEASURE_WORD_FIELDS)
+
+def set_measure_word_field(note, value):
+    set_field(note, MEASURE_WORD_FIELDS, value)
+
+#------------------------------------------------------------------------------
+# Decomposition
+
+def has_decomposition_field(note):
+    return has_field(note, DECOMPOSITION_FIELDS)
+
+def has_empty_decomposition_field(note):
+    return has_empty_field(note, DECOMPOSITION_FIELDS)
+
+def set_decomposition_field(note, value):
+    set_field(note, DECOMPOSITION_FIELDS, value)
+
+def get_decomposition_field(note, fail_if_empty=False):
+    return get_field(note, DECOMPOSITION_FIELDS, fail_if_empty)
+
+#------------------------------------------------------------------------------
+# Note search
+
+# Mandarin lookups go through the word index rather than a search of the
+# collection. See mmagic.core.index.
+def find_note_ids_for_word(word_index, word):
+    return word_index.find(word)
+
+def note_exists_for_mandarin(word_index, word):
+    return word_index.contains(word)
+
+#------------------------------------------------------------------------------
+# Component lists
+
+# Returns the decomposition components as a list. A new list is returned. It
+# can be modified by the client.
+#
+# If the field is 'None' an empty list is returned.
+#
+# If the field is empty, None is returned.
+
+def get_decomposition_list(note):
+    result = note_view.get_view(note).get_decomposition_list()
+    if result is None:
+        return None
+    return list(result)
+
+# Returns the CJK words in a component or measure word field. Used to build
+# the reference index.
+def extract_referenced_words(field):
+    return cjk.get_words(anki.utils.stripHTML(field))
+
+def get_measure_word_list(note):
+    return list(note_view.get_view(note).get_measure_word_list())
+
+# Returns the CJK words in the component or measure word field of the note.
+# 'fields' is DECOMPOSITION_FIELDS or MEASURE_WORD_FIELDS.
+def get_referenced_words(note, fields):
+    return list(note_view.get_view(note).get_words(fields))
+
+# Returns the field without HTML and the spans of the CJK words in it. See
+# mmagic.core.cjk.
+def get_field_spans(note, fields):
+    view = note_view.get_view(note)
+    return (view.get_stripped(fields), view.get_spans(fields))
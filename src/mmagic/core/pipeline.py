@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import mmagic.core.exception as exception
+import mmagic.core.health as health
+import mmagic.core.profiler as profiler
+import mmagic.core.word_list as word_list
+from mmagic.core.engine import Engine
+from mmagic.core.notes import get_mandarin_text
+from mmagic.core.populate import ComputePool, compute_batch, read_request
+
+# Bulk operations over every Mandarin note in a collection. These are meant
+# for use without the Anki GUI, e.g. from mmagic.cli.
+#
+# Changes are queued in the engine's BatchSession and committed every
+# 'batch_size' notes rather than after each note. If the session is a dry
+# run, nothing is written.
+
+DEFAULT_BATCH_SIZE = 500
+
+# The outcome of running one stage of the pipeline over a set of notes.
+class StageResult:
+
+    def __init__(self, name, note_count, seconds, errors):
+        self.name = name
+        self.note_count = note_count
+        self.seconds = seconds
+        self.errors = errors
+        # Used by the consistency check. Problem name -> note ids.
+        self.offenders = {}
+
+    def notes_per_second(self):
+        if self.seconds == 0:
+            return 0.0
+        return self.note_count / self.seconds
+
+    def __str__(self):
+        result = '%s: %d notes in %.1fs (%.1f notes/s), %d errors'%(
+            self.name, self.note_count, self.seconds,
+            self.notes_per_second(), len(self.errors))
+        for problem, note_ids in sorted(self.offenders.iteritems()):
+            result += '\n  %s: %d notes'%(problem, len(note_ids))
+        return result
+
+def mandarin_note_ids(engine):
+    return sorted(engine.get_word_index().note_ids())
+
+# Writes what has been queued so far. Any problems are added to 'errors'.
+def commit(engine, errors):
+    if engine.session is not None:
+        errors.append(engine.session.commit())
+    else:
+        engine.get_collection().save()
+    engine.mark_indexes_current()
+
+# Calls 'process' for each note id, committing every 'batch_size' notes.
+def run_stage(engine, name, note_ids, process, batch_size):
+    errors = exception.ErrorCollector()
+    start = time.time()
+    for count, note_id in enumerate(note_ids):
+        if count % batch_size == 0:
+            engine.prefetch_notes(note_ids[count:count+batch_size])
+        try:
+            process(note_id)
+        except exception.MagicException as e:
+            errors.append(e)
+        if (count+1) % batch_size == 0:
+            commit(engine, errors)
+    commit(engine, errors)
+    return StageResult(name, len(note_ids), time.time() - start, errors)
+
+# The worker pool is only used when the dictionary snapshot is memory-mapped.
+# Without it, each worker would parse CEDICT into a copy of its own, which
+# costs more than it saves.
+def populate(engine, note_ids, batch_size=DEFAULT_BATCH_SIZE, processes=None):
+    if processes == 1:
+        return populate_in_process(engine, note_ids, batch_size)
+    if not engine.get_lookup().is_memory_mapped():
+        profiler.logger.info('populate: no dictionary snapshot, not using worker processes')
+        return populate_in_process(engine, note_ids, batch_size)
+    return populate_in_parallel(engine, note_ids, batch_size, processes)
+
+# Does the dictionary work on this process, a batch at a time.
+def populate_in_process(engine, note_ids, batch_size):
+    def compute(requests):
+        return zip(requests, compute_batch(engine.get_lookup(), requests))
+    return populate_in_batches(engine, note_ids, batch_size, compute)
+
+# Does the dictionary work on a pool of worker processes. 'processes'
+# defaults to the number of CPUs.
+def populate_in_parallel(engine, note_ids, batch_size, processes=None):
+    pool = ComputePool(processes)
+    try:
+        result = populate_in_batches(engine, note_ids, batch_size, pool.compute)
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    return result
+
+# Reads and writes notes a batch at a time. 'compute' takes a batch's
+# requests and returns (request, (updates, messages)) pairs, in order.
+def populate_in_batches(engine, note_ids, batch_size, compute):
+    errors = exception.ErrorCollector()
+    start = time.time()
+    for first in xrange(0, len(note_ids), batch_size):
+        notes = []
+        requests = []
+        for note_id in note_ids[first:first+batch_size]:
+            note = engine.get_note(note_id)
+            try:
+                requests.append(read_request(note))
+                notes.append(note)
+            except exception.MagicException as e:
+                errors.append(e)
+        for note, (request, (updates, messages)) in zip(notes, compute(requests)):
+            try:
+                engine.finish_populating_note(note, updates, messages)
+            except exception.MagicException as e:
+                errors.append(e)
+            finally:
+                engine.flush_note(note)
+        commit(engine, errors)
+    return StageResult('populate', len(note_ids), time.time() - start, errors)
+
+# Builds one dependency graph for all the notes and then adds the missing
+# words in dependency order. See Engine.add_missing_dependencies_for_notes.
+def add_missing_dependencies(engine, note_ids, batch_size=DEFAULT_BATCH_SIZE):
+    start = time.time()
+    dependency_graph = {}
+    models = {}
+    words = []
+
+    def collect(note_id):
+        note = engine.get_note_view(note_id)
+        words.append(get_mandarin_text(note))
+        engine.add_to_dependency_graph(note, dependency_graph, models)
+
+    result = run_stage(engine, 'add missing dependencies', note_ids, collect, batch_size)
+    missing_words, missing_errors = engine.get_missing_words(dependency_graph, words)
+    result.errors.append(missing_errors)
+
+    engine.get_lookup().lookup_words(missing_words)
+    for count, word in enumerate(missing_words):
+        try:
+            engine.add_mandarin_note(models[word], word)
+        except exception.MagicException as e:
+            result.errors.append(e)
+        if (count+1) % batch_size == 0:
+            commit(engine, result.errors)
+    commit(engine, result.errors)
+
+    # The new notes change the status colour of the notes that refer to them.
+    engine.recolour_dependents()
+    commit(engine, result.errors)
+    result.seconds = time.time() - start
+    return result
+
+# Adds notes of the given type for the words that don't have any and, if
+# 'add_components' is True, for their missing components. See
+# mmagic.core.word_list. The notes are all added in one commit at the end.
+# Progress is logged every 'batch_size' words.
+def import_words(engine, words, model, add_components=False, batch_size=DEFAULT_BATCH_SIZE):
+    start = time.time()
+    word_list.check_model(engine.get_collection(), model)
+    plan = word_list.plan_import(engine, words, add_components)
+    profiler.logger.info('import: %d words, %d already have notes, %d components added',
+            len(words), len(plan.existing), len(plan.components))
+    word_import = word_list.WordImport(engine, model)
+    engine.get_lookup().lookup_words(plan.words)
+    result = StageResult('import', len(plan.words), 0, plan.errors)
+    for count, word in enumerate(plan.words):
+        try:
+            prepared = word_import.prepare(word)
+            word_import.apply(word, prepared, word_import.compute(prepared))
+        except exception.MagicException as e:
+            result.errors.append(e)
+        if (count+1) % batch_size == 0:
+            profiler.logger.info('import: %d of %d notes', count+1, len(plan.words))
+    commit(engine, result.errors)
+    result.seconds = time.time() - start
+    return result
+
+EMPTY_DEPENDENCIES = 'empty component list'
+MISSING_DEPENDENCIES = 'missing dependencies'
+
+# Reports notes with an empty component list and notes that refer to words
+# that have no note. If 'tag' is given, the offending notes are tagged with
+# it.
+def check_consistency(engine, note_ids, tag=None, batch_size=DEFAULT_BATCH_SIZE):
+    empty = []
+    missing = []
+
+    def process(note_id):
+        if engine.note_has_empty_dependencies(note_id):
+            empty.append(note_id)
+        if engine.note_has_missing_dependencies(note_id):
+            missing.append(note_id)
+
+    result = run_stage(engine, 'consistency check', note_ids, process, batch_size)
+    result.offenders[EMPTY_DEPENDENCIES] = empty
+    result.offenders[MISSING_DEPENDENCIES] = missing
+    offenders = sorted(set(empty) | set(missing))
+    if tag and offenders:
+        engine.add_tags(offenders, tag)
+        commit(engine, result.errors)
+    return result
+
+EMPTY_COMPONENTS = 'empty component list'
+MISSING_COMPONENTS = 'refer to words without notes'
+DUPLICATES = 'duplicated headwords'
+CYCLES = 'in dependency cycles'
+
+# Runs the one-pass health scan over the whole collection. See
+# mmagic.core.health. If 'tag' is given, every note involved in a problem
+# is tagged with it.
+def check_health(engine, tag=None):
+    report = health.scan(engine)
+    result = StageResult('health report', report.note_count, report.seconds, report.errors)
+    result.offenders[EMPTY_COMPONENTS] = report.empty_components
+    result.offenders[MISSING_COMPONENTS] = sorted(
+            set(i for note_ids in report.missing.itervalues() for i in note_ids))
+    result.offenders[DUPLICATES] = sorted(
+            set(i for note_ids in report.duplicates.itervalues() for i in note_ids))
+    result.offenders[CYCLES] = sorted(
+            set(i for note_ids in report.cycle_note_ids.itervalues() for i in note_ids))
+    offenders = report.offenders()
+    if tag and offenders:
+        engine.add_tags(offenders, tag)
+        commit(engine, result.errors)
+    return result
+
+# Runs the requested stages over every Mandarin note in the collection.
+# Returns a list of StageResults.
+#
+# If the engine has no session open, one is opened for the run. To do a dry
+# run, open one with dry_run=True beforehand and look at its describe()
+# afterwards.
+#
+# 'processes' is the number of worker processes used to populate notes. It
+# defaults to the number of CPUs. Pass 1 to do everything in this process.
+# Without a dictionary snapshot, everything is done in this process anyway;
+# see populate.
+#
+# The words in 'import_list' are imported first, as notes of type
+# 'import_model', so that the other stages see them.
+def run(collection, populate_notes=False, add_missing=False, check=False,
+        tag=None, batch_size=DEFAULT_BATCH_SIZE, processes=None, engine=None,
+        health_report=False, import_list=None, import_model=None,
+        import_components=False):
+    if engine is None:
+        engine = Engine(collection)
+    own_session = engine.session is None
+    if own_session:
+        engine.begin_session()
+    engine.begin_operation()
+    results = []
+    if import_list is not None:
+        results.append(import_words(
+            engine, import_list, import_model, import_components, batch_size))
+    if populate_notes:
+        results.append(populate(engine, mandarin_note_ids(engine), batch_size, processes))
+    if add_missing:
+        results.append(add_missing_dependencies(engine, mandarin_note_ids(engine), batch_size))
+    if check:
+        results.append(check_consistency(engine, mandarin_note_ids(engine), tag, batch_size))
+    if health_report:
+        results.append(check_health(engine, tag))
+    for result in results:
+        engine.profiler.record('stage: ' + result.name, result.seconds)
+        profiler.logger.info('%s', result)
+    engine.end_operation()
+    if own_session:
+        errors = engine.end_session()
+        if results:
+            results[-1].errors.append(errors)
+    return results
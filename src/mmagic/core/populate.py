@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+
+import mmagic.core.exception as exception
+import mmagic.core.lookup as lookup
+import zhonglib as zl
+from mmagic.core.fields import ENGLISH_FIELDS, PINYIN_FIELDS, DECOMPOSITION_FIELDS,\
+        MEASURE_WORD_FIELDS
+from mmagic.core.formatting import format_pinyin, format_decomposition
+from mmagic.core.notes import get_mandarin_text, set_field, has_field, has_empty_field,\
+        get_pinyin_field
+
+# Populating a note is split into three steps so that the expensive part
+# can run away from the collection:
+#
+#   read_request(note)                  collection side. Captures what the
+#                                       computation needs from the note.
+#   compute_updates(lookup, request)    pure. Segmentation, decomposition,
+#                                       dictionary lookup and formatting.
+#                                       Returns (updates, messages).
+#   apply_updates(note, updates, messages)
+#                                       collection side. Writes the fields.
+#
+# Requests and results are plain picklable values, so compute_updates can
+# run on a worker thread or in another process. 'updates' maps a field role
+# (one of the field sets in mmagic.core.fields) to its new value. 'messages'
+# holds a (category, text) pair for each error; see mmagic.core.exception.
+# MagicExceptions don't survive pickling, so the errors are only collected
+# again on the collection side.
+
+# The roles populate fills in if they are empty.
+FILLED_ROLES = (ENGLISH_FIELDS, PINYIN_FIELDS, DECOMPOSITION_FIELDS, MEASURE_WORD_FIELDS)
+
+class PopulateRequest:
+
+    def __init__(self, mandarin_text, empty_roles, pinyin, messages):
+        self.mandarin_text = mandarin_text
+        # The roles in FILLED_ROLES whose fields exist and are empty.
+        self.empty_roles = empty_roles
+        # The current pinyin. None if the field is empty.
+        self.pinyin = pinyin
+        # Problems found while reading the note.
+        self.messages = messages
+
+    def is_empty(self, role):
+        return role in self.empty_roles
+
+# Raises MagicException if the Mandarin field is missing or empty.
+#
+# The fields of the roles in 'overwrite' are treated as empty, so they are
+# filled in again even if they aren't.
+def read_request(note, overwrite=()):
+    mandarin_text = get_mandarin_text(note, fail_if_empty=True)
+    empty_roles = frozenset(role for role in FILLED_ROLES
+                            if has_empty_field(note, role)
+                            or (role in overwrite and has_field(note, role)))
+    pinyin = None
+    messages = []
+    if PINYIN_FIELDS not in empty_roles:
+        try:
+            pinyin = get_pinyin_field(note)
+        except exception.MagicException as e:
+            messages += e.get_problems()
+    return PopulateRequest(mandarin_text, empty_roles, pinyin, messages)
+
+# The field may be in numbered pinyin format. If so, it is converted to tone
+# marks. Returns None if it isn't numbered pinyin.
+def reformat_pinyin(pinyin):
+    try:
+        return format_pinyin('['+pinyin+']')
+    except Exception:
+        # Something didn't work. It's probably not in numbered format. Just
+        # leave it be.
+        return None
+
+def compute_updates(lookup, request):
+    mandarin_text = request.mandarin_text
+    updates = {}
+
+    # In the following, we want to populate as many fields as possible even
+    # if errors occur on previous fields, so error messages are accumulated
+    # rather than raised.
+    messages = list(request.messages)
+
+    try:
+        # In the following, we do two things. One, we work out whether the
+        # text can possibly be in the dictionary or not. If it's a sentence,
+        # it cannot. Second, we split the text into components. This can
+        # happen no matter what the text is. If it's a character, it is
+        # split into sub-characters. If it's a word, it's split into
+        # characters. If it's a sentence, it is is split into words.
+        is_sentence = False
+        if len(mandarin_text) == 1:
+            decomposition = lookup.decompose_character(mandarin_text)
+        else:
+            # When segmenting sentences, only use the traditional words.
+            words = lookup.segment(mandarin_text, zl.TRADITIONAL)
+            if len(words) == 1:
+                decomposition = lookup.decompose_word(mandarin_text)
+            else:
+                is_sentence = True
+                decomposition = words
+    except zl.ZhonglibException as e:
+        decomposition = None
+        messages.append((exception.DICTIONARY_MISS, unicode(e)))
+
+    if request.pinyin is not None:
+        formatted = reformat_pinyin(request.pinyin)
+        if formatted is not None:
+            updates[PINYIN_FIELDS] = formatted
+
+    if is_sentence:
+        if request.is_empty(ENGLISH_FIELDS):
+            updates[ENGLISH_FIELDS] = 'Cannot use dictionary to look up sentences'
+    else:
+        # The Mandarin text is either a word or a character. We can look it
+        # up in the dictionary. The entries come already formatted, in both
+        # traditional and simplified form; see Lookup.get_strings.
+        strings = lookup.get_strings(mandarin_text)
+
+        if strings is None and request.is_empty(ENGLISH_FIELDS):
+            messages.append((exception.DICTIONARY_MISS, 'No dictionary entry for "' + mandarin_text + '"'))
+            updates[ENGLISH_FIELDS] = "No dictionary entry"
+
+        if strings is not None:
+            # Add English
+            if request.is_empty(ENGLISH_FIELDS):
+                updates[ENGLISH_FIELDS] = strings.english
+
+            # Add 拼音
+            if request.is_empty(PINYIN_FIELDS):
+                updates[PINYIN_FIELDS] = strings.pinyin
+
+            # Add 量詞
+            if request.is_empty(MEASURE_WORD_FIELDS):
+                updates[MEASURE_WORD_FIELDS] = strings.measure_words
+
+    if decomposition != None and request.is_empty(DECOMPOSITION_FIELDS):
+        try:
+            updates[DECOMPOSITION_FIELDS] = format_decomposition(decomposition)
+        except exception.MagicException as e:
+            messages += e.get_problems()
+
+    return (updates, messages)
+
+# Returns compute_updates(lookup, request) for each of the requests, in
+# order. The dictionary strings of all their words are looked up together
+# first, so a word shared by several requests is only looked up once.
+def compute_batch(lookup, requests):
+    lookup.lookup_words(request.mandarin_text for request in requests)
+    return [compute_updates(lookup, request) for request in requests]
+
+# Returns an ErrorCollector holding the given messages. The caller raises it
+# once it has finished with the note.
+def apply_updates(note, updates, messages):
+    for role, value in updates.iteritems():
+        set_field(note, role, value)
+    errors = exception.ErrorCollector()
+    for category, message in messages:
+        errors.add(category, message)
+    return errors
+
+#------------------------------------------------------------------------------
+# Process pool
+
+# Each worker process opens the dictionary once. The pool is only meant to
+# be used when the precompiled snapshot is available: the workers then
+# memory-map the same file and share its pages. Without it, each worker would
+# parse CEDICT into a copy of its own; see mmagic.core.pipeline.populate.
+
+_worker_lookup = None
+
+def _initialise_worker():
+    global _worker_lookup
+    _worker_lookup = lookup.open_lookup()
+
+def _compute_in_worker(request):
+    try:
+        return compute_updates(_worker_lookup, request)
+    except Exception as e:
+        # Anything else would be raised again in the parent without a
+        # message that identifies the note.
+        return ({}, [(exception.OTHER, u'"%s": %s'%(request.mandarin_text, unicode(e)))])
+
+def _compute_chunk_in_worker(requests):
+    try:
+        _worker_lookup.lookup_words(request.mandarin_text for request in requests)
+    except Exception:
+        # Reported against the note it concerns below.
+        pass
+    return [_compute_in_worker(request) for request in requests]
+
+# Computes updates for batches of requests on a pool of worker processes.
+# Use as:
+#
+#   pool = ComputePool()
+#   try:
+#       for request, (updates, messages) in pool.compute(requests):
+#           ...
+#   finally:
+#       pool.close()
+class ComputePool:
+
+    # Requests handed to a worker at a time.
+    CHUNK_SIZE = 16
+
+    def __init__(self, processes=None):
+        self.pool = multiprocessing.Pool(processes, _initialise_worker)
+
+    # Returns (request, (updates, messages)) pairs in the order of the
+    # requests. Each chunk's words are looked up in one batch.
+    def compute(self, requests):
+        requests = list(requests)
+        chunks = [requests[first:first+self.CHUNK_SIZE]
+                  for first in xrange(0, len(requests), self.CHUNK_SIZE)]
+        results = []
+        for chunk_results in self.pool.imap(_compute_chunk_in_worker, chunks):
+            results += chunk_results
+        return zip(requests, results)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
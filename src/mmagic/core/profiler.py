@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import contextlib
+import json
+import logging
+import threading
+import time
+
+# Counters and timers for the add-on's hot paths, so that we can see where
+# the time goes on real decks.
+#
+#   profiler.count('getNote')
+#   with profiler.timed('populate: compute'):
+#       ...
+#
+# A timer records how often a stage ran, the total time it took and the
+# longest single run. report() returns everything as a dictionary that can
+# be saved as JSON. The counters and timers may be updated from any thread.
+#
+# The add-on logs to the 'mmagic' logger. Nothing is printed unless the
+# application configures logging. RecentRecords keeps the latest messages
+# so that they can be shown in the GUI.
+
+logger = logging.getLogger('mmagic')
+logger.addHandler(logging.NullHandler())
+
+# Number of log messages RecentRecords keeps.
+RECENT_RECORDS = 500
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+class Profiler:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            # name -> count
+            self.counts = collections.defaultdict(int)
+            # name -> [runs, total seconds, longest run in seconds]
+            self.timings = {}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def record(self, name, seconds):
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                self.timings[name] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = max(timing[2], seconds)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start)
+
+    # 'extra' is added to the report as it is. Use it for statistics kept
+    # elsewhere, such as those of the lookup caches.
+    def report(self, extra=None):
+        with self.lock:
+            result = {
+                'seconds': time.time() - self.started,
+                'counts': dict(self.counts),
+                'timings': dict(
+                    (name, {'runs': runs, 'seconds': total, 'longest': longest})
+                    for name, (runs, total, longest) in self.timings.iteritems()),
+            }
+        if extra:
+            result.update(extra)
+        return result
+
+def to_json(report):
+    return json.dumps(report, indent=2, sort_keys=True)
+
+# Returns a list of lines summarising the report, slowest stages first.
+def format_report(report):
+    result = ['Recorded over %.1fs'%report['seconds'], '', 'Timings:']
+    timings = sorted(report['timings'].iteritems(),
+                     key=lambda item: item[1]['seconds'], reverse=True)
+    for name, timing in timings:
+        result.append('  %-40s %6d runs %9.3fs total %8.3fs longest'%(
+            name, timing['runs'], timing['seconds'], timing['longest']))
+    result += ['', 'Counts:']
+    for name, count in sorted(report['counts'].iteritems()):
+        result.append('  %-40s %9d'%(name, count))
+    lookups = report.get('lookups')
+    if lookups:
+        result += ['', 'Dictionary lookups (since the dictionary was loaded):']
+    for name, statistics in sorted((lookups or {}).iteritems()):
+        calls = statistics['hits'] + statistics['misses']
+        result.append('  %-40s %9d calls %9d computed'%(name, calls, statistics['misses']))
+    return result
+
+# A logging handler that keeps the most recent messages.
+class RecentRecords(logging.Handler):
+
+    def __init__(self, capacity=RECENT_RECORDS):
+        logging.Handler.__init__(self)
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+        self.lines = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        try:
+            self.lines.append(self.format(record))
+        except Exception:
+            self.handleError(record)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import anki.utils
+import mmagic.core.cjk as cjk
+import mmagic.core.graph as graph
+import mmagic.core.index as index
+from mmagic.core.fields import MANDARIN_FIELDS, DECOMPOSITION_FIELDS
+from mmagic.core.note_cache import LOAD_CHUNK_SIZE
+
+# Reorders new cards so that a word's components are learnt before it.
+#
+# Anki shows new cards in the order of their due numbers, which is usually
+# the order they were created in. The notes are sorted by dependency (see
+# graph.sort_levels) and the due numbers that their new cards already have
+# are handed out again in that order, so the cards keep their place among
+# the new cards of other notes. The cards of one note share a due number,
+# as Anki's own repositioning does.
+#
+# Anki's Scheduler.sortCards looks up each card's note with a query of its
+# own. Here the new cards and then their notes' Mandarin and Decomposition
+# fields are read LOAD_CHUNK_SIZE notes to a query, as in
+# mmagic.core.note_cache, and the changed due numbers are written with one
+# executemany. Chunking keeps each query well within SQLite's limit on the
+# length of a statement, however many notes there are.
+
+# Yields the ids LOAD_CHUNK_SIZE at a time, formatted for an 'in' clause.
+def chunks(ids):
+    ids = list(ids)
+    for first in xrange(0, len(ids), LOAD_CHUNK_SIZE):
+        yield anki.utils.ids2str(ids[first:first+LOAD_CHUNK_SIZE])
+
+class Reordering:
+
+    def __init__(self, note_order, cards, ordering):
+        # Note ids in the order their cards should come up.
+        self.note_order = note_order
+        # card id -> (note id, old due, new due)
+        self.cards = cards
+        # The graph.Ordering of the notes' words. Notes whose words are in
+        # or behind a cycle keep their relative order after the others.
+        self.ordering = ordering
+
+    # Returns (new due, card id) pairs for the cards whose due changes.
+    def changes(self):
+        return [(new, card_id)
+                for card_id, (note_id, old, new) in self.cards.iteritems() if old != new]
+
+# Returns a dictionary from note id to the (card id, due) pairs of its new
+# cards, sorted by due.
+def load_new_cards(collection, note_ids):
+    result = {}
+    for chunk in chunks(note_ids):
+        query = 'select id, nid, due from cards where type = 0 and nid in %s' % chunk
+        for card_id, note_id, due in collection.db.execute(query):
+            result.setdefault(note_id, []).append((card_id, due))
+    for cards in result.itervalues():
+        cards.sort(key=lambda card: (card[1], card[0]))
+    return result
+
+# Returns a dictionary from note id to (word, components) for those of the
+# given notes that are Mandarin notes. The components are the words in the
+# Decomposition field, as in notes.get_decomposition_list.
+def load_components(collection, note_ids):
+    mandarin_ordinals = index.get_field_ordinals(collection, MANDARIN_FIELDS)
+    decomposition_ordinals = index.get_field_ordinals(collection, DECOMPOSITION_FIELDS)
+    result = {}
+    for chunk in chunks(note_ids):
+        query = 'select id, mid, flds from notes where id in %s' % chunk
+        for note_id, model_id, fields in collection.db.execute(query):
+            if model_id not in mandarin_ordinals:
+                continue
+            values = anki.utils.splitFields(fields)
+            word = anki.utils.stripHTML(values[mandarin_ordinals[model_id][0]]).strip()
+            components = []
+            for ordinal in decomposition_ordinals.get(model_id, ()):
+                components += cjk.scan_words(anki.utils.stripHTML(values[ordinal]))
+            result[note_id] = (word, components)
+    return result
+
+# Returns (order, ordering). 'order' holds the notes in 'components', those
+# of components first. Otherwise notes keep the order of their first new
+# card. 'first_due' maps note id to that due number. Notes in or behind a
+# cycle come last. 'ordering' is the graph.Ordering of their words.
+def sort_notes(components, first_due):
+    by_due = sorted(sorted(components), key=first_due.get)
+    # word -> ids of its notes, by due
+    note_ids_for_word = {}
+    # Words by the due number of their earliest new card.
+    rank = {}
+    for note_id in by_due:
+        word = components[note_id][0]
+        if word not in note_ids_for_word:
+            note_ids_for_word[word] = []
+            rank[word] = len(rank)
+        note_ids_for_word[word].append(note_id)
+
+    dependency_graph = {}
+    for note_id, (word, dependencies) in components.iteritems():
+        successors = dependency_graph.setdefault(word, [])
+        successors += [d for d in dependencies if d in note_ids_for_word and d != word]
+
+    ordering = graph.sort_levels(dependency_graph, key=rank.get)
+    result = []
+    for word in ordering.order():
+        result += note_ids_for_word[word]
+    ordered = set(result)
+    result += [note_id for note_id in by_due if note_id not in ordered]
+    return (result, ordering)
+
+# Works out new due numbers for the new cards of the given notes. Notes
+# that aren't Mandarin notes or have no new cards are left alone. The
+# dependency cycles found are in the result's ordering.get_errors().
+def plan(collection, note_ids):
+    new_cards = load_new_cards(collection, note_ids)
+    components = load_components(collection, new_cards.keys())
+    first_due = dict((note_id, new_cards[note_id][0][1]) for note_id in components)
+    order, ordering = sort_notes(components, first_due)
+
+    # The due numbers in use, one per note.
+    slots = sorted(first_due.itervalues())
+    cards = {}
+    for slot, note_id in zip(slots, order):
+        for card_id, due in new_cards[note_id]:
+            cards[card_id] = (note_id, due, slot)
+    return Reordering(order, cards, ordering)
+
+# Writes the new due numbers. Returns the number of cards changed.
+def apply(collection, reordering):
+    changes = reordering.changes()
+    if not changes:
+        return 0
+    modified = anki.utils.intTime()
+    usn = collection.usn()
+    collection.db.executemany(
+        'update cards set due = ?, mod = ?, usn = ? where id = ?',
+        [(due, modified, usn, card_id) for due, card_id in changes])
+    collection.save()
+    return len(changes)
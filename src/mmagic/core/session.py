@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+import collections
+
+import anki.utils
+
+import mmagic.core.exception as exception
+from mmagic.core.note_cache import LOAD_CHUNK_SIZE
+from mmagic.core.notes import get_mandarin_text
+
+# Queues changes to the collection so that a bulk action writes them all in
+# one go rather than as it goes along:
+#
+#   update_note(note)           flushes the note on commit, if it is
+#                               already in the collection
+#   add_note(note)              adds the note to the collection on commit
+#   add_tags(note_ids, tag)     tags the notes on commit
+#   remove_tags(note_ids, tag)  untags the notes on commit
+#
+# commit() writes everything that is queued and then saves the collection
+# once, so the changes go into a single transaction. The session can be
+# used again afterwards.
+#
+# In dry-run mode commit() writes nothing and the changes stay queued.
+# describe() reports what would have been written.
+#
+# Sessions are opened through Engine.begin_session. While one is open, the
+# engine's get_note returns the queued copy of a note, if there is one, so
+# that later changes build on earlier ones.
+
+class BatchSession:
+
+    def __init__(self, collection, dry_run=False):
+        self.collection = collection
+        self.dry_run = dry_run
+        self.clear()
+
+    def clear(self):
+        # note id -> note, in the order they were first queued
+        self.updated_notes = collections.OrderedDict()
+        self.added_notes = []
+        # The lowercased Mandarin text of the notes in added_notes.
+        self.added_words = set()
+        # tag -> set of note ids
+        self.tags = {}
+        self.removed_tags = {}
+
+    def has_changes(self):
+        return bool(self.updated_notes or self.added_notes or self.tags or self.removed_tags)
+
+    # Returns the queued copy of the note or None if the note hasn't been
+    # changed in this session.
+    def get_note(self, note_id):
+        return self.updated_notes.get(note_id)
+
+    # New notes may be queued here too, since Anki gives a note its id when
+    # it is made. Only the ones that turn out to be stored are flushed; see
+    # stored_note_ids.
+    def update_note(self, note):
+        self.updated_notes[note.id] = note
+
+    # Anki numbers a note from the time it is made, moved on past the ids
+    # that are stored. Notes made in the same millisecond get the same id
+    # until one of them is added, and adding the next would then write over
+    # the first. So each queued note is given an id past the one queued
+    # before it. Ids stored in the meantime are avoided on commit; see
+    # assign_free_ids.
+    def add_note(self, note):
+        if self.added_notes and note.id <= self.added_notes[-1].id:
+            note.id = self.added_notes[-1].id + 1
+        self.added_notes.append(note)
+        self.added_words.add(get_mandarin_text(note).lower())
+
+    # Returns True if a note for the word is waiting to be added.
+    def has_added_note_for(self, word):
+        return word.lower() in self.added_words
+
+    # Adding a tag cancels its queued removal from the same notes, and the
+    # other way around.
+    def add_tags(self, note_ids, tag):
+        self.tags.setdefault(tag, set()).update(note_ids)
+        self.removed_tags.get(tag, set()).difference_update(note_ids)
+
+    def remove_tags(self, note_ids, tag):
+        self.removed_tags.setdefault(tag, set()).update(note_ids)
+        self.tags.get(tag, set()).difference_update(note_ids)
+
+    # Returns an ErrorCollector holding any problems. Notes that couldn't be
+    # added are reported there; everything else is still written.
+    def commit(self):
+        errors = exception.ErrorCollector()
+        if self.dry_run or not self.has_changes():
+            return errors
+        added_notes, updated_notes = self.added_notes, self.updated_notes
+        tags, removed_tags = self.tags, self.removed_tags
+        stored = self.stored_note_ids()
+        self.clear()
+        self.assign_free_ids(added_notes)
+        for note in added_notes:
+            # addNote flushes the note, but only if it produces cards. A note
+            # without cards would not show up in the browser.
+            if self.collection.addNote(note) == 0:
+                errors.append(exception.MagicException(
+                    'No cards were added for "' + get_mandarin_text(note) + '". ' +
+                    "Try adding manually for further clues."
+                ))
+        for note_id, note in updated_notes.iteritems():
+            if note_id in stored:
+                note.flush()
+        for tag, note_ids in sorted(tags.iteritems()):
+            if note_ids:
+                self.collection.tags.bulkAdd(sorted(note_ids), tag)
+        for tag, note_ids in sorted(removed_tags.iteritems()):
+            if note_ids:
+                self.collection.tags.bulkRem(sorted(note_ids), tag)
+        self.collection.save()
+        return errors
+
+    # Returns a list of lines describing the queued changes.
+    def describe(self):
+        result = []
+        for note in self.added_notes:
+            result.append(u'add note "%s"'%get_mandarin_text(note))
+        stored = self.stored_note_ids()
+        for note_id, note in self.updated_notes.iteritems():
+            if note_id not in stored:
+                continue
+            changed = self.changed_field_names(note)
+            if changed:
+                result.append(u'update note %d "%s": %s'%(
+                    note_id, get_mandarin_text(note), u', '.join(changed)))
+        for tag, note_ids in sorted(self.tags.iteritems()):
+            if note_ids:
+                result.append(u'tag %d notes with "%s"'%(len(note_ids), tag))
+        for tag, note_ids in sorted(self.removed_tags.iteritems()):
+            if note_ids:
+                result.append(u'remove "%s" from %d notes'%(tag, len(note_ids)))
+        return result
+
+    # Returns the set of ids of the notes queued by update_note that are
+    # already in the collection and aren't waiting to be added. The others
+    # are new notes, which are written when they are added, if at all.
+    def stored_note_ids(self):
+        added = set(note.id for note in self.added_notes)
+        return self.find_stored([note_id for note_id in self.updated_notes
+                                 if note_id not in added])
+
+    # Moves the notes about to be added past any id that has been stored
+    # since they were made. Usually none has, and this is a single query.
+    def assign_free_ids(self, notes):
+        taken = self.find_stored([note.id for note in notes])
+        while taken:
+            next_id = max(note.id for note in notes) + 1
+            moved = []
+            for note in notes:
+                if note.id in taken:
+                    note.id = next_id
+                    next_id += 1
+                    moved.append(note.id)
+            taken = self.find_stored(moved)
+
+    # Returns the set of the given ids that belong to stored notes. The ids
+    # are looked up LOAD_CHUNK_SIZE at a time, so the query stays within
+    # SQLite's limits however many notes are queued.
+    def find_stored(self, note_ids):
+        result = set()
+        for first in xrange(0, len(note_ids), LOAD_CHUNK_SIZE):
+            result.update(note_id for (note_id,) in self.collection.db.execute(
+                    'select id from notes where id in %s'
+                    % anki.utils.ids2str(note_ids[first:first+LOAD_CHUNK_SIZE])))
+        return result
+
+    # Compares the queued note with the one in the collection.
+    def changed_field_names(self, note):
+        stored = self.collection.getNote(note.id)
+        names = dict((f['ord'], f['name']) for f in note.model()['flds'])
+        return [names[ordinal]
+                for ordinal, (old, new) in enumerate(zip(stored.fields, note.fields))
+                if old != new]
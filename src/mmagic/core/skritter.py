@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import os
+
+import mmagic.core.exception as exception
+import mmagic.core.graph as graph
+from mmagic.core.notes import get_decomposition_list
+
+# Export of words to Skritter.
+#
+# Words are exported in dependency order, so that a character's components
+# come before it, and otherwise in code point order, so exporting the same
+# words twice gives the same list. They are exported in sections, since
+# Skritter takes at most 200 words per section. The sections are either
+# copied to the clipboard one at a time or written out to files all in one
+# go.
+#
+# A ledger of the words that have been exported is kept. Words in the
+# ledger are left out of later exports, so exporting a growing selection
+# only exports the new words. Pass include_exported to prepare_export to
+# export them anyway, or take them out of the ledger for good with
+# forget_exports.
+#
+# The ledger grows by a word for every word ever exported and is never
+# trimmed, so it is kept in a file of its own next to the collection, a
+# word per line, rather than in the collection's configuration, which Anki
+# writes out on every save. The file is only rewritten when the ledger
+# changes. It isn't synced; the tag on exported notes is. Ledgers kept in
+# the configuration by earlier versions are moved to the file the first
+# time it is written.
+
+DEFAULT_SECTION_SIZE = 200
+
+EXPORTED_TAG = 'exported_to_skritter'
+
+# Keys in collection.conf. The ledger is only read from there, to move it to
+# its file.
+LEDGER_KEY = 'mmagic_skritter_exported'
+SECTION_SIZE_KEY = 'mmagic_skritter_section_size'
+
+# Replaces the extension of the collection's file to name the ledger's.
+LEDGER_EXTENSION = '.skritter'
+
+# Extension of the files that hold every section in one table. Otherwise,
+# each section is written to a file of its own.
+TABLE_EXTENSION = '.tsv'
+
+def get_ledger_path(collection):
+    return os.path.splitext(collection.path)[0] + LEDGER_EXTENSION
+
+class ExportLedger:
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.path = get_ledger_path(collection)
+        if os.path.exists(self.path):
+            with codecs.open(self.path, 'r', 'utf-8') as ledger:
+                self.words = set(line.strip() for line in ledger if line.strip())
+        else:
+            self.words = set(collection.conf.get(LEDGER_KEY, ()))
+
+    def __contains__(self, word):
+        return word in self.words
+
+    def __len__(self):
+        return len(self.words)
+
+    def record(self, words):
+        self.update(self.words.union(words))
+
+    def forget(self, words):
+        self.update(self.words.difference(words))
+
+    # The file is written in full to a temporary file that then replaces it,
+    # so a failed write leaves the old ledger in place.
+    def update(self, words):
+        if words == self.words:
+            return
+        temporary_path = self.path + '.tmp'
+        with codecs.open(temporary_path, 'w', 'utf-8') as ledger:
+            for word in sorted(words):
+                ledger.write(word + u'\n')
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temporary_path, self.path)
+        self.words = words
+        if LEDGER_KEY in self.collection.conf:
+            del self.collection.conf[LEDGER_KEY]
+            self.collection.setMod()
+
+def get_section_size(collection):
+    return collection.conf.get(SECTION_SIZE_KEY, DEFAULT_SECTION_SIZE)
+
+def set_section_size(collection, section_size):
+    if section_size < 1:
+        raise exception.MagicException('The section size must be at least 1.')
+    collection.conf[SECTION_SIZE_KEY] = section_size
+    collection.setMod()
+
+# The words to export and the notes they come from.
+class Export:
+
+    def __init__(self, words, note_ids, skipped):
+        # In dependency order.
+        self.words = words
+        # word -> note id
+        self.note_ids = note_ids
+        # Number of words left out because they have been exported before.
+        self.skipped = skipped
+
+    def sections(self, section_size):
+        for first in xrange(0, len(self.words), section_size):
+            yield self.words[first:first+section_size]
+
+    def note_ids_for(self, words):
+        return [self.note_ids[word] for word in words]
+
+# Returns a dictionary from each word to those of its components that are
+# also being exported. 'get_note' returns a note given its id.
+def build_export_graph(words_and_ids, get_note):
+    result = {}
+    for word, note_id in words_and_ids.iteritems():
+        dependencies = get_decomposition_list(get_note(note_id)) or []
+        result[word] = [d for d in dependencies if d in words_and_ids]
+    return result
+
+# Returns an Export holding the given words in dependency order. Unless
+# 'include_exported' is True, words that are in the ledger or whose notes
+# are tagged as exported are left out. Raises MagicException if a word has
+# no note or more than one, or if the components form a cycle.
+def prepare_export(engine, words, ledger, include_exported=False):
+    words_and_ids, errors = engine.get_note_ids_for_words(words)
+    errors.raise_if_not_empty()
+
+    dependency_graph = build_export_graph(words_and_ids, engine.get_note_view)
+    ordered = graph.topological_sort(dependency_graph)
+
+    if include_exported:
+        return Export(ordered, words_and_ids, 0)
+    # Words exported before the ledger was kept are only tagged.
+    result = [word for word in ordered
+              if word not in ledger
+              and not engine.get_note_view(words_and_ids[word]).hasTag(EXPORTED_TAG)]
+    return Export(result, words_and_ids, len(ordered) - len(result))
+
+# Takes the words out of the ledger and removes the exported tag from the
+# notes, so that later exports include them again.
+def forget_exports(engine, ledger, words, note_ids):
+    ledger.forget(words)
+    engine.remove_tags(note_ids, EXPORTED_TAG)
+
+def format_section(section):
+    return u''.join(word + u'\n' for word in section)
+
+# Returns the path of the file for the section with the given index. The
+# index is added to the name so that the files sort in section order.
+def get_section_path(path, index):
+    stem, extension = os.path.splitext(path)
+    return u'%s-%03d%s'%(stem, index + 1, extension)
+
+# Writes the sections out as they are produced and returns the paths of the
+# files written. If the path ends in TABLE_EXTENSION, every section goes
+# into that file as 'section<tab>word' rows. Otherwise each section gets a
+# file of its own with one word per line.
+def write_sections(path, sections):
+    if os.path.splitext(path)[1].lower() == TABLE_EXTENSION:
+        with codecs.open(path, 'w', 'utf-8') as table:
+            for index, section in enumerate(sections):
+                for word in section:
+                    table.write(u'%d\t%s\n'%(index + 1, word))
+        return [path]
+    result = []
+    for index, section in enumerate(sections):
+        section_path = get_section_path(path, index)
+        with codecs.open(section_path, 'w', 'utf-8') as text:
+            text.write(format_section(section))
+        result.append(section_path)
+    return result
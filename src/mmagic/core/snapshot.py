@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+import array
+import bisect
+import codecs
+import mmap
+import os
+import re
+import struct
+import sys
+
+import zhonglib as zl
+
+# A precompiled, memory-mapped copy of the CEDICT dictionary.
+#
+# Parsing CEDICT on every launch takes seconds and keeps the whole dictionary
+# in memory as Python objects. The add-on only ever reads the pinyin, the
+# English definitions and the measure words of an entry, so those are
+# compiled into a compact binary snapshot. The snapshot is memory-mapped, so
+# only the pages that are actually touched are read from disk.
+#
+# Layout (all integers little endian, unsigned 32 bit unless stated):
+#
+#   header      magic, version, source size (64 bit), source mtime (64 bit),
+#               string count, entry count, list count
+#   offsets     string count + 1 offsets into the string data
+#   strings     UTF-8 string data. Each distinct string is stored once.
+#   entries     per entry: traditional, simplified and pinyin string ids,
+#               then start and length of the English and measure word lists
+#   lists       string ids referred to by the entry lists
+#   traditional entry ids sorted by traditional headword
+#   simplified  entry ids sorted by simplified headword
+#
+# Strings are sorted by their UTF-8 bytes, which is also code point order,
+# so the headword indexes can be binary searched on the raw bytes.
+#
+# The snapshot is compiled from a CEDICT file. zhonglib builds its standard
+# dictionary from the copy of CEDICT that is installed with it, so that copy
+# is used. A CEDICT file placed in the add-on's data directory (see
+# SOURCE_NAMES) takes precedence, e.g. to use a newer release. The snapshot
+# itself is written to the data directory. If no CEDICT file can be found,
+# the add-on falls back to zl.standard_dictionary().
+#
+# Only the dictionary is in the snapshot. Character and word decompositions
+# and segmentation still come from zhonglib's own data, so the time
+# zhonglib takes to load that is not saved. The entries are parsed here
+# rather than by zhonglib; the tests check that they match the ones
+# zl.standard_dictionary() returns.
+
+MAGIC = 'MMDS'
+VERSION = 1
+
+HEADER = struct.Struct('<4sIQQIII')
+ENTRY = struct.Struct('<IIIIIII')
+WORD = struct.Struct('<I')
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+DEFAULT_SNAPSHOT_PATH = os.path.join(DATA_DIRECTORY, 'cedict.snapshot')
+
+# The names CEDICT is distributed under, in order of preference.
+SOURCE_NAMES = ('cedict_ts.u8', 'cedict_1_0_ts_utf-8_mdbg.txt', 'cedict.u8', 'cedict.txt')
+
+CEDICT_LINE = re.compile(r'^(\S+) (\S+) \[([^\]]*)\] /(.*)/\s*$')
+
+#------------------------------------------------------------------------------
+# Compilation
+
+def parse_measure_words(definition):
+    # For example: CL:個|个[ge4],張|张[zhang1]
+    result = []
+    for item in definition[len('CL:'):].split(','):
+        traditional = re.split(r'[|\[]', item, 1)[0].strip()
+        if traditional:
+            result.append(traditional)
+    return result
+
+# Yields (traditional, simplified, pinyin, english, measure_words) for each
+# entry in a CEDICT file. As with the zhonglib dictionary, the pinyin keeps
+# its surrounding brackets and classifiers are moved out of the English.
+def parse_cedict(path):
+    with codecs.open(path, 'r', 'utf-8') as source:
+        for line in source:
+            if line.startswith('#'):
+                continue
+            match = CEDICT_LINE.match(line)
+            if match is None:
+                continue
+            traditional, simplified, pinyin, definitions = match.groups()
+            english = []
+            measure_words = []
+            for definition in definitions.split('/'):
+                if definition.startswith('CL:'):
+                    measure_words += parse_measure_words(definition)
+                elif definition:
+                    english.append(definition)
+            yield (traditional, simplified, '[' + pinyin + ']', english, measure_words)
+
+def source_signature(source_path):
+    status = os.stat(source_path)
+    return (status.st_size, int(status.st_mtime))
+
+def compile_snapshot(source_path, snapshot_path):
+    entries = list(parse_cedict(source_path))
+
+    # Intern every string. Ids are assigned in sorted order.
+    strings = set()
+    for traditional, simplified, pinyin, english, measure_words in entries:
+        strings.add(traditional)
+        strings.add(simplified)
+        strings.add(pinyin)
+        strings.update(english)
+        strings.update(measure_words)
+    encoded = sorted(s.encode('utf-8') for s in strings)
+    string_ids = dict((s.decode('utf-8'), idx) for idx, s in enumerate(encoded))
+
+    offsets = array.array('I', [0])
+    for s in encoded:
+        offsets.append(offsets[-1] + len(s))
+
+    records = []
+    lists = array.array('I')
+    for traditional, simplified, pinyin, english, measure_words in entries:
+        english_start = len(lists)
+        lists.extend(string_ids[s] for s in english)
+        measure_word_start = len(lists)
+        lists.extend(string_ids[s] for s in measure_words)
+        records.append(ENTRY.pack(
+            string_ids[traditional],
+            string_ids[simplified],
+            string_ids[pinyin],
+            english_start, len(english),
+            measure_word_start, len(measure_words)))
+
+    # Sorting is stable, so entries sharing a headword keep their order in
+    # the source file.
+    entry_ids = range(len(entries))
+    traditional_index = array.array('I', sorted(entry_ids, key=lambda i: string_ids[entries[i][0]]))
+    simplified_index = array.array('I', sorted(entry_ids, key=lambda i: string_ids[entries[i][1]]))
+
+    for a in (offsets, lists, traditional_index, simplified_index):
+        if sys.byteorder != 'little':
+            a.byteswap()
+
+    size, mtime = source_signature(source_path)
+    directory = os.path.dirname(snapshot_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temporary_path = snapshot_path + '.tmp'
+    with open(temporary_path, 'wb') as snapshot:
+        snapshot.write(HEADER.pack(
+            MAGIC, VERSION, size, mtime, len(encoded), len(entries), len(lists)))
+        snapshot.write(offsets.tostring())
+        snapshot.write(''.join(encoded))
+        snapshot.write(''.join(records))
+        snapshot.write(lists.tostring())
+        snapshot.write(traditional_index.tostring())
+        snapshot.write(simplified_index.tostring())
+    # Windows won't rename over an existing file.
+    if os.path.exists(snapshot_path):
+        os.remove(snapshot_path)
+    os.rename(temporary_path, snapshot_path)
+
+#------------------------------------------------------------------------------
+# Reading
+
+class SnapshotEntry(object):
+
+    __slots__ = ('traditional', 'simplified', 'pinyin', 'english', 'traditional_measure_words')
+
+    def __init__(self, traditional, simplified, pinyin, english, traditional_measure_words):
+        self.traditional = traditional
+        self.simplified = simplified
+        self.pinyin = pinyin
+        self.english = english
+        self.traditional_measure_words = traditional_measure_words
+
+# Presents the index of a snapshot as a sorted sequence of headwords so that
+# it can be searched with the bisect module.
+class HeadwordSequence:
+
+    def __init__(self, snapshot, index_offset, field):
+        self.snapshot = snapshot
+        self.index_offset = index_offset
+        self.field = field
+
+    def __len__(self):
+        return self.snapshot.entry_count
+
+    def __getitem__(self, position):
+        string_id = self.snapshot.read_entry(self.entry_id(position))[self.field]
+        return self.snapshot.read_bytes(string_id)
+
+    def entry_id(self, position):
+        return self.snapshot.read_word(self.index_offset + position*WORD.size)
+
+# Reads a snapshot through the same find() interface as the zhonglib
+# dictionary.
+class SnapshotDictionary:
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size, mtime, string_count, entry_count, list_count =\
+                HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('%s is not a version %d dictionary snapshot'%(path, VERSION))
+        self.source_signature = (size, mtime)
+        self.entry_count = entry_count
+        self.offsets_offset = HEADER.size
+        self.strings_offset = self.offsets_offset + (string_count+1)*WORD.size
+        self.entries_offset = self.strings_offset + self.read_offset(string_count)
+        self.lists_offset = self.entries_offset + entry_count*ENTRY.size
+        traditional_offset = self.lists_offset + list_count*WORD.size
+        simplified_offset = traditional_offset + entry_count*WORD.size
+        if len(self.data) != simplified_offset + entry_count*WORD.size:
+            self.close()
+            raise ValueError('%s is truncated'%path)
+        self.traditional = HeadwordSequence(self, traditional_offset, 0)
+        self.simplified = HeadwordSequence(self, simplified_offset, 1)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def read_word(self, offset):
+        return WORD.unpack_from(self.data, offset)[0]
+
+    def read_offset(self, string_id):
+        return self.read_word(self.offsets_offset + string_id*WORD.size)
+
+    # Headwords are compared as UTF-8 so that they compare in the same order
+    # as they were sorted.
+    def read_bytes(self, string_id):
+        start = self.strings_offset + self.read_offset(string_id)
+        end = self.strings_offset + self.read_offset(string_id+1)
+        return self.data[start:end]
+
+    def read_string(self, string_id):
+        return self.read_bytes(string_id).decode('utf-8')
+
+    def read_list(self, start, length):
+        offset = self.lists_offset + start*WORD.size
+        return [self.read_string(self.read_word(offset + i*WORD.size)) for i in xrange(length)]
+
+    def read_entry(self, entry_id):
+        return ENTRY.unpack_from(self.data, self.entries_offset + entry_id*ENTRY.size)
+
+    def make_entry(self, entry_id):
+        traditional, simplified, pinyin, english_start, english_length,\
+                measure_word_start, measure_word_length = self.read_entry(entry_id)
+        return SnapshotEntry(
+            self.read_string(traditional),
+            self.read_string(simplified),
+            self.read_string(pinyin),
+            self.read_list(english_start, english_length),
+            self.read_list(measure_word_start, measure_word_length))
+
+    def find_ids(self, headwords, word):
+        key = word.encode('utf-8')
+        position = bisect.bisect_left(headwords, key)
+        result = []
+        while position < len(headwords) and headwords[position] == key:
+            result.append(headwords.entry_id(position))
+            position += 1
+        return result
+
+    # Searching the English definitions is not supported, so
+    # 'include_english' is ignored.
+    def find(self, word, flags, include_english=False):
+        entry_ids = []
+        if flags & zl.TRADITIONAL:
+            entry_ids += self.find_ids(self.traditional, word)
+        if flags & zl.SIMPLIFIED:
+            entry_ids += self.find_ids(self.simplified, word)
+        # An entry whose traditional and simplified forms are the same would
+        # otherwise be returned twice.
+        seen = set()
+        result = []
+        for entry_id in entry_ids:
+            if entry_id not in seen:
+                seen.add(entry_id)
+                result.append(self.make_entry(entry_id))
+        return result
+
+# Returns the directories searched for a CEDICT file, in order: the
+# add-on's data directory and then wherever zhonglib is installed.
+def get_source_directories():
+    result = [DATA_DIRECTORY]
+    zhonglib_path = getattr(zl, '__file__', None)
+    if zhonglib_path is None:
+        return result
+    zhonglib_directory = os.path.dirname(os.path.abspath(zhonglib_path))
+    if os.path.splitext(os.path.basename(zhonglib_path))[0] == '__init__':
+        # A package. Its data may be in a subdirectory.
+        for directory, subdirectories, files in os.walk(zhonglib_directory):
+            subdirectories.sort()
+            result.append(directory)
+    else:
+        result.append(zhonglib_directory)
+    return result
+
+# Returns the path of the CEDICT file to compile the snapshot from, or None
+# if there isn't one.
+def find_source_path():
+    for directory in get_source_directories():
+        for name in SOURCE_NAMES:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return path
+    return None
+
+# Returns a SnapshotDictionary for the given CEDICT file, compiling the
+# snapshot first if it is missing or the source has changed since it was
+# compiled. The source defaults to find_source_path(). Returns None if
+# there is no source or the snapshot can't be written.
+def load_dictionary(source_path=None, snapshot_path=DEFAULT_SNAPSHOT_PATH):
+    if source_path is None:
+        source_path = find_source_path()
+    if source_path is None or not os.path.exists(source_path):
+        return None
+    if os.path.exists(snapshot_path):
+        try:
+            dictionary = SnapshotDictionary(snapshot_path)
+            if dictionary.source_signature == source_signature(source_path):
+                return dictionary
+            dictionary.close()
+        except (ValueError, struct.error, EnvironmentError):
+            # Corrupt or from an older version. Compile it again.
+            pass
+    try:
+        compile_snapshot(source_path, snapshot_path)
+    except EnvironmentError:
+        # E.g. the add-on's directory is read-only.
+        return None
+    return SnapshotDictionary(snapshot_path)
+
+def main():
+    if len(sys.argv) != 3:
+        print 'usage: python -m mmagic.core.snapshot CEDICT_FILE SNAPSHOT_FILE'
+        sys.exit(1)
+    compile_snapshot(sys.argv[1], sys.argv[2])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import re
+
+import mmagic.core.cjk as cjk
+import mmagic.core.exception as exception
+import mmagic.core.graph as graph
+import mmagic.core.index as index
+from mmagic.core.fields import MANDARIN_FIELDS
+
+# Import of word lists, e.g. the vocabulary of an HSK level, as new notes.
+#
+# A list has a word per line. Each line is split on whitespace, commas,
+# semicolons and quotes, and the first token that contains CJK is taken
+# whole, so words such as 卡拉OK keep their Latin part. CSV and
+# tab-separated lists with pinyin and English columns work too, and header
+# rows, comments and blank lines are skipped.
+#
+# plan_import drops the words that already have notes, looking each up in
+# the engine's word index, and can add the components of the new words
+# that have no notes either. Components come before the words made from
+# them, so every note is coloured correctly when it is added.
+#
+# The notes are then made in the three populate steps, with the dictionary
+# work done through the engine's cached lookup, a batch of words at a time
+# where possible (see Lookup.lookup_words), and queued in the engine's
+# BatchSession so that they are all added in one transaction:
+#
+#   plan = plan_import(engine, read_word_list(path), add_components=True)
+#   word_import = WordImport(engine, model)
+#   engine.begin_session()
+#   engine.get_lookup().lookup_words(plan.words)
+#   for word in plan.words:
+#       prepared = word_import.prepare(word)
+#       word_import.apply(word, prepared, word_import.compute(prepared))
+#   errors = engine.end_session()
+#
+# prepare, compute, compute_batch and apply fit the stages of a
+# job_runner.Job.
+
+# Splits a line into tokens. Covers the fullwidth separators used in
+# Chinese text as well as the ASCII ones.
+_SEPARATORS = re.compile(u'[\\s,;"\'\uff0c\u3001\uff1b]+', re.UNICODE)
+
+# Returns the first token in the line that contains CJK, or None.
+def parse_word(line):
+    for token in _SEPARATORS.split(line):
+        if token and cjk.scan_words(token):
+            return token
+    return None
+
+# Returns the words in the lines, each once, in the order they first appear.
+def parse_word_list(lines):
+    result = []
+    seen = set()
+    for line in lines:
+        word = parse_word(line)
+        if word is not None and word not in seen:
+            seen.add(word)
+            result.append(word)
+    return result
+
+def read_word_list(path):
+    with codecs.open(path, 'r', 'utf-8-sig') as lines:
+        return parse_word_list(lines)
+
+class ImportPlan:
+
+    def __init__(self):
+        # The words to add notes for, components first.
+        self.words = []
+        # Listed words that already have notes.
+        self.existing = []
+        # The words in 'words' that weren't listed but are components of
+        # ones that were.
+        self.components = []
+        # Problems working out the components.
+        self.errors = exception.ErrorCollector()
+
+# Returns an ImportPlan for the words. If 'add_components' is True, the
+# components of the new words that have no notes are added too, found as in
+# Engine.build_dependency_graph. Words caught up in a dependency cycle come
+# after the rest, and only if they were listed.
+def plan_import(engine, words, add_components=False):
+    plan = ImportPlan()
+    new_words = []
+    for word in words:
+        if engine.word_has_notes(word):
+            plan.existing.append(word)
+        else:
+            new_words.append(word)
+    if not add_components:
+        plan.words = new_words
+        return plan
+
+    dependency_graph = {}
+    for word in new_words:
+        try:
+            part, errors = engine.build_dependency_graph(word, dependency_graph)
+        except exception.MagicException as e:
+            plan.errors.append(e)
+            continue
+        plan.errors.append(errors)
+        dependency_graph.update(part)
+
+    # Within a level, listed words keep their order and components follow
+    # them.
+    positions = dict((word, position) for position, word in enumerate(new_words))
+    ordering = graph.sort_levels(dependency_graph,
+            key=lambda word: (positions.get(word, len(positions)), word))
+    plan.errors.append(ordering.get_errors())
+    listed = set(new_words)
+    for word in ordering.order():
+        if word in listed:
+            plan.words.append(word)
+        elif not engine.word_has_notes(word):
+            plan.words.append(word)
+            plan.components.append(word)
+    ordered = set(plan.words)
+    plan.words += [word for word in new_words if word not in ordered]
+    return plan
+
+# Raises MagicException unless notes of the type can hold Mandarin words.
+def check_model(collection, model):
+    if model is None:
+        raise exception.MagicException('No such note type.')
+    if model['id'] not in index.get_field_ordinals(collection, MANDARIN_FIELDS):
+        raise exception.MagicException(
+            u'The note type "%s" has no Mandarin field.'%model['name'])
+
+# Makes notes of the given type for the words of a plan. The notes go in the
+# Default deck.
+#
+# mmagic.core.populate needs zhonglib, so it is imported here rather than
+# at the top of the module. Word lists can be read and planned without it.
+class WordImport:
+
+    def __init__(self, engine, model):
+        self.engine = engine
+        self.model = model
+        self.deck_id = engine.get_collection().decks.id('Default')
+
+    # Collection side. Returns a (note, request) pair.
+    def prepare(self, word):
+        import mmagic.core.populate as populate
+        note = self.engine.new_mandarin_note(self.model, word, self.deck_id)
+        return (note, populate.read_request(note))
+
+    # Safe to call from a worker thread.
+    def compute(self, prepared):
+        import mmagic.core.populate as populate
+        note, request = prepared
+        with self.engine.profiler.timed('populate: compute'):
+            return populate.compute_updates(self.engine.get_lookup(), request)
+
+    # Like compute for a list of prepared notes, with their words looked up
+    # together.
+    def compute_batch(self, prepared_list):
+        import mmagic.core.populate as populate
+        with self.engine.profiler.timed('populate: compute batch'):
+            return populate.compute_batch(self.engine.get_lookup(),
+                    [request for note, request in prepared_list])
+
+    # Collection side. The note is added even if some of its fields couldn't
+    # be filled in. The problems are raised afterwards.
+    def apply(self, word, prepared, result):
+        note, request = prepared
+        updates, messages = result
+        try:
+            self.engine.finish_populating_note(note, updates, messages)
+        finally:
+            self.engine.add_new_note(note)
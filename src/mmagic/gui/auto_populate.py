@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import json
+import Queue
+import threading
+import weakref
+
+from PyQt4 import QtCore
+
+import mmagic.core.exception as exception
+import mmagic.core.populate as populate
+import mmagic.core.profiler as profiler
+from mmagic.core.notes import get_mandarin_text, get_field, set_field
+
+# Populates the note in the editor as the Mandarin field is typed in.
+#
+# Anki runs the 'editTimer' hook shortly after each change to a field. Once
+# the Mandarin text has stopped changing for DELAY milliseconds, it is
+# looked up on a worker thread through the engine's cached dictionary and
+# decomposition layer. The English, pinyin, measure word and decomposition
+# fields are then filled in and their components coloured, without
+# interrupting the typing.
+#
+# Each lookup is numbered. A result is only used if no lookup has been
+# asked for since and the note still has the text it was computed for.
+# Anything else is stale and thrown away.
+#
+# Only fields that are empty, or still hold what was filled in
+# automatically, are written. Anything the user typed is left alone.
+
+# Milliseconds without a change before the text is looked up.
+DELAY = 400
+
+# Milliseconds between checks for a finished lookup.
+POLL_INTERVAL = 50
+
+# Key in collection.conf.
+ENABLED_KEY = 'mmagic_auto_populate'
+
+class AutoPopulate:
+
+    def __init__(self, main_object):
+        self.main_object = main_object
+        # The editors that are open. Anki only tells us the note.
+        self.editors = weakref.WeakSet()
+        # Number of the latest lookup.
+        self.generation = 0
+        # The note and Mandarin text of the latest lookup.
+        self.note = None
+        self.text = None
+        # role -> the value the role's field was last filled in with
+        self.filled = {}
+        self.inputs = Queue.Queue()
+        self.results = Queue.Queue()
+        self.worker = None
+        # Lookups handed to the worker whose results haven't been collected.
+        self.in_flight = 0
+
+        self.delay = QtCore.QTimer()
+        self.delay.setSingleShot(True)
+        self.delay.timeout.connect(self.start_lookup)
+        self.poll = QtCore.QTimer()
+        self.poll.timeout.connect(self.check_results)
+
+    def is_enabled(self):
+        collection = self.main_object.get_collection()
+        return collection is not None and collection.conf.get(ENABLED_KEY, False)
+
+    def set_enabled(self, enabled):
+        collection = self.main_object.get_collection()
+        collection.conf[ENABLED_KEY] = enabled
+        collection.setMod()
+
+    def add_editor(self, editor):
+        self.editors.add(editor)
+
+    def find_editor(self, note):
+        for editor in self.editors:
+            if editor.note is note:
+                return editor
+        return None
+
+    # The 'editTimer' hook.
+    def note_edited(self, note):
+        if not self.is_enabled() or self.find_editor(note) is None:
+            return
+        try:
+            text = get_mandarin_text(note)
+        except exception.MagicException:
+            # Not a Mandarin note.
+            return
+        if note is self.note and text == self.text:
+            return
+        if note is not self.note:
+            self.filled = {}
+        self.note = note
+        self.text = text
+        # Anything under way is now stale.
+        self.generation += 1
+        if text:
+            self.delay.start(DELAY)
+        else:
+            self.delay.stop()
+
+    # Main thread
+    def start_lookup(self):
+        note = self.note
+        overwrite = [role for role, value in self.filled.iteritems()
+                     if self.field_value(note, role) == value]
+        try:
+            request = populate.read_request(note, overwrite)
+        except exception.MagicException:
+            return
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.work, name='mmagic-auto-populate')
+            self.worker.daemon = True
+            self.worker.start()
+        self.inputs.put((self.generation, note, request))
+        self.in_flight += 1
+        self.poll.start(POLL_INTERVAL)
+
+    # Worker thread. Every lookup gets a result. It is None if the lookup
+    # went stale while it was queued or failed.
+    def work(self):
+        while True:
+            generation, note, request = self.inputs.get()
+            result = None
+            if generation == self.generation:
+                try:
+                    with self.main_object.profiler.timed('populate: compute'):
+                        result = populate.compute_updates(
+                                self.main_object.get_lookup(), request)
+                except Exception as e:
+                    profiler.logger.warning('auto-populate of "%s" failed: %s',
+                            request.mandarin_text, e)
+            self.results.put((generation, note, request, result))
+
+    # Main thread
+    def check_results(self):
+        while self.in_flight > 0:
+            try:
+                generation, note, request, result = self.results.get_nowait()
+            except Queue.Empty:
+                return
+            self.in_flight -= 1
+            if result is not None and generation == self.generation and note is self.note:
+                self.apply(note, request, result)
+        self.poll.stop()
+
+    def apply(self, note, request, result):
+        editor = self.find_editor(note)
+        try:
+            if editor is None or get_mandarin_text(note) != request.mandarin_text:
+                return
+            updates, messages = result
+            old_fields = list(note.fields)
+            # The user may have typed in a field while the lookup ran. Only
+            # fields that are still empty, or still hold what was filled in,
+            # are written.
+            roles = [role for role in request.empty_roles
+                     if self.is_unchanged(note, role)]
+            # Fields filled in for earlier text that the new text has no
+            # value for are cleared.
+            for role in roles:
+                set_field(note, role, updates.get(role, u''))
+            self.main_object.refresh_status_colour(note)
+            for role in roles:
+                self.filled[role] = self.field_value(note, role)
+        except exception.MagicException as e:
+            profiler.logger.debug('auto-populate: %s', e)
+            return
+        # Only the fields that changed are redrawn, so the field being typed
+        # in keeps its cursor.
+        for ordinal, (old, new) in enumerate(zip(old_fields, note.fields)):
+            if old != new and ordinal != editor.currentField:
+                editor.web.eval('$("#f%d").html(%s);'%(ordinal, json.dumps(new)))
+
+    # True if the role's field is empty or holds what it was last filled in
+    # with.
+    def is_unchanged(self, note, role):
+        value = self.field_value(note, role)
+        return not (value or u'').strip() or value == self.filled.get(role)
+
+    def field_value(self, note, role):
+        try:
+            return get_field(note, role, strip_html=False)
+        except exception.MagicException:
+            return None
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+
+from PyQt4 import QtGui
+
+import aqt.utils
+
+# Shows the problems an action ran into: a count per category at the top and
+# the messages below, in a list that can be scrolled and saved to a file.
+
+class ErrorDialog(QtGui.QDialog):
+
+    # 'errors' is an ErrorCollector.
+    def __init__(self, errors, parent=None):
+        super(ErrorDialog, self).__init__(parent)
+        self.errors = errors
+        self.setWindowTitle('Mandarin Magic')
+        self.resize(600, 400)
+
+        summary = QtGui.QLabel(u'<br>'.join(
+            [u'The following problems were encountered:'] + errors.summary()), self)
+
+        self.details = QtGui.QPlainTextEdit(self)
+        self.details.setReadOnly(True)
+        self.details.setPlainText(u'\n'.join(self.detail_lines()))
+
+        buttons = QtGui.QHBoxLayout()
+        buttons.addStretch()
+        export = QtGui.QPushButton('Export...', self)
+        export.clicked.connect(self.export)
+        buttons.addWidget(export)
+        close = QtGui.QPushButton('Close', self)
+        close.clicked.connect(self.accept)
+        close.setDefault(True)
+        buttons.addWidget(close)
+
+        layout = QtGui.QVBoxLayout(self)
+        layout.addWidget(summary)
+        layout.addWidget(self.details)
+        layout.addLayout(buttons)
+
+    def detail_lines(self):
+        result = []
+        for number, (category, message) in enumerate(self.errors.get_problems()):
+            result.append(u'%d. [%s] %s'%(number + 1, category, message))
+        omitted = self.errors.omitted()
+        if omitted > 0:
+            result.append(u'... and %d more'%omitted)
+        return result
+
+    def export(self):
+        path = QtGui.QFileDialog.getSaveFileName(self, 'Export problems',
+                'mmagic-problems.txt', 'Text (*.txt)')
+        if not path:
+            return
+        try:
+            with codecs.open(unicode(path), 'w', 'utf-8') as output:
+                for line in self.errors.summary() + [u''] + self.detail_lines():
+                    output.write(line + u'\n')
+        except (IOError, OSError) as e:
+            aqt.utils.showInfo('Could not write the problems: %s'%e, self)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import Queue
+import threading
+import time
+
+from PyQt4 import QtCore, QtGui
+
+import mmagic.core.exception as exception
+
+# Runs long browser actions in small steps so that Anki stays responsive,
+# shows their progress and lets the user cancel them.
+#
+# A job works through a list of items (usually note ids). Each item goes
+# through up to three stages:
+#
+#   prepare(item)                   main thread. Reads whatever the compute
+#                                   stage needs from the collection.
+#   compute(prepared)               worker thread. Must not touch the
+#                                   collection. Used for dictionary and
+#                                   decomposition work.
+#   apply(item, prepared, result)   main thread. Writes to the collection.
+#
+# 'prepare' and 'compute' are optional. The main thread stages are run in
+# batches from a timer so that the event loop gets a look in between
+# batches.
+#
+# A job may also give compute_batch(prepared_list), which returns a list of
+# results. The worker then takes every item that is waiting for it at once,
+# so that work shared between items, such as dictionary lookups, is done
+# once per batch. If it raises, the items of the batch are computed one at
+# a time instead, so the problem is put down to the right item.
+#
+# An exception raised by a stage is added to job.errors and the item is
+# skipped, so one bad item doesn't stop the job. MagicExceptions keep their
+# category; anything else is reported as exception.OTHER.
+#
+# When the job is complete or cancelled, finish(cancelled) is called on the
+# main thread.
+
+class Job:
+
+    def __init__(self, title, items, apply, finish, prepare=None, compute=None,
+                 compute_batch=None):
+        self.title = title
+        self.items = list(items)
+        self.apply = apply
+        self.finish = finish
+        self.prepare = prepare
+        self.compute = compute
+        self.compute_batch = compute_batch
+        self.errors = exception.ErrorCollector()
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return '%ds'%seconds
+    return '%dm %02ds'%(seconds/60, seconds%60)
+
+class JobRunner:
+
+    # Number of items handled per timer tick.
+    BATCH_SIZE = 20
+    # Maximum number of items handed to the worker but not yet applied.
+    WINDOW_SIZE = 200
+
+    def __init__(self, job, parent):
+        self.job = job
+        self.total = len(job.items)
+        self.next_item = 0
+        self.done = 0
+        self.in_flight = 0
+        self.cancelled = threading.Event()
+        self.inputs = Queue.Queue()
+        self.results = Queue.Queue()
+        self.worker = None
+        self.start_time = None
+
+        self.dialog = QtGui.QProgressDialog(job.title, 'Cancel', 0, self.total, parent)
+        self.dialog.setWindowTitle('Mandarin Magic')
+        self.dialog.setWindowModality(QtCore.Qt.WindowModal)
+        self.dialog.setMinimumDuration(500)
+        self.dialog.canceled.connect(self.cancel)
+
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.tick)
+
+    def start(self):
+        self.start_time = time.time()
+        if self.job.compute is not None:
+            self.worker = threading.Thread(target=self.work, name='mmagic-job')
+            self.worker.daemon = True
+            self.worker.start()
+        self.timer.start(0)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def is_running(self):
+        return self.timer.isActive()
+
+    # Worker thread
+    def work(self):
+        while not self.cancelled.is_set():
+            entries = [self.inputs.get()]
+            if self.job.compute_batch is not None:
+                while len(entries) < self.BATCH_SIZE:
+                    try:
+                        entries.append(self.inputs.get_nowait())
+                    except Queue.Empty:
+                        break
+            if None in entries:
+                return
+            if len(entries) > 1:
+                try:
+                    results = self.job.compute_batch([prepared for item, prepared in entries])
+                except Exception:
+                    results = None
+                if results is not None:
+                    for (item, prepared), result in zip(entries, results):
+                        self.results.put((item, prepared, result, None))
+                    continue
+            for item, prepared in entries:
+                try:
+                    result, error = self.job.compute(prepared), None
+                except Exception as e:
+                    result, error = None, e
+                self.results.put((item, prepared, result, error))
+
+    def prepare(self, item):
+        if self.job.prepare is None:
+            return None
+        return self.job.prepare(item)
+
+    def apply(self, item, prepared, result):
+        try:
+            self.job.apply(item, prepared, result)
+        except Exception as e:
+            self.job.errors.append(e)
+        self.done += 1
+
+    def feed(self, limit):
+        while limit > 0 and self.next_item < self.total:
+            item = self.job.items[self.next_item]
+            self.next_item += 1
+            limit -= 1
+            try:
+                prepared = self.prepare(item)
+            except Exception as e:
+                self.job.errors.append(e)
+                self.done += 1
+                continue
+            if self.worker is None:
+                self.apply(item, prepared, None)
+            else:
+                self.inputs.put((item, prepared))
+                self.in_flight += 1
+
+    def drain(self, limit):
+        while limit > 0 and self.in_flight > 0:
+            try:
+                item, prepared, result, error = self.results.get_nowait()
+            except Queue.Empty:
+                return
+            self.in_flight -= 1
+            limit -= 1
+            if error is not None:
+                self.job.errors.append(error)
+                self.done += 1
+                continue
+            self.apply(item, prepared, result)
+
+    def tick(self):
+        if self.cancelled.is_set():
+            self.stop(True)
+            return
+        if self.worker is None:
+            self.feed(self.BATCH_SIZE)
+        else:
+            self.feed(min(self.BATCH_SIZE, self.WINDOW_SIZE - self.in_flight))
+            self.drain(self.BATCH_SIZE)
+        self.update_progress()
+        if self.done >= self.total:
+            self.stop(False)
+
+    def update_progress(self):
+        label = '%s\n%d of %d notes'%(self.job.title, self.done, self.total)
+        if self.done > 0:
+            elapsed = time.time() - self.start_time
+            remaining = elapsed / self.done * (self.total - self.done)
+            label += ', about %s remaining'%format_duration(remaining)
+        self.dialog.setLabelText(label)
+        self.dialog.setValue(self.done)
+
+    def stop(self, cancelled):
+        self.timer.stop()
+        if self.worker is not None:
+            self.cancelled.set()
+            self.inputs.put(None)
+        # Disconnect first. Closing the dialog would otherwise count as
+        # cancelling it.
+        self.dialog.canceled.disconnect(self.cancel)
+        self.dialog.reset()
+        self.dialog.hide()
+        self.job.finish(cancelled)
+
+# Runs a job to completion without a progress dialog or worker thread. Used
+# where there is no event loop to return to, e.g. in benchmarks.
+def run_synchronously(job):
+    for item in job.items:
+        try:
+            prepared = job.prepare(item) if job.prepare is not None else None
+            result = job.compute(prepared) if job.compute is not None else None
+            job.apply(item, prepared, result)
+        except Exception as e:
+            job.errors.append(e)
+    job.finish(False)
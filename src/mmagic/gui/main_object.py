@@ -1,287 +1,72 @@
 # -*- coding: utf-8 -*-
 
-import operator
+import logging
+import threading
+import time
 
-from PyQt4 import QtGui
+from PyQt4 import QtCore, QtGui
 from PyQt4.QtGui import QPushButton
 
 import aqt.utils
-import anki.notes
-import anki.utils
 import mmagic.core.exception as exception
-import zhonglib as zl
-
-# All this stuff should be moved to core
-MANDARIN_FIELDS=frozenset({'Front', u'漢字', 'Hanzi', 'Chinese', 'Mandarin', 'Radical'})
-ENGLISH_FIELDS=frozenset({'Back', 'English', 'Meaning'})
-PINYIN_FIELDS=frozenset({u'拼音', u'pīnyīn', u'Pīnyīn', 'Pinyin', 'Pronunciation'})
-DECOMPOSITION_FIELDS=frozenset({'Decomposition'})
-MEASURE_WORD_FIELDS=frozenset({'Measure Word', 'Measure Words', 'Classifier', 'Classifiers', u'量詞'})
-
-#------------------------------------------------------------------------------
-#
-
-# From a set of possible field names, this function returns the actual field
-# used in a particular note.
-#
-# MagicException is thrown if there is no matching field or there is more than
-# one match.
-def calculate_field_name(note, possible_fields):
-    # Have to make this is a mutable set. Hence the explicit construction.
-    candidates = set(possible_fields & set(note.keys()))
-    if len(candidates) > 1:
-        note_type = note.model()['name']
-        message ='Note type "' + note_type + '" has the following fields: '
-        message += '"%s"'%candidates.pop()
-        while len(candidates) > 0:
-            message += ', "%s"'%candidates.pop()
-        message += '. It should have at most one of them.'
-        raise exception.MagicException(message)
-    if len(candidates) == 0:
-        note_type = note.model()['name']
-        message = 'Note type "' + note_type + '" does not have any of the following fields: '
-        field_set = set(possible_fields)
-        message += '"%s"'%field_set.pop()
-        while len(field_set) > 0:
-            message += ', "%s"'%field_set.pop()
-        message += '. It should have one of them.'
-        raise exception.MagicException(message)
-    return candidates.pop()
-
-#------------------------------------------------------------------------------
-# Field access
-
-def get_field(note, fields, fail_if_empty=False, strip_html=True):
-    result = note[calculate_field_name(note, fields)]
-    if fail_if_empty and len(result) == 0:
-        field_name = calculate_field_name(note, fields)
-        raise exception.MagicException(field_name + ' field is empty')
-    if strip_html:
-        result = anki.utils.stripHTML(result)
-    return result
-
-def has_field(note, fields):
-    return len(set(note.keys()) & fields) > 0
-
-def has_empty_field(note, fields):
-    return has_field(note, fields)\
-            and len(get_field(note, fields, strip_html=True)) == 0
-
-def set_field(note, fields, value):
-    note[calculate_field_name(note, fields)] = value
-
-def get_mandarin_text(note, fail_if_empty=False):
-    return get_field(note, MANDARIN_FIELDS, fail_if_empty).strip().rstrip()
-
-def set_mandarin_field(note, value):
-    set_field(note, MANDARIN_FIELDS, value)
-
-def get_english_definition(note, fail_if_empty=False):
-    return get_field(note, ENGLISH_FIELDS, fail_if_empty)
-
-def has_english_field(note):
-    return has_field(note, ENGLISH_FIELDS)
-
-def has_empty_english_field(note):
-    return has_empty_field(note, ENGLISH_FIELDS)
-
-def set_english_field(note, value):
-    set_field(note, ENGLISH_FIELDS, value)
-
-#------------------------------------------------------------------------------
-# Pinyin
-
-def has_pinyin_field(note):
-    return has_field(note, PINYIN_FIELDS)
-
-def has_empty_pinyin_field(note):
-    return has_empty_field(note, PINYIN_FIELDS)
-
-def set_pinyin_field(note, value):
-    set_field(note, PINYIN_FIELDS, value)
-
-def get_pinyin_field(note):
-    return get_field(note, PINYIN_FIELDS)
-
-#------------------------------------------------------------------------------
-# Measure word
-
-def has_measure_word_field(note):
-    return has_field(note, MEASURE_WORD_FIELDS)
-
-def has_empty_measure_word_field(note):
-    return has_empty_field(note, MEASURE_WORD_FIELDS)
-
-def get_measure_word_field(note):
-    return get_field(note, MEASURE_WORD_FIELDS)
-
-def set_measure_word_field(note, value):
-    set_field(note, MEASURE_WORD_FIELDS, value)
-
-#------------------------------------------------------------------------------
-# Decomposition
-
-def has_decomposition_field(note):
-    return has_field(note, DECOMPOSITION_FIELDS)
-
-def has_empty_decomposition_field(note):
-    return has_empty_field(note, DECOMPOSITION_FIELDS)
-
-def set_decomposition_field(note, value):
-    set_field(note, DECOMPOSITION_FIELDS, value)
-
-def get_decomposition_field(note, fail_if_empty=False):
-    return get_field(note, DECOMPOSITION_FIELDS, fail_if_empty)
-
-#------------------------------------------------------------------------------
-# Note search
-
-def find_notes(collection, field_set, value):
-    result = []
-    for field in field_set:
-        notes = collection.findNotes('%s:"%s"'%(field,value))
-        result += notes
-    return result
-
-def find_note_ids_for_word(collection, word):
-    return find_notes(collection, MANDARIN_FIELDS, word)
-
-def note_exists_for_mandarin(collection, word):
-    return len(find_note_ids_for_word(collection, word)) > 0
-
-#------------------------------------------------------------------------------
-# Formatting routines
-
-def format_list(the_list):
-    if len(the_list) == 0:
-        return ''
-    result = ''
-    assert len(the_list) > 0
-    result += the_list[0]
-    for idx in xrange(1, len(the_list)):
-        result += ', ' + the_list[idx]
-    return result
-
-def format_entry_english(entry):
-    result = entry.english[0]
-    for idx in xrange(1, len(entry.english)):
-        result += "; "
-        result += entry.english[idx]
-    return result
-
-def format_english(dictionary_entries):
-    if len(dictionary_entries) == 1:
-        result = format_entry_english(dictionary_entries[0])
-    else:
-        # Each entry is put on a separate line with an integer identifier.
-        result = '[1] ' + format_entry_english(dictionary_entries[0])
-        for idx in xrange(1, len(dictionary_entries)):
-            id = idx+1
-            result += '<br>['+str(id)+'] ' + format_entry_english(dictionary_entries[idx])
-    return result
-
-def format_pinyin(text):
-    return zl.format_pinyin_sequence(zl.parse_cedict_pinyin(text))
-
-def format_pinyin_list(dictionary_entries):
-    if len(dictionary_entries) == 1:
-        result = format_pinyin(dictionary_entries[0].pinyin)
-    else:
-        # Each goes on a separate line with an integer identifier that matches
-        # that in English field.
-        result = '[1] ' + format_pinyin(dictionary_entries[0].pinyin)
-        for idx in xrange(1, len(dictionary_entries)):
-            id = idx+1
-            result += '<br>['+str(id)+'] ' + format_pinyin(dictionary_entries[idx].pinyin)
-    return result
-
-def format_entry_measure_words(is_first, ordinal, dictionary_entry):
-    measure_words = dictionary_entry.traditional_measure_words
-    if len(measure_words) == 0:
-        return ''
-    result = ''
-    if not is_first:
-        result += '<br>'
-    result += '[' + str(ordinal) + '] ' + format_list(measure_words)
-    return result
-
-def format_measure_words(dictionary_entries):
-    if len(dictionary_entries) == 1:
-        result = format_list(dictionary_entries[0].traditional_measure_words)
-    else:
-        # Each goes on a separate line with an integer identifier that matches
-        # that in English field.
-        result = ''
-        is_first = True
-        for idx in xrange(0, len(dictionary_entries)):
-            formatted_measure_words = format_entry_measure_words(\
-                is_first,\
-                idx+1,\
-                dictionary_entries[idx]
-            )
-            result += formatted_measure_words
-            is_first = len(formatted_measure_words) == 0
-    return result
-
-def add_highlight(text, colour):
-    return '<font color='+colour+'>'+text +'</font>'
-
-def add_missing_note_highlight(text):
-    return add_highlight(text, 'red')
-
-def format_decomposition(decomposition):
-    if len(decomposition) == 0:
-        return 'None'
-    return format_list(decomposition)
-
-# Returns the decomposition components as a list. A new list is returned. It
-# can be modified by the client.
-#
-# If the field is 'None' an empty list is returned.
-#
-# If the field is empty, None is returned.
-
-def get_decomposition_list(note):
-    field = get_decomposition_field(note)
-    field = anki.utils.stripHTML(field.strip().rstrip())
-    if len(field) == 0:
-        return None
-    if field == 'None':
-        return []
-    pattern, words = zl.extract_cjk(field)
-    return list(words)
-
-def get_measure_word_list(note):
-    field = get_measure_word_field(note)
-    field = anki.utils.stripHTML(field.strip().rstrip())
-    if len(field) == 0:
-        return []
-    pattern, words = zl.extract_cjk(field)
-    return list(words)
-
-# exception must be an instance of MagicException or its subclasses
-def show_error(exception):
-    # Use a set to avoid duplicates. Use a list to support indexing.
-    all_messages = list(set(exception.get_message_list()))
+import mmagic.core.health as health
+import mmagic.core.populate as populate
+import mmagic.core.profiler as profiler
+import mmagic.core.reorder as reorder
+import mmagic.core.skritter as skritter
+import mmagic.core.word_list as word_list
+import mmagic.gui.auto_populate as auto_populate
+import mmagic.gui.error_dialog as error_dialog
+import mmagic.gui.job_runner as job_runner
+import mmagic.gui.profiler_dialog as profiler_dialog
+from mmagic.core.engine import Engine
+from mmagic.core.notes import get_mandarin_text
+
+# error must be an instance of MagicException or its subclasses. A single
+# problem is shown in a message box, several in an ErrorDialog.
+def show_error(error):
+    errors = exception.ErrorCollector()
+    errors.append(error)
     # No Messages
-    if len(all_messages) == 0:
+    if len(errors) == 0:
         return
     # Single error only
-    if len(all_messages) == 1:
-        aqt.utils.showInfo(all_messages[0])
+    if len(errors) == 1:
+        aqt.utils.showInfo(errors.get_message_list()[0])
         return
     # Multiple errors
-    display_message = u"The following problems were encountered:<br>"
-    # Prepend an ordinal to each message.
-    for idx in xrange(len(all_messages)):
-        display_message += "<br>" + str(idx+1) + ". " + all_messages[idx]
-    aqt.utils.showInfo(display_message)
+    error_dialog.ErrorDialog(errors, aqt.mw).exec_()
 
-class MainObject:
+# The add-on's GUI: browser actions and editor buttons on top of the core
+# Engine. The engine works on whichever collection is open in the main
+# window.
+
+class MainObject(Engine):
 
     def __init__(self, anki_main_window):
+        Engine.__init__(self)
         self.mw = anki_main_window
-        self.dictionary = zl.standard_dictionary()
+        self.job_runner = None
+        # Keeps the latest log messages for the profiler dialog.
+        self.recent_records = profiler.RecentRecords()
+        profiler.logger.addHandler(self.recent_records)
+        profiler.logger.setLevel(logging.INFO)
+        self.auto_populate = auto_populate.AutoPopulate(self)
+
+    def get_collection(self):
+        return self.mw.col
+
+    # Dependents are recoloured once control returns to the event loop.
+    def schedule_recolour(self, words):
+        if words and not self.recolour_words:
+            QtCore.QTimer.singleShot(0, self.recolour_dependents)
+        Engine.schedule_recolour(self, words)
+
+    def recolour_dependents(self):
+        updated = Engine.recolour_dependents(self)
+        if updated > 0:
+            self.mw.requireReset()
+        return updated
 
     def add_browser_action(self, name, callback, browser):
         action = QtGui.QAction(name, self.mw)
@@ -299,6 +84,26 @@ class MainObject:
             lambda: self.export_to_skritter(browser),
             browser)
 
+        self.add_browser_action(
+            "Export to Skritter again",
+            lambda: self.export_to_skritter(browser, include_exported=True),
+            browser)
+
+        self.add_browser_action(
+            "Export to Skritter files...",
+            lambda: self.export_to_skritter_files(browser),
+            browser)
+
+        self.add_browser_action(
+            "Forget Skritter exports",
+            lambda: self.forget_skritter_exports(browser),
+            browser)
+
+        self.add_browser_action(
+            "Skritter section size...",
+            lambda: self.set_skritter_section_size(browser),
+            browser)
+
         self.add_browser_action(
             "Mark cards with empty dependencies",
             lambda: self.mark_cards_with_empty_dependencies(browser),
@@ -319,160 +124,233 @@ class MainObject:
             lambda: self.add_missing_dependencies(browser),
             browser)
 
-    def get_note(self, note_id):
-        return self.mw.col.getNote(note_id)
+        self.add_browser_action(
+            "Import word list...",
+            lambda: self.import_word_list(browser),
+            browser)
+
+        self.add_browser_action(
+            "Order new cards by dependency",
+            lambda: self.order_new_cards(browser),
+            browser)
+
+        self.add_browser_action(
+            "Collection health report",
+            lambda: self.show_health_report(browser),
+            browser)
 
-    # Returns a pair: (result, errors)
-    def get_transitive_dependencies(self, note_id, depth=0):
-        all_notes = [note_id]
-        all_errors = exception.MultiException()
+        self.add_browser_action(
+            "Refresh status colours",
+            lambda: self.refresh_all_status_colours(browser),
+            browser)
 
-        try:
-            note = self.get_note(note_id)
-            dependencies = get_decomposition_list(note)
-            if dependencies == None:
-                msg = '"%s" has missing component list'%get_mandarin_text(note)
-                raise exception.MagicException(msg)
-            for dependency in dependencies:
-                note_ids = find_note_ids_for_word(self.mw.col, dependency)
-                if len(note_ids) > 1:
-                    all_errors.append(exception.TooManyNotes(dependency))
-                    continue
-                if len(note_ids) == 0:
-                    all_errors.append(exception.MagicException('No note for "%s"'%dependency))
-                    continue
-                dependency_id = note_ids[0]
-                notes, errors = self.get_transitive_dependencies(dependency_id, depth+1)
-                all_notes += notes
-                all_errors.append(errors)
-        except exception.MagicException as e:
-            all_errors.append(e)
-        return (all_notes, all_errors)
+        self.add_browser_action(
+            "Mandarin Magic profile...",
+            lambda: self.show_profiler(browser),
+            browser)
 
-    def add_tag(self, browser, note_ids, tag):
+    # Only one job runs at a time. Jobs share the collection and the browser
+    # selection, so running two at once would only lead to confusion.
+    #
+    # Each job is an operation, so the notes it reads are loaded in bulk and
+    # cached until it finishes. If the job's items are note ids, they are
+    # loaded up front. A job started from the finish callback of another is
+    # part of the same operation.
+    #
+    # If 'batch' is True, a session is opened for the job. Its finish
+    # callback must call commit_session.
+    #
+    # Each job is timed, from the start to the end of its finish callback.
+    def run_job(self, job, parent, batch=False, items_are_notes=True):
+        if self.job_runner is not None and self.job_runner.is_running():
+            aqt.utils.showInfo('Another Mandarin Magic action is still running.', parent)
+            return
+        start = time.time()
+        profiler.logger.info('%s: %d items', job.title, len(job.items))
+        self.begin_operation(job.items if items_are_notes else ())
+        if batch:
+            self.begin_session()
+        finish = job.finish
+
+        def finish_operation(cancelled):
+            try:
+                finish(cancelled)
+            finally:
+                self.end_operation()
+                seconds = time.time() - start
+                self.profiler.record('action: ' + job.title, seconds)
+                profiler.logger.info('%s: %s after %.3fs with %d problems', job.title,
+                        'cancelled' if cancelled else 'finished', seconds, len(job.errors))
+
+        job.finish = finish_operation
+        self.start_job(job, parent)
+
+    def start_job(self, job, parent):
+        self.job_runner = job_runner.JobRunner(job, parent)
+        self.job_runner.start()
+
+    # Starts loading the dictionary on a background thread so that it is
+    # ready by the time the user asks for it. Otherwise, it is loaded on
+    # first use.
+    def warm_up(self):
+        if self.lookup is not None:
+            return
+        thread = threading.Thread(target=self.load_dictionary, name='mmagic-warm-up')
+        thread.daemon = True
+        thread.start()
+
+    # Commits the open session with a single browser reset, main window
+    # reset and editor refresh. Shows any problems.
+    def commit_session(self, browser):
+        if not self.session.has_changes():
+            show_error(self.end_session())
+            return
         # Code taken from anki/aqt/browser.py(addTags method).
         # This is a bit nasty because I'm using the "browser.model" field,
         # which is really a private field.
         browser.model.beginReset()
-        self.mw.col.tags.bulkAdd(note_ids, tag)
+        errors = self.end_session()
         browser.model.endReset()
         self.mw.requireReset()
+        # Refresh the editor
+        browser.editor.setNote(browser.editor.note)
+        show_error(errors)
 
-    # Returns (result, errors pair) where result is a dictionary with
-    # the word as key and the note_id as value
-    def get_note_ids_for_words(self, words):
-        result = {}
-        errors = exception.MultiException()
-        for word in words:
-            note_ids = find_note_ids_for_word(self.mw.col, word)
-            if len(note_ids) > 1:
-                errors.append(exception.TooManyNotes(word))
-                continue
-            if len(note_ids) == 0:
-                errors.append(exception.MagicException('No note for "%s"'%word))
-                continue
-            result[word] = note_ids[0]
-        return (result, errors)
-
-    def word_has_notes(self, word):
-        return len(find_note_ids_for_word(self.mw.col, word)) > 0
-
-    def note_has_empty_dependencies(self, note_id):
-        return get_decomposition_list(self.get_note(note_id)) == None
+    def add_tag(self, browser, note_ids, tag):
+        self.begin_session()
+        self.add_tags(note_ids, tag)
+        self.commit_session(browser)
 
     def mark_cards_with_empty_dependencies(self, browser):
         selected_notes = browser.selectedNotes()
         if not selected_notes:
             aqt.utils.showInfo("No notes selected.", browser)
             return
-        errors = exception.MultiException()
         notes_to_mark = []
-        for note_id in selected_notes:
-            try:
-                if self.note_has_empty_dependencies(note_id):
-                    notes_to_mark.append(note_id)
-            except exception.MagicException as e:
-                errors.append(e)
-        print 'marking notes:',notes_to_mark
-        self.add_tag(browser, notes_to_mark, 'marked')
-        show_error(errors)
 
-    def note_has_missing_dependencies(self, note_id):
-        result = False
-        dependencies = []
-        note = self.get_note(note_id)
-        if has_decomposition_field(note):
-            field = get_decomposition_field(note)
-            pattern, words = zl.extract_cjk(field)
-            dependencies += words
-        if has_measure_word_field(note):
-            field = get_measure_word_field(note)
-            pattern, words = zl.extract_cjk(field)
-            dependencies += words
-        notes_exist = map(lambda word: self.word_has_notes(word), dependencies)
-        all_exist = reduce(operator.and_, notes_exist, True)
-        print 'notes_exist:',notes_exist
-        print 'all_exist:',all_exist
-
-        result = not all_exist
-        print 'result:', result
-        return result
+        def apply(note_id, prepared, result):
+            if self.note_has_empty_dependencies(note_id):
+                notes_to_mark.append(note_id)
+
+        def finish(cancelled):
+            if not cancelled:
+                profiler.logger.debug('marking notes: %s', notes_to_mark)
+                self.add_tag(browser, notes_to_mark, 'marked')
+            show_error(job.errors)
+
+        job = job_runner.Job('Marking cards with empty dependencies',
+                selected_notes, apply, finish)
+        self.run_job(job, browser)
 
     def mark_cards_with_missing_dependencies(self, browser):
         selected_notes = browser.selectedNotes()
         if not selected_notes:
             aqt.utils.showInfo("No notes selected.", browser)
             return
-        errors = exception.MultiException()
         notes_to_mark = []
-        for note_id in selected_notes:
-            try:
-                if self.note_has_missing_dependencies(note_id):
-                    notes_to_mark.append(note_id)
-            except exception.MagicException as e:
-                errors.append(e)
-        print 'marking notes:',notes_to_mark
-        self.add_tag(browser, notes_to_mark, 'marked')
-        show_error(errors)
+
+        def apply(note_id, prepared, result):
+            if self.note_has_missing_dependencies(note_id):
+                notes_to_mark.append(note_id)
+
+        def finish(cancelled):
+            if not cancelled:
+                profiler.logger.debug('marking notes: %s', notes_to_mark)
+                self.add_tag(browser, notes_to_mark, 'marked')
+            show_error(job.errors)
+
+        job = job_runner.Job('Marking cards with missing dependencies',
+                selected_notes, apply, finish)
+        self.run_job(job, browser)
 
     def add_missing_dependencies(self, browser):
         selected_notes = browser.selectedNotes()
         if not selected_notes:
             aqt.utils.showInfo("No notes selected.", browser)
             return
-        errors = exception.MultiException()
-        for note_id in selected_notes:
+
+        # One dependency graph is built for the whole selection. Then the
+        # missing words are added in dependency order, each one once.
+        dependency_graph = {}
+        models = {}
+        notes = []
+
+        def apply(note_id, prepared, result):
+            note = self.get_note(note_id)
+            notes.append(note)
+            self.add_to_dependency_graph(note, dependency_graph, models)
+
+        def finish(cancelled):
+            if cancelled:
+                self.end_session()
+                show_error(job.errors)
+                return
             try:
-                note = self.get_note(note_id)
-                self.add_missing_dependencies_for_note(note)
+                words = [get_mandarin_text(note) for note in notes]
+                missing_words, missing_errors = self.get_missing_words(dependency_graph, words)
+                job.errors.append(missing_errors)
             except exception.MagicException as e:
-                errors.append(e)
-        # Refresh editor
-        browser.editor.setNote(browser.editor.note)
-        show_error(errors)
+                job.errors.append(e)
+                missing_words = []
+            self.add_missing_words(browser, notes, missing_words, models, job.errors)
+
+        job = job_runner.Job('Collecting dependencies',
+                selected_notes, apply, finish)
+        self.run_job(job, browser, batch=True)
+
+    # The second half of add_missing_dependencies. 'errors' holds the
+    # problems found so far.
+    def add_missing_words(self, browser, notes, missing_words, models, errors):
+        self.get_lookup().lookup_words(missing_words)
+
+        def apply(word, prepared, result):
+            self.add_mandarin_note(models[word], word)
+
+        def finish(cancelled):
+            # Whatever was done before a cancel is kept. The colours of the
+            # selected notes are updated to match.
+            for note in notes:
+                self.refresh_status_colour(note)
+                self.flush_note(note)
+            self.commit_session(browser)
+            errors.append(job.errors)
+            show_error(errors)
+
+        job = job_runner.Job('Adding missing dependencies',
+                missing_words, apply, finish)
+        self.run_job(job, browser, items_are_notes=False)
 
     def mark_all_dependencies(self, browser):
         selected_notes = browser.selectedNotes()
         if not selected_notes:
             aqt.utils.showInfo("No notes selected.", browser)
             return
-        all_errors = exception.MultiException()
-        all_notes = list(selected_notes)
-        for note_id in selected_notes:
-            notes, errors = self.get_transitive_dependencies(note_id)
-            all_notes += notes
-            all_errors.append(errors)
-        self.add_tag(browser, all_notes, 'marked')
-        show_error(all_errors)
-
-    def export_to_skritter(self, browser):
-        # Generate the dependency graph and then sort topologically.
-
-        # Generate the dependency graph.
-        #
-        # We have to add all the selected characters and all the characters
-        # they depend on to the graph.
-
+        # Shared by all the selected notes so that common dependencies are
+        # only walked and reported once.
+        visited = set()
+        reported_words = set()
+        all_notes = []
+
+        def apply(note_id, prepared, result):
+            notes, errors = self.get_transitive_dependencies(
+                    [note_id], visited, reported_words)
+            all_notes.extend(notes)
+            job.errors.append(errors)
+
+        def finish(cancelled):
+            if not cancelled:
+                self.add_tag(browser, all_notes, 'marked')
+            show_error(job.errors)
+
+        job = job_runner.Job('Marking all dependencies',
+                selected_notes, apply, finish)
+        self.run_job(job, browser)
+
+    # Exports the selected words to Skritter. If 'path' is None, the
+    # sections are copied to the clipboard one at a time. Otherwise they are
+    # all written to files. Words exported before are left out unless
+    # 'include_exported' is True. See mmagic.core.skritter.
+    def export_to_skritter(self, browser, path=None, include_exported=False):
         selected_notes = browser.selectedNotes()
         if not selected_notes:
             aqt.utils.showInfo("No notes selected.", browser)
@@ -480,102 +358,293 @@ class MainObject:
 
         # Export words selected in browser.
         words = []
-        for note_id in selected_notes:
-            note = self.get_note(note_id)
+
+        def apply(note_id, prepared, result):
+            note = self.get_note_view(note_id)
             words.append(get_mandarin_text(note))
 
-        # Only export characters (although Skitter seems to work for words
-        # too).
-        #selected_characters = set(filter(lambda word: len(word) == 1, words))
+        def finish(cancelled):
+            if cancelled:
+                return
+            if len(job.errors) > 0:
+                show_error(job.errors)
+                return
+            self.export_words_to_skritter(browser, words, path, include_exported)
 
-        words_and_ids, errors = self.get_note_ids_for_words(words)
+        job = job_runner.Job('Collecting words for Skritter',
+                selected_notes, apply, finish)
+        self.run_job(job, browser)
 
-        if len(errors) > 0:
-            show_error(errors)
+    # Takes the selected words out of the Skritter ledger and removes their
+    # exported tag, so that the next export includes them again.
+    def forget_skritter_exports(self, browser):
+        selected_notes = browser.selectedNotes()
+        if not selected_notes:
+            aqt.utils.showInfo("No notes selected.", browser)
             return
 
-        # Now, generate the dependency graph.
-        dependency_graph = {}
-        for word, note_id in words_and_ids.iteritems():
-            note = self.get_note(note_id)
+        words = []
 
-            # Now get the dependencies for the note but only include
-            # characters that are in the selected characters.
-            dependencies = get_decomposition_list(note)
-            dependencies = filter(lambda d: d in words, dependencies)
+        def apply(note_id, prepared, result):
+            note = self.get_note_view(note_id)
+            words.append(get_mandarin_text(note))
 
-            dependency_graph[word] = dependencies
+        def finish(cancelled):
+            if cancelled:
+                return
+            ledger = skritter.ExportLedger(self.get_collection())
+            self.begin_session()
+            skritter.forget_exports(self, ledger, words, selected_notes)
+            self.commit_session(browser)
+            if len(job.errors) > 0:
+                show_error(job.errors)
+                return
+            aqt.utils.showInfo('%d notes will be exported to Skritter again.'%len(selected_notes), browser)
 
-        # Sort topologically
-        for_export = zl.topological_sort(dependency_graph)
-        # Remove any characters that have already been exported
-        #for_export = filter(lambda c: c not in already_exported, for_export)
+        job = job_runner.Job('Forgetting Skritter exports',
+                selected_notes, apply, finish)
+        self.run_job(job, browser)
 
-        if len(for_export) == 0:
-            aqt.utils.showInfo('There are no characters to export. They may have already been exported. Check tags.', browser)
+    def export_to_skritter_files(self, browser):
+        path = QtGui.QFileDialog.getSaveFileName(browser, 'Export to Skritter',
+                'skritter.txt', 'One file per section (*.txt);;One table (*.tsv)')
+        if not path:
             return
+        self.export_to_skritter(browser, unicode(path))
 
-        # Now copy characters to clipboad so that they can be pasted in to
-        # Skritter. Skritter has a 200 word limit per section, so we only
-        # copy max 200 characters at a time.  After each section, we wait
-        # for the user to prompt us for the next batch.
+    def set_skritter_section_size(self, browser):
+        collection = self.get_collection()
+        section_size, ok = QtGui.QInputDialog.getInt(browser, 'Skritter',
+                'Words per section:', skritter.get_section_size(collection), 1)
+        if ok:
+            skritter.set_section_size(collection, section_size)
 
-        section_size = 200
-        def export(section):
-            print 'len(section):',len(section)
-            assert len(section) <= section_size
-            text = unicode()
-            for c in section:
-                text += c + '\n'
-
-            QtGui.QApplication.clipboard().setText(text)
+    def export_words_to_skritter(self, browser, words, path=None, include_exported=False):
+        ledger = skritter.ExportLedger(self.get_collection())
+        try:
+            export = skritter.prepare_export(self, words, ledger, include_exported)
+        except exception.MagicException as e:
+            show_error(e)
+            return
 
-            ids = map(lambda word: words_and_ids[word], section)
-            print 'adding export_to_skritter to', ids
-            self.add_tag(browser, ids, 'exported_to_skritter')
+        if len(export.words) == 0:
+            aqt.utils.showInfo('There are no characters to export. %d have already been exported.'%export.skipped, browser)
+            return
 
+        section_size = skritter.get_section_size(self.get_collection())
 
-        while len(for_export) > section_size:
+        # The words of each section are recorded in the ledger and their
+        # notes tagged as the section is exported. The tags for all the
+        # sections are written in one go at the end.
+        def exported(section):
+            ledger.record(section)
+            self.add_tags(export.note_ids_for(section), skritter.EXPORTED_TAG)
 
-            section = for_export[0:section_size]
-            for_export = for_export[section_size:]
+        def tracked(sections):
+            for section in sections:
+                yield section
+                exported(section)
 
-            export(section)
+        self.begin_session()
+        if path is not None:
+            try:
+                paths = skritter.write_sections(path, tracked(export.sections(section_size)))
+            except (IOError, OSError) as e:
+                self.commit_session(browser)
+                show_error(exception.MagicException('Could not write "%s": %s'%(path, e)))
+                return
+            self.commit_session(browser)
+            aqt.utils.showInfo('%d characters written to %d files.'%(len(export.words), len(paths)), browser)
+            return
 
-            result = aqt.utils.askUser('%s characters copied to clipboard.  There are more characters remaining. Press OK when you want more characters to be copied.'%section_size, browser)
+        # Copy the sections to the clipboard so that they can be pasted in
+        # to Skritter. After each section, we wait for the user to prompt
+        # us for the next one.
+        sections = list(export.sections(section_size))
+        for index, section in enumerate(sections):
+            QtGui.QApplication.clipboard().setText(skritter.format_section(section))
+            exported(section)
+            if index == len(sections) - 1:
+                break
+            result = aqt.utils.askUser('%s characters copied to clipboard.  There are more characters remaining. Press OK when you want more characters to be copied.'%len(section), browser)
             if not result:
+                # The sections copied so far still count as exported.
+                self.commit_session(browser)
                 return
 
-        assert len(for_export) <= section_size
-        export(for_export)
-        aqt.utils.showInfo("%s characters copied to clipboard for pasting into Skritter."%len(for_export), browser)
+        self.commit_session(browser)
+        aqt.utils.showInfo("%s characters copied to clipboard for pasting into Skritter."%len(sections[-1]), browser)
 
-        print 'exiting exported_to_skritter'
-        # Refresh editor
-        browser.editor.setNote(browser.editor.note)
+    # Adds notes of the current note type for the words in a list that don't
+    # have any, optionally with their missing components. The notes are
+    # populated as they are made and added in one go at the end. See
+    # mmagic.core.word_list.
+    def import_word_list(self, browser, path=None, add_components=None):
+        collection = self.get_collection()
+        model = collection.models.current()
+        try:
+            word_list.check_model(collection, model)
+        except exception.MagicException as e:
+            show_error(e)
+            return
+        if path is None:
+            path = QtGui.QFileDialog.getOpenFileName(browser, 'Import word list',
+                    '', 'Word lists (*.txt *.csv *.tsv);;All files (*)')
+            if not path:
+                return
+            path = unicode(path)
+        words = word_list.read_word_list(path)
+        if not words:
+            aqt.utils.showInfo("No words found in the list.", browser)
+            return
+        if add_components is None:
+            add_components = aqt.utils.askUser(
+                    "Also add notes for the components of the new words that have none?", browser)
 
+        self.begin_operation()
+        try:
+            plan = word_list.plan_import(self, words, add_components)
+        finally:
+            self.end_operation()
+        if not plan.words:
+            aqt.utils.showInfo("All %d words already have notes."%len(words), browser)
+            return
+        word_import = word_list.WordImport(self, model)
+
+        def finish(cancelled):
+            # Whatever was done before a cancel is kept.
+            self.commit_session(browser)
+            plan.errors.append(job.errors)
+            show_error(plan.errors)
+            if not cancelled:
+                aqt.utils.showInfo('%d words and %d components imported. %d words already had notes.'%(
+                    len(plan.words) - len(plan.components), len(plan.components),
+                    len(plan.existing)), browser)
+
+        job = job_runner.Job('Importing words', plan.words, word_import.apply, finish,
+                word_import.prepare, word_import.compute, word_import.compute_batch)
+        self.run_job(job, browser, batch=True, items_are_notes=False)
+
+    # Repositions the new cards of the selected notes, or of every Mandarin
+    # note if none are selected, so that components come up before the words
+    # made from them. See mmagic.core.reorder.
+    def order_new_cards(self, browser):
+        note_ids = browser.selectedNotes()
+        if not note_ids:
+            if not aqt.utils.askUser("No notes selected. Order the new cards of every Mandarin note?", browser):
+                return
+            self.check_indexes()
+            note_ids = self.get_word_index().note_ids()
+        with self.profiler.timed('order new cards'):
+            reordering = reorder.plan(self.get_collection(), note_ids)
+            browser.model.beginReset()
+            changed = reorder.apply(self.get_collection(), reordering)
+            browser.model.endReset()
+        self.mark_indexes_current()
+        if changed > 0:
+            self.mw.requireReset()
+        show_error(reordering.ordering.get_errors())
+        aqt.utils.showInfo('%d of the new cards of %d notes repositioned.'%(changed, len(reordering.note_order)), browser)
+
+    # Checks the whole collection, not just the selected notes, and offers to
+    # tag every note involved in a problem. See mmagic.core.health.
+    def show_health_report(self, browser):
+        scan = health.HealthScan(self)
+        note_ids = scan.note_ids()
+        if not note_ids:
+            aqt.utils.showInfo("No Mandarin notes found.", browser)
+            return
+
+        def apply(note_id, prepared, result):
+            scan.add_note(note_id)
+
+        def finish(cancelled):
+            if cancelled:
+                return
+            report = scan.finish()
+            report.errors.append(job.errors)
+            summary = '<br>'.join(report.summary())
+            offenders = report.offenders()
+            if not offenders:
+                aqt.utils.showInfo(summary + '<br><br>No problems found.', browser)
+                return
+            show_error(report.errors)
+            if aqt.utils.askUser(summary + '<br><br>Tag the %d notes involved with "marked"?'%len(offenders), browser):
+                self.add_tag(browser, offenders, 'marked')
+
+        job = job_runner.Job('Checking collection health', note_ids, apply, finish)
+        self.run_job(job, browser)
+
+    # Refreshes the status colours across the whole collection, not just the
+    # selected notes. Only notes that refer to other words are looked at and
+    # only those whose colouring changes are written back.
+    def refresh_all_status_colours(self, browser):
+        note_ids = sorted(self.get_reference_index().note_ids())
+        if not note_ids:
+            aqt.utils.showInfo("No notes have components or measure words.", browser)
+            return
+        updated = []
+
+        def apply(note_id, prepared, result):
+            if self.recolour_note(note_id):
+                updated.append(note_id)
+
+        def finish(cancelled):
+            self.commit_session(browser)
+            aqt.utils.showInfo('%d notes updated.'%len(updated), browser)
+
+        job = job_runner.Job('Refreshing status colours', note_ids, apply, finish)
+        self.run_job(job, browser, batch=True)
 
     def populate_from_browser(self, browser):
         selected_notes = browser.selectedNotes()
         if not selected_notes:
             aqt.utils.showInfo("No notes selected.", browser)
             return
-        errors = exception.MultiException()
-        for note_id in selected_notes:
+
+        def prepare(note_id):
             note = self.get_note(note_id)
+            with self.profiler.timed('populate: read'):
+                return (note, populate.read_request(note))
+
+        # Runs on the worker thread.
+        def compute(prepared):
+            note, request = prepared
+            with self.profiler.timed('populate: compute'):
+                return populate.compute_updates(self.get_lookup(), request)
+
+        # Runs on the worker thread. The words of the notes are looked up
+        # together.
+        def compute_batch(prepared_list):
+            with self.profiler.timed('populate: compute batch'):
+                return populate.compute_batch(self.get_lookup(),
+                        [request for note, request in prepared_list])
+
+        def apply(note_id, prepared, result):
+            note, request = prepared
+            updates, messages = result
             try:
-                self.populate_note(note)
-            except exception.MagicException as e:
-                errors.append(e)
+                self.finish_populating_note(note, updates, messages)
             finally:
                 # Even if there's an error, flush the note.  Usually, the
                 # error only pertains to one problematic field.  The other
                 # fields are okay.
-                note.flush()
-        show_error(errors)
-        # Refresh the editor
-        browser.editor.setNote(browser.editor.note)
-        aqt.utils.showInfo('Done.', browser)
+                self.flush_note(note)
+
+        def finish(cancelled):
+            # Whatever was done before a cancel is kept.
+            self.commit_session(browser)
+            show_error(job.errors)
+            if not cancelled:
+                aqt.utils.showInfo('Done.', browser)
+
+        job = job_runner.Job('Populating notes',
+                selected_notes, apply, finish, prepare, compute, compute_batch)
+        self.run_job(job, browser, batch=True)
+
+    def show_profiler(self, browser):
+        dialog = profiler_dialog.ProfilerDialog(self, browser)
+        dialog.exec_()
 
     def setup_button(self, editor, text, callback):
         button = QPushButton(editor.widget)
@@ -585,18 +654,26 @@ class MainObject:
         button.clicked.connect(callback)
         button.setStyle(editor.plastiqueStyle)
         editor.iconsBox.addWidget(button)
+        return button
 
     def setup_editor_buttons(self, editor):
         self.editor = editor
+        self.auto_populate.add_editor(editor)
         # Note that shortcut is Alt-P
         self.setup_button(editor, '&P', lambda: self.populate_and_save_note(editor))
         self.setup_button(editor, '+', lambda: self.add_missing_components_from_editor(editor))
+        # Toggles populating as you type. See mmagic.gui.auto_populate.
+        button = self.setup_button(editor, 'A', self.auto_populate.set_enabled)
+        button.setCheckable(True)
+        button.setChecked(bool(self.auto_populate.is_enabled()))
+        button.setToolTip('Populate as you type')
 
     def populate_and_save_note(self, editor):
         note = editor.note
         try:
-            self.populate_note(note)
-            note.flush()
+            with self.profiler.timed('action: populate from editor'):
+                self.populate_note(note)
+                note.flush()
         except exception.MagicException as e:
             show_error(e)
         finally:
@@ -605,268 +682,10 @@ class MainObject:
 
     def add_missing_components_from_editor(self, editor):
         try:
-            self.add_missing_dependencies_for_note(editor.note)
+            with self.profiler.timed('action: add missing from editor'):
+                self.add_missing_dependencies_for_note(editor.note)
         except exception.MagicException as e:
             show_error(e)
         finally:
             # Refresh editor
             editor.setNote(editor.note)
-
-    def add_status_colour_to_word(self, word):
-        # Find all notes that have the given word as the Mandarin field
-        note_ids = find_note_ids_for_word(self.mw.col, word)
-        if len(note_ids) == 0:
-            word = add_missing_note_highlight(word)
-        return word
-
-    def add_status_colour(self, text):
-        pattern, words = zl.extract_cjk(text)
-        highlit_words = tuple(
-            map(lambda w: self.add_status_colour_to_word(w), words)
-        )
-        return pattern%highlit_words
-
-    def refresh_status_colour(self, note):
-        if has_decomposition_field(note):
-            field = get_decomposition_field(note)
-            set_decomposition_field(note, self.add_status_colour(field))
-        if has_measure_word_field(note):
-            field = get_measure_word_field(note)
-            set_measure_word_field(note, self.add_status_colour(field))
-
-    # This function does not flush the note. 'flush' has to be called (either
-    # directly or indirectly) from the caller. See 'add_mandarin_note' for
-    # the only instance where it is called indirectly.
-    def populate_note(self, note):
-        # Extract 漢字 from card
-        mandarin_text = get_mandarin_text(note, fail_if_empty=True)
-
-        # In the following, we want to populate as many fields as possible
-        # even if errors occur on previous field.  The following object
-        # is used to accumulate errors.  At the end, the object is raised
-        # as an exception if it actually has errors.
-        errors = exception.MultiException()
-
-        try:
-            # In the following, we do two things. One, we work out whether
-            # the text can possibly be in the dictionary or not.  If it's a
-            # sentence, it cannot.  Second, we split the text into components.
-            # This can happen no matter what the text is.  If it's a character,
-            # it is split into sub-characters.  If it's a word, it's split into
-            # characters.  If it's a sentence, it is is split into words.
-            is_sentence = False
-            if len(mandarin_text) == 1:
-                decomposition = zl.decompose_character(mandarin_text)
-            else:
-                # When segmenting sentences, only use the traditional words.
-                words = zl.segment(mandarin_text, zl.TRADITIONAL)
-                if len(words) == 1:
-                    decomposition = zl.decompose_word(mandarin_text)
-                else:
-                    is_sentence = True
-                    can_lookup_dictionary = False
-                    decomposition = words
-        except zl.ZhonglibException as e:
-            decomposition = None
-            errors.append(exception.MagicException(unicode(e)))
-
-        if is_sentence:
-            if has_empty_english_field(note):
-                set_english_field(note, 'Cannot use dictionary to look up sentences')
-            # Should also set pinyin here from decomposition
-            if not has_empty_pinyin_field(note):
-                # The field may be in numbered pinyin format
-                # If so, convert it to proper tone marks.
-                pinyin_text = get_pinyin_field(note)
-                try:
-                    formatted = format_pinyin('['+pinyin_text+']')
-                    set_pinyin_field(note, formatted)
-                except Exception:
-                    # Something didn't work.  It's probably not in 
-                    # numbered format.  Just leave it be.
-                    pass
-        else:
-            # The Mandarin text is either a word or a character. We can look
-            # it up in the dictionary.
-
-            # Get dictionary entries. Some character components are only defined
-            # in the dictionary as simplifed, so we have to look in both.
-            dictionary_entries = self.dictionary.find(
-                mandarin_text, zl.TRADITIONAL | zl.SIMPLIFIED, include_english=False)
-
-            if len(dictionary_entries) == 0 and has_empty_english_field(note):
-                message = 'No dictionary entry for "' + mandarin_text + '"'
-                errors.append(exception.MagicException(message))
-                set_english_field(note, "No dictionary entry")
-
-            if not has_empty_pinyin_field(note):
-                # The field may be in numbered pinyin format
-                # If so, convert it to proper tone marks.
-                pinyin_text = get_pinyin_field(note)
-                try:
-                    formatted = format_pinyin('['+pinyin_text+']')
-                    set_pinyin_field(note, formatted)
-                except Exception:
-                    # Something didn't work.  It's probably not in 
-                    # numbered format.  Just leave it be.
-                    pass
-
-            if len(dictionary_entries) > 0:
-                # Add Englih
-                if has_empty_english_field(note):
-                    set_english_field(note, format_english(dictionary_entries))
-
-                # Add 拼音
-                if has_empty_pinyin_field(note):
-                    set_pinyin_field(note, format_pinyin_list(dictionary_entries))
-
-                # Add 量詞
-                if has_empty_measure_word_field(note):
-                    set_measure_word_field(note, format_measure_words(dictionary_entries))
-
-
-        if decomposition != None and has_empty_decomposition_field(note):
-            try:
-                set_decomposition_field(\
-                    note,\
-                    format_decomposition(decomposition\
-                ))
-            except exception.MagicException as e:
-                errors.append(e)
-
-        self.refresh_status_colour(note)
-        errors.raise_if_not_empty()
-    
-    def add_mandarin_note(self, model, text):
-        errors = exception.MultiException()
-
-        # Create the new note in Default deck
-        model['did'] = self.mw.col.decks.id('Default')
-
-        note = anki.notes.Note(self.mw.col, model)
-        set_mandarin_field(note, text)
-        try:
-            self.populate_note(note)
-        except exception.MagicException as e:
-            errors.append(e)
-        # The following will flush the note which is why we don't have to
-        # do it ourselves. In fact, we have to avoid it doing it ourselves
-        # because col.addNote() may fail if no cards are produced.  If this
-        # is the case, then the note must not be flushed because the database
-        # ends up with a note with no cards, which will not show up on the
-        # browser.  In that case, you don't even know that there's a dodgy
-        # note unless you dive directly into the database.
-        cards_added = self.mw.col.addNote(note)
-        if cards_added == 0:
-            errors.append(exception.MagicException(
-                'No cards were added for "' + text + '". ' +
-                "Try adding manually for further clues."
-            ))
-        errors.raise_if_not_empty()
-        return note
-
-    # Returns a dependency graph for all transitive components of the given
-    # word.  If a note exists for a given word, its dependency information is
-    # used.  If not, the zhonglib  decomposition data is used.
-    #
-    # Cycles do not break this function because it only looks at each node
-    # once.  However, it won't tell you if there's a cycle. The graph produced
-    # here can be passed to topological_sort.  It will detect cycles.
-
-    # Returns (graph, errors) pair
-    def build_dependency_graph(self, word):
-        result = {}
-        queue = [word]
-
-        errors = exception.MultiException()
-
-        # Do breadth-first traversal of dependency graph.
-        while queue:
-            word = queue.pop()
-            if word in result:
-                # This word has already been seen. This is not necessarily
-                # a cycle because in a DAG it's possible to see the same
-                # node twice during a traversal
-                continue
-            note_ids = find_note_ids_for_word(self.mw.col, word)
-            if len(note_ids) > 1:
-            # There is more than one note for this word
-                raise exception.TooManyNotes(word)
-            elif len(note_ids) == 1:
-            # There is exactly one note for this word.
-            # Extract its component list.
-                note = self.get_note(note_ids[0])
-                dependencies = get_decomposition_list(note)
-                if dependencies == None:
-                    msg = '"%s" has missing component list'%word
-                    raise exception.MagicException(msg)
-            else:
-            # There are no notes for this word. Use the decomposition data
-            # to find it dependencies.
-                try:
-                    dependencies = zl.decompose(word, zl.TRADITIONAL)
-                except zl.ZhonglibException as e:
-                    dependencies = []
-                    errors.append(e)
-            result[word] = dependencies
-            queue += dependencies
-        return (result, errors)
-
-    def add_missing_dependencies_for_word(self, model, word):
-        all_errors = exception.MultiException()
-        try:
-            # Even if there are errors, we continue with what we have.
-            # At least some of the notes will get created. That's better
-            # than doing nothing at all.
-
-            dependency_graph, errors = self.build_dependency_graph(word)
-
-            all_errors.append(errors)
-
-            # topological_sort will detect cycles
-            sorted_words = zl.topological_sort(dependency_graph)
-
-            # The word itself should come last in the sorted list now
-            assert sorted_words[-1] == word
-            # Don't create a note for the word itself. If it already exists
-            # there's no need to do so.  That case would be handled by the
-            # following code.  However, if the '+' button is pressed from
-            # the 'Add Note' dialog, the note will not yet exist for that
-            # word and the following code will create it.  However, that
-            # means that the 'Add Note' dialog will now detect a duplicate
-            # because the note has been added 'under its feet' so to speak.
-            sorted_words.remove(word)
-            assert not word in sorted_words
-
-            for word in sorted_words:
-                if not note_exists_for_mandarin(self.mw.col, word):
-                    try:
-                        self.add_mandarin_note(model, word)
-                    except exception.MagicException as e:
-                        all_errors.append(e)
-        except exception.MagicException as e:
-            all_errors.append(e)
-        all_errors.raise_if_not_empty()
-
-    def add_missing_dependencies_for_note(self, note):
-        errors = exception.MultiException()
-
-        try:
-            self.add_missing_dependencies_for_word(note.model(), get_mandarin_text(note))
-        except exception.MagicException as e:
-            errors.append(e)
-
-        if has_measure_word_field(note):
-            measure_words = get_measure_word_list(note)
-            for word in measure_words:
-                try:
-                    self.add_missing_dependencies_for_word(note.model(), word)
-                except exception.MagicException as e:
-                    errors.append(e)
-
-        # Missing components (may) have been added. Have to update the colour
-        # of words in the text to reflect this.
-        self.refresh_status_colour(note)
-        note.flush()
-
-        errors.raise_if_not_empty()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import logging
+
+from PyQt4 import QtGui
+
+import aqt.utils
+import mmagic.core.profiler as profiler
+
+# Shows the engine's profiler report and the latest log messages. The report
+# can be saved as JSON and the counters reset, e.g. to profile one action on
+# its own.
+
+class ProfilerDialog(QtGui.QDialog):
+
+    def __init__(self, main_object, parent):
+        super(ProfilerDialog, self).__init__(parent)
+        self.main_object = main_object
+        self.setWindowTitle('Mandarin Magic profile')
+        self.resize(800, 600)
+
+        self.text = QtGui.QPlainTextEdit(self)
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QtGui.QPlainTextEdit.NoWrap)
+        self.text.setFont(QtGui.QFont('Courier'))
+
+        self.debug = QtGui.QCheckBox('Log debug messages', self)
+        self.debug.setChecked(profiler.logger.level == logging.DEBUG)
+        self.debug.toggled.connect(self.set_debug)
+
+        buttons = QtGui.QHBoxLayout()
+        buttons.addWidget(self.debug)
+        buttons.addStretch()
+        for text, callback in (('Refresh', self.refresh),
+                               ('Reset', self.reset),
+                               ('Export JSON...', self.export),
+                               ('Close', self.accept)):
+            button = QtGui.QPushButton(text, self)
+            button.clicked.connect(callback)
+            buttons.addWidget(button)
+
+        layout = QtGui.QVBoxLayout(self)
+        layout.addWidget(self.text)
+        layout.addLayout(buttons)
+        self.refresh()
+
+    def refresh(self):
+        lines = profiler.format_report(self.main_object.profiler_report())
+        lines += ['', 'Log:'] + list(self.main_object.recent_records.lines)
+        self.text.setPlainText(u'\n'.join(lines))
+
+    def reset(self):
+        self.main_object.profiler.reset()
+        self.refresh()
+
+    def set_debug(self, enabled):
+        profiler.logger.setLevel(logging.DEBUG if enabled else logging.INFO)
+
+    def export(self):
+        path = QtGui.QFileDialog.getSaveFileName(self, 'Export profile',
+                'mmagic-profile.json', 'JSON (*.json)')
+        if not path:
+            return
+        try:
+            with codecs.open(unicode(path), 'w', 'utf-8') as output:
+                output.write(profiler.to_json(self.main_object.profiler_report()))
+        except (IOError, OSError) as e:
+            aqt.utils.showInfo('Could not write the profile: %s'%e, self)
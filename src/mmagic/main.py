@@ -1,21 +1,77 @@
+import time
+start_time = time.time()
 
-from mmagic.gui.main_object import MainObject
+import mmagic.core.profiler as profiler
 from aqt import mw
-from anki.hooks import addHook
+import anki.notes
+from anki.hooks import addHook, wrap
 
-main_object = MainObject(mw)
+# The main object, and with it the engine and zhonglib, is imported and
+# made by the first hook that needs it, which is usually profileLoaded once
+# the main window is up. Until then there are no indexes or caches, so the
+# hooks that keep them in step have nothing to do.
+
+main_object = None
+
+def get_main_object():
+    global main_object
+    if main_object is None:
+        start = time.time()
+        from mmagic.gui.main_object import MainObject
+        main_object = MainObject(mw)
+        main_object.record_startup_time('import', import_time)
+        main_object.record_startup_time('main object', time.time() - start)
+    return main_object
 
 def setup_browser_menu(browser):
-    main_object.setup_browser_menu(browser)
+    get_main_object().setup_browser_menu(browser)
 
 addHook("browser.setupMenus", setup_browser_menu)
 
 def setup_editor_button(editor):
-    main_object.setup_editor_buttons(editor)
+    get_main_object().setup_editor_buttons(editor)
 
 addHook("setupEditorButtons", setup_editor_button)
 
+def note_edited(note):
+    get_main_object().auto_populate.note_edited(note)
+
+addHook("editTimer", note_edited)
+
 def before_state_change(state, old_state):
-    print 'before_state_change:', state
+    profiler.logger.debug('before_state_change: %s', state)
 
 addHook("beforeStateChange", before_state_change)
+
+# Keep the word index in step with the collection. Anki has no hook for
+# flushing a note, so Note.flush is wrapped. Collection.addNote flushes the
+# note, so this covers new notes too.
+
+def note_flushed(note, *args, **kwargs):
+    if main_object is not None:
+        main_object.note_flushed(note)
+
+anki.notes.Note.flush = wrap(anki.notes.Note.flush, note_flushed, "after")
+
+def notes_removed(collection, note_ids):
+    if main_object is not None:
+        main_object.notes_removed(collection, note_ids)
+
+addHook("remNotes", notes_removed)
+
+def profile_changed():
+    if main_object is not None:
+        main_object.invalidate_word_index()
+
+addHook("profileLoaded", profile_changed)
+addHook("unloadProfile", profile_changed)
+
+# The dictionary is not loaded when the main object is made. Once the main
+# window is up, load it in the background so that the first action doesn't
+# have to wait.
+def profile_loaded():
+    get_main_object().warm_up()
+
+addHook("profileLoaded", profile_loaded)
+
+import_time = time.time() - start_time
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+
+import random
+import re
+import sys
+import time
+import types
+
+# A local stand-in for the parts of Anki that the add-on uses, together with
+# a generator for synthetic Mandarin collections. This lets the add-on's hot
+# paths be exercised without running Anki.
+#
+# The stand-in counts the collection operations that are performed on it so
+# that benchmarks can report query counts as well as wall time.
+
+FIELD_SEPARATOR = '\x1f'
+
+#------------------------------------------------------------------------------
+# anki.utils stand-ins
+
+def strip_html(text):
+    return re.sub(r'(?s)<.*?>', '', text)
+
+def split_fields(fields):
+    return fields.split(FIELD_SEPARATOR)
+
+def join_fields(fields):
+    return FIELD_SEPARATOR.join(fields)
+
+def ids_to_string(ids):
+    return '(%s)'%','.join(str(i) for i in ids)
+
+def int_time():
+    return int(time.time())
+
+# Like anki.utils.timestampID: the time in milliseconds, moved on past any
+# id that is already stored. Notes made in the same millisecond get the same
+# id until one of them is added.
+def timestamp_id(col):
+    result = int(time.time() * 1000)
+    while result in col.notes:
+        result += 1
+    return result
+
+#------------------------------------------------------------------------------
+# Collection stand-in
+
+class Counters:
+
+    NAMES = ('findNotes', 'getNote', 'addNote', 'flush', 'bulkAdd', 'execute',
+             'executemany', 'save')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        for name in self.NAMES:
+            setattr(self, name, 0)
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.NAMES)
+
+class Note:
+
+    def __init__(self, col, model=None, id=None):
+        self.col = col
+        if id is not None:
+            mid, fields, tags = col.notes[id]
+            self.id = id
+            self.mid = mid
+            self.mod = col.note_mods[id]
+            self.fields = list(fields)
+            self.tags = list(tags)
+        else:
+            # Anki gives a new note its id here, not when it is added. See
+            # timestamp_id.
+            self.id = timestamp_id(col)
+            self.mod = 0
+            self.mid = model['id']
+            self.fields = [u''] * len(model['flds'])
+            self.tags = []
+        self._fmap = dict((f['name'], (f['ord'], f)) for f in self.model()['flds'])
+
+    def model(self):
+        return self.col.models.get(self.mid)
+
+    def keys(self):
+        return self._fmap.keys()
+
+    def values(self):
+        return self.fields
+
+    def items(self):
+        return [(name, self.fields[ordinal]) for name, (ordinal, f) in self._fmap.items()]
+
+    def __getitem__(self, key):
+        return self.fields[self._fmap[key][0]]
+
+    def __setitem__(self, key, value):
+        self.fields[self._fmap[key][0]] = value
+
+    def __contains__(self, key):
+        return key in self._fmap
+
+    def hasTag(self, tag):
+        return tag in self.tags
+
+    def flush(self, mod=None):
+        self.col.counters.flush += 1
+        self.mod = mod if mod else int_time()
+        self.col.notes[self.id] = (self.mid, list(self.fields), list(self.tags))
+        self.col.note_mods[self.id] = self.mod
+        self.col.db.mod = True
+        for callback in self.col.flush_callbacks:
+            callback(self)
+
+class Models:
+
+    def __init__(self, models):
+        self.models = dict((m['id'], m) for m in models)
+
+    def all(self):
+        return self.models.values()
+
+    def get(self, model_id):
+        return self.models.get(model_id)
+
+    def current(self):
+        return min(self.models.itervalues(), key=lambda model: model['id'])
+
+    def byName(self, name):
+        for model in self.models.itervalues():
+            if model['name'] == name:
+                return model
+        return None
+
+class Decks:
+
+    def id(self, name):
+        return 1
+
+class Tags:
+
+    def __init__(self, col):
+        self.col = col
+
+    def bulkAdd(self, note_ids, tags, add=True):
+        self.col.counters.bulkAdd += 1
+        for note_id in note_ids:
+            mid, fields, note_tags = self.col.notes[note_id]
+            for tag in tags.split():
+                if add and tag not in note_tags:
+                    note_tags.append(tag)
+                elif not add and tag in note_tags:
+                    note_tags.remove(tag)
+            self.col.note_mods[note_id] = int_time()
+        self.col.db.mod = True
+
+    # As in Anki, this is bulkAdd with add=False.
+    def bulkRem(self, note_ids, tags):
+        self.bulkAdd(note_ids, tags, add=False)
+
+class Database:
+
+    IN_LIST = re.compile(r'where (mid|id) in \(([^)]*)\)')
+    NEW_CARDS = re.compile(r'where type = 0 and nid in \(([^)]*)\)')
+
+    def __init__(self, col):
+        self.col = col
+        # True if there are unsaved changes.
+        self.mod = False
+
+    # Only understands the queries that the add-on makes:
+    #   select <id, mid, flds, tags, mod> from notes [where (id|mid) in (...)]
+    #   select id, nid, due from cards where type = 0 and nid in (...)
+    def execute(self, query, *args):
+        self.col.counters.execute += 1
+        if 'from cards' in query:
+            return self.select_new_cards(query)
+        return self.select_notes(query)
+
+    # Only understands
+    #   select count(), max(mod) from notes where mid in (...)
+    def first(self, query, *args):
+        self.col.counters.execute += 1
+        assert query.startswith('select count(), max(mod) from notes')
+        mods = [mod for mod, in self.select_notes('select mod' + query[len('select count(), max(mod)'):])]
+        return [len(mods), max(mods) if mods else None]
+
+    def select_notes(self, query):
+        columns = [c.strip() for c in query[len('select '):query.index(' from')].split(',')]
+        match = self.IN_LIST.search(query)
+        if match is None:
+            ids = None
+        else:
+            ids = set(long(i) for i in match.group(2).split(',') if i.strip())
+        result = []
+        for note_id, (mid, fields, tags) in self.col.notes.iteritems():
+            if ids is not None:
+                key = mid if match.group(1) == 'mid' else note_id
+                if key not in ids:
+                    continue
+            values = {'id': note_id, 'mid': mid, 'flds': join_fields(fields),
+                      'tags': ' %s '%' '.join(tags), 'mod': self.col.note_mods[note_id]}
+            result.append(tuple(values[c] for c in columns))
+        return result
+
+    def select_new_cards(self, query):
+        note_ids = set(long(i) for i in self.NEW_CARDS.search(query).group(1).split(',') if i.strip())
+        return [(card_id, card['nid'], card['due'])
+                for card_id, card in self.col.cards.iteritems()
+                if card['type'] == 0 and card['nid'] in note_ids]
+
+    # Only understands
+    #   update cards set due = ?, mod = ?, usn = ? where id = ?
+    def executemany(self, query, rows):
+        self.col.counters.executemany += 1
+        assert query.startswith('update cards set due = ?, mod = ?, usn = ?')
+        for due, mod, usn, card_id in rows:
+            self.col.cards[card_id].update(due=due, mod=mod, usn=usn)
+        self.mod = True
+
+    # Changes a field of a note without flushing it, as Anki's find and
+    # replace and importers do. 'mod' defaults to now.
+    def write_field(self, note_id, name, value, mod=None):
+        mid, fields, tags = self.col.notes[note_id]
+        for f in self.col.models.get(mid)['flds']:
+            if f['name'] == name:
+                fields[f['ord']] = value
+        self.col.note_mods[note_id] = mod if mod else int_time()
+        self.mod = True
+
+class Collection:
+
+    def __init__(self, models):
+        self.models = Models(models)
+        self.decks = Decks()
+        self.tags = Tags(self)
+        self.db = Database(self)
+        self.counters = Counters()
+        self.conf = {}
+        # The collection's file. Set it to use files kept next to it.
+        self.path = None
+        # The time of the last save that had changes to write.
+        self.mod = 0
+        # note id -> (model id, fields, tags)
+        self.notes = {}
+        # note id -> modification time in seconds
+        self.note_mods = {}
+        # card id -> {'nid', 'type', 'due', 'mod', 'usn'}. Each note gets one
+        # new card, due in the order the notes were added.
+        self.cards = {}
+        # Due numbers are handed out when notes are added.
+        self.next_due = 1
+        self.flush_callbacks = []
+
+    def getNote(self, note_id):
+        self.counters.getNote += 1
+        return Note(self, id=note_id)
+
+    def addNote(self, note):
+        self.counters.addNote += 1
+        note.flush()
+        self.cards[note.id] = {'nid': note.id, 'type': 0, 'due': self.next_due, 'mod': 0, 'usn': 0}
+        self.next_due += 1
+        return 1
+
+    def save(self):
+        self.counters.save += 1
+        if self.db.mod:
+            self.mod = max(self.mod + 1, int(time.time() * 1000))
+            self.db.mod = False
+
+    def setMod(self):
+        pass
+
+    def usn(self):
+        return -1
+
+    # Supports 'Field:"value"' searches. The add-on no longer makes any;
+    # they are counted so that the benchmarks catch any that come back.
+    def findNotes(self, query):
+        self.counters.findNotes += 1
+        field, value = re.match(r'^(.*?):"(.*)"$', query).groups()
+        value = value.lower()
+        result = []
+        for note_id, (mid, fields, tags) in self.notes.iteritems():
+            for f in self.models.get(mid)['flds']:
+                if f['name'] == field and fields[f['ord']].lower() == value:
+                    result.append(note_id)
+        return result
+
+class MainWindow:
+
+    def __init__(self, col):
+        self.col = col
+        self.resets = 0
+
+    def requireReset(self):
+        self.resets += 1
+
+class BrowserModel:
+
+    def beginReset(self):
+        pass
+
+    def endReset(self):
+        pass
+
+class Editor:
+
+    def __init__(self):
+        self.note = None
+
+    def setNote(self, note):
+        self.note = note
+
+class Browser:
+
+    def __init__(self, selected_notes):
+        self.selected_notes = list(selected_notes)
+        self.model = BrowserModel()
+        self.editor = Editor()
+
+    def selectedNotes(self):
+        return self.selected_notes
+
+# Registers stand-in 'anki' and 'aqt' modules so that the add-on can be
+# imported without Anki. Call this before importing anything from mmagic.
+def install():
+    anki = types.ModuleType('anki')
+    anki.notes = types.ModuleType('anki.notes')
+    anki.notes.Note = Note
+    anki.utils = types.ModuleType('anki.utils')
+    anki.utils.stripHTML = strip_html
+    anki.utils.splitFields = split_fields
+    anki.utils.joinFields = join_fields
+    anki.utils.ids2str = ids_to_string
+    anki.utils.intTime = int_time
+    anki.hooks = types.ModuleType('anki.hooks')
+    anki.hooks.addHook = lambda name, function: None
+    anki.hooks.runHook = lambda name, *args: None
+    aqt = types.ModuleType('aqt')
+    aqt.mw = None
+    aqt.utils = types.ModuleType('aqt.utils')
+    aqt.utils.showInfo = lambda *args, **kwargs: None
+    aqt.utils.askUser = lambda *args, **kwargs: True
+    for module in (anki, anki.notes, anki.utils, anki.hooks, aqt, aqt.utils):
+        sys.modules[module.__name__] = module
+
+#------------------------------------------------------------------------------
+# Synthetic collections
+
+MANDARIN_MODEL = {
+    'id': 1000,
+    'mod': 1,
+    'name': 'Mandarin',
+    'did': 1,
+    'flds': [
+        {'name': u'漢字', 'ord': 0},
+        {'name': 'English', 'ord': 1},
+        {'name': 'Pinyin', 'ord': 2},
+        {'name': 'Measure Word', 'ord': 3},
+        {'name': 'Decomposition', 'ord': 4},
+    ],
+}
+
+# The CJK unified ideographs and extension A. Roughly 27,000 characters.
+CHARACTER_RANGES = ((0x4E00, 0x9FFF), (0x3400, 0x4DBF))
+
+def characters():
+    for first, last in CHARACTER_RANGES:
+        for code in xrange(first, last+1):
+            yield unichr(code)
+
+# Generates a collection with 'size' notes. Roughly 40% of the notes are
+# characters (capped by the number of CJK characters) and the rest are two
+# and three character words.
+#
+# Characters are arranged in 'depth' levels. Level 0 characters have no
+# components. A character on any other level is made up of two or three
+# components from lower levels, at least one of them from the level
+# directly below, so that decomposition chains really are 'depth' long.
+# Components are shared heavily, as they are in real data.
+#
+# 'missing_ratio' of the level 0 characters don't get notes of their own, so
+# that some dependencies are missing.
+#
+# Returns (collection, words) where words maps each level name ('level0',
+# 'level1', ..., 'words') to the words on that level.
+def generate_collection(size, depth=4, missing_ratio=0.0, seed=0):
+    assert size > 0 and depth > 0
+    rng = random.Random(seed)
+    col = Collection([MANDARIN_MODEL])
+
+    available = characters()
+    character_count = min(int(size*0.4) or 1, 26000)
+    # Each level is smaller than the one above it.
+    weights = [2**i for i in xrange(depth)]
+    levels = []
+    remaining = character_count
+    for level in xrange(depth):
+        count = max(1, character_count * weights[level] / sum(weights))
+        if level == depth-1:
+            count = max(1, remaining)
+        remaining -= count
+        levels.append([available.next() for i in xrange(count)])
+
+    decompositions = {}
+    for level in xrange(1, depth):
+        lower = [c for l in levels[:level] for c in l]
+        for character in levels[level]:
+            components = [rng.choice(levels[level-1])]
+            for i in xrange(rng.randint(1, 2)):
+                components.append(rng.choice(lower))
+            decompositions[character] = components
+
+    all_characters = [c for l in levels for c in l]
+    words = set()
+    word_count = size - len(all_characters)
+    while len(words) < word_count:
+        length = rng.choice((2, 2, 3))
+        words.add(u''.join(rng.choice(all_characters) for i in xrange(length)))
+    words = sorted(words)
+    for word in words:
+        decompositions[word] = list(word)
+
+    missing = set(rng.sample(levels[0], int(len(levels[0]) * missing_ratio)))
+    for character in all_characters + words:
+        if character in missing:
+            continue
+        note = Note(col, MANDARIN_MODEL)
+        note[u'漢字'] = character
+        note['English'] = u'meaning of ' + character
+        note['Pinyin'] = u'pīnyīn'
+        components = decompositions.get(character, [])
+        note['Decomposition'] = u', '.join(components) if components else u'None'
+        col.addNote(note)
+    col.save()
+    col.counters.reset()
+
+    result = dict(('level%d'%i, l) for i, l in enumerate(levels))
+    result['words'] = words
+    return (col, result)
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+import synthetic
+
+# Benchmarks for the add-on's hot paths, run against a synthetic collection.
+#
+# Each benchmark reports its wall time and the number of collection
+# operations it performed. It fails if it performs more operations than the
+# stored baseline or takes more than TIME_TOLERANCE times as long, give or
+# take TIME_SLACK seconds of timer noise. The stored baseline is for the
+# default size and depth.
+#
+# Environment variables:
+#
+#   MMAGIC_BENCHMARK_SIZE      number of notes in the collection (default 1000)
+#   MMAGIC_BENCHMARK_DEPTH     levels of character decomposition (default 4)
+#   MMAGIC_UPDATE_BASELINE     if set, record the results as the new baseline
+#
+# The benchmarks need zhonglib and PyQt4. Anki itself is replaced by the
+# stand-in in synthetic.py.
+
+SIZE = int(os.environ.get('MMAGIC_BENCHMARK_SIZE', 1000))
+DEPTH = int(os.environ.get('MMAGIC_BENCHMARK_DEPTH', 4))
+UPDATE_BASELINE = bool(os.environ.get('MMAGIC_UPDATE_BASELINE'))
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+TIME_TOLERANCE = 1.5
+TIME_SLACK = 0.25
+
+# Number of notes each benchmark works on.
+SAMPLE_SIZE = 200
+
+synthetic.install()
+try:
+    from PyQt4 import QtGui
+    import mmagic.gui.job_runner as job_runner
+    import mmagic.gui.main_object as main_object
+    import mmagic.core.snapshot as snapshot
+    import zhonglib as zl
+    import_error = None
+except ImportError as e:
+    import_error = e
+
+def load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+def save_baseline(baseline):
+    with open(BASELINE_PATH, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+
+# Returns a message for each way in which a result is worse than its
+# baseline.
+def find_regressions(key, seconds, queries, expected):
+    result = []
+    for query, count in sorted(queries.iteritems()):
+        limit = expected['queries'].get(query, 0)
+        if count > limit:
+            result.append('%s: %s went from %d to %d'%(key, query, limit, count))
+    if seconds > expected['seconds'] * TIME_TOLERANCE + TIME_SLACK:
+        result.append('%s: took %.3fs, baseline is %.3fs'%(key, seconds, expected['seconds']))
+    return result
+
+class Clipboard:
+
+    def setText(self, text):
+        self.text = text
+
+if import_error is None:
+
+    # Runs jobs straight away and recolours synchronously, since there is no
+    # event loop.
+    class BenchmarkMainObject(main_object.MainObject):
+
+        def start_job(self, job, parent):
+            job_runner.run_synchronously(job)
+
+        def schedule_recolour(self, words):
+            self.recolour_words.update(words)
+
+    # Dialogs need a running application.
+    main_object.show_error = lambda error: None
+
+@unittest.skipIf(import_error is not None, 'cannot import the add-on: %s'%import_error)
+class Benchmarks(unittest.TestCase):
+
+    baseline = None
+    results = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.baseline = load_baseline()
+        cls.results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        if UPDATE_BASELINE and cls.results:
+            baseline = load_baseline()
+            baseline.update(cls.results)
+            save_baseline(baseline)
+
+    def setUp(self):
+        self.col, self.words = synthetic.generate_collection(
+            SIZE, depth=DEPTH, missing_ratio=0.1)
+        self.mw = synthetic.MainWindow(self.col)
+        self.main_object = BenchmarkMainObject(self.mw)
+        self.col.flush_callbacks.append(self.main_object.note_flushed)
+        # Load the dictionary up front. That cost is not what's being
+        # measured.
+        self.main_object.get_lookup()
+        self.word_index = self.main_object.get_word_index()
+        self.word_index.ensure_built()
+        self.col.counters.reset()
+
+    def sample_words(self, level):
+        return self.words[level][:SAMPLE_SIZE]
+
+    def sample_note_ids(self, level):
+        result = []
+        for word in self.sample_words(level):
+            result += self.word_index.find(word)
+        return result
+
+    def measure(self, name, function):
+        self.col.counters.reset()
+        start = time.time()
+        function()
+        seconds = time.time() - start
+        queries = self.col.counters.as_dict()
+
+        key = '%s@%dx%d'%(name, SIZE, DEPTH)
+        print '\n%s: %.3fs %s'%(key, seconds, queries)
+        self.results[key] = {'seconds': round(seconds, 3), 'queries': queries}
+
+        expected = self.baseline.get(key)
+        if expected is None or UPDATE_BASELINE:
+            return
+        regressions = find_regressions(key, seconds, queries, expected)
+        self.assertEqual(regressions, [], '; '.join(regressions))
+
+    def test_populate_note(self):
+        model = synthetic.MANDARIN_MODEL
+        notes = []
+        for word in self.sample_words('words') + self.sample_words('level%d'%(DEPTH-1)):
+            note = synthetic.Note(self.col, model)
+            note[u'漢字'] = word
+            notes.append(note)
+
+        def populate():
+            for note in notes:
+                try:
+                    self.main_object.populate_note(note)
+                except main_object.exception.MagicException:
+                    pass
+
+        self.measure('populate_note', populate)
+
+    def test_mark_all_dependencies(self):
+        browser = synthetic.Browser(self.sample_note_ids('words'))
+        self.measure('mark_all_dependencies',
+                lambda: self.main_object.mark_all_dependencies(browser))
+
+    def test_build_dependency_graph(self):
+        words = self.sample_words('words')
+
+        def build():
+            for word in words:
+                try:
+                    self.main_object.build_dependency_graph(word)
+                except main_object.exception.MagicException:
+                    pass
+
+        self.measure('build_dependency_graph', build)
+
+    def test_export_to_skritter(self):
+        note_ids = []
+        for level in xrange(DEPTH):
+            note_ids += self.sample_note_ids('level%d'%level)
+        browser = synthetic.Browser(note_ids)
+        clipboard = QtGui.QApplication.clipboard
+        QtGui.QApplication.clipboard = staticmethod(lambda: Clipboard())
+        directory = tempfile.mkdtemp()
+        self.col.path = os.path.join(directory, 'collection.anki2')
+        try:
+            self.measure('export_to_skritter',
+                    lambda: self.main_object.export_to_skritter(browser))
+        finally:
+            QtGui.QApplication.clipboard = clipboard
+            shutil.rmtree(directory)
+
+    def test_add_missing_dependencies_for_note(self):
+        note_ids = self.sample_note_ids('words')
+
+        def add():
+            for note_id in note_ids:
+                try:
+                    note = self.main_object.get_note(note_id)
+                    self.main_object.add_missing_dependencies_for_note(note)
+                except main_object.exception.MagicException:
+                    pass
+            self.main_object.recolour_dependents()
+
+        self.measure('add_missing_dependencies_for_note', add)
+
+    def test_import_word_list(self):
+        # Half of the list already has notes. The rest are new words, some
+        # of them made from characters that have no notes either.
+        rng = random.Random(0)
+        characters = self.words['level0'] + self.words['level1']
+        new_words = set()
+        while len(new_words) < SAMPLE_SIZE/2:
+            word = rng.choice(characters) + rng.choice(characters)
+            if not self.word_index.contains(word):
+                new_words.add(word)
+        words = self.sample_words('words')[:SAMPLE_SIZE/2] + sorted(new_words)
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, u'words.txt')
+            with open(path, 'w') as f:
+                f.write(u''.join(u'%s\tpinyin\tmeaning\n'%word for word in words).encode('utf-8'))
+            browser = synthetic.Browser([])
+            self.measure('import_word_list', lambda: self.main_object.import_word_list(
+                    browser, path, add_components=True))
+        finally:
+            shutil.rmtree(directory)
+
+        for word in words:
+            self.assertEqual(len(self.word_index.find(word)), 1, word)
+        for word in new_words:
+            for character in word:
+                self.assertTrue(self.word_index.contains(character), character)
+
+    def test_order_new_cards(self):
+        # Reverse the creation order so that every word comes before its
+        # components.
+        last = max(card['due'] for card in self.col.cards.itervalues())
+        for card in self.col.cards.itervalues():
+            card['due'] = last - card['due']
+        browser = synthetic.Browser([])
+        self.measure('order_new_cards', lambda: self.main_object.order_new_cards(browser))
+
+        due = dict((card['nid'], card['due']) for card in self.col.cards.itervalues())
+        for note_id in self.sample_note_ids('words'):
+            for component in self.col.getNote(note_id)['Decomposition'].split(u', '):
+                for component_id in self.word_index.find(component):
+                    self.assertLess(due[component_id], due[note_id])
+
+    def test_snapshot_lookup(self):
+        # A CEDICT entry for every word in the collection, with measure
+        # words for the longer ones.
+        directory = tempfile.mkdtemp()
+        try:
+            source_path = os.path.join(directory, 'cedict_ts.u8')
+            snapshot_path = os.path.join(directory, 'cedict.snapshot')
+            words = [word for level in sorted(self.words) for word in self.words[level]]
+            with open(source_path, 'w') as f:
+                for word in words:
+                    line = u'%s %s [pin1] /meaning of %s/'%(word, word, word)
+                    if len(word) > 1:
+                        line += u'CL:個|个[ge4]/'
+                    f.write((line + u'\n').encode('utf-8'))
+            snapshot.compile_snapshot(source_path, snapshot_path)
+            print '\nsnapshot of %d entries: %d bytes'%(len(words), os.path.getsize(snapshot_path))
+
+            def load_and_look_up():
+                dictionary = snapshot.load_dictionary(source_path, snapshot_path)
+                for word in words[:SAMPLE_SIZE*5]:
+                    self.assertEqual(len(dictionary.find(word, zl.TRADITIONAL)), 1)
+                dictionary.close()
+
+            self.measure('snapshot_lookup', load_and_look_up)
+        finally:
+            shutil.rmtree(directory)
+
+class BaselineTest(unittest.TestCase):
+
+    EXPECTED = {'seconds': 1.0, 'queries': {'getNote': 10, 'flush': 0}}
+
+    def test_within_baseline(self):
+        self.assertEqual(find_regressions('a', 1.2, {'getNote': 10, 'flush': 0}, self.EXPECTED), [])
+        self.assertEqual(find_regressions('a', 0.1, {'getNote': 3}, self.EXPECTED), [])
+
+    def test_more_queries_fail(self):
+        self.assertEqual(find_regressions('a', 1.0, {'getNote': 11, 'flush': 0}, self.EXPECTED),
+                ['a: getNote went from 10 to 11'])
+        # Queries that the baseline doesn't have count as 0.
+        self.assertEqual(find_regressions('a', 1.0, {'save': 1}, self.EXPECTED),
+                ['a: save went from 0 to 1'])
+
+    def test_slower_fails(self):
+        self.assertEqual(find_regressions('a', 2.0, {'getNote': 10}, self.EXPECTED),
+                ['a: took 2.000s, baseline is 1.000s'])
+
+    def test_baseline_covers_every_benchmark(self):
+        baseline = load_baseline()
+        names = [name[len('test_'):] for name in dir(Benchmarks) if name.startswith('test_')]
+        for name in names:
+            self.assertIn('%s@1000x4'%name, baseline)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+# Tests for the tokeniser of component and measure word fields.
+
+try:
+    import mmagic.core.cjk as cjk
+    import_error = None
+except ImportError as e:
+    import_error = e
+
+@unittest.skipIf(import_error is not None, 'cannot import the tokeniser: %s'%import_error)
+class TokeniseTest(unittest.TestCase):
+
+    def test_spans(self):
+        text = u'木, 口 (mouth), 人人'
+        self.assertEqual(cjk.tokenise(text), ((0, 1, u'木'), (3, 4, u'口'), (14, 16, u'人人')))
+        for start, end, word in cjk.tokenise(text):
+            self.assertEqual(text[start:end], word)
+
+    def test_no_words(self):
+        self.assertEqual(cjk.tokenise(u''), ())
+        self.assertEqual(cjk.get_words(u'None'), [])
+
+    def test_radicals_strokes_and_extensions(self):
+        # A Kangxi radical, a stroke, extension A and extension B.
+        self.assertEqual(cjk.get_words(u'⼝ ㇏ 㐀 \U00020000'), [u'⼝', u'㇏', u'㐀', u'\U00020000'])
+
+    def test_scan_words_matches_tokenise(self):
+        text = u'<b>日</b>月, 明'
+        self.assertEqual(cjk.scan_words(text), cjk.get_words(text))
+        self.assertEqual(cjk.scan_words(text), [u'日', u'月', u'明'])
+
+    def test_splice(self):
+        text = u'100% 木, 口'
+        result = cjk.splice(text, cjk.tokenise(text), lambda word: u'[%s]'%word)
+        self.assertEqual(result, u'100% [木], [口]')
+        self.assertEqual(cjk.splice(u'none', cjk.tokenise(u'none'), None), u'none')
+
+if __name__ == '__main__':
+    unittest.main()
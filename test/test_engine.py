@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import synthetic
+
+# Tests for adding the missing components of notes, run against a small
+# synthetic collection.
+
+synthetic.install()
+try:
+    import mmagic.core.exception as exception
+    import mmagic.core.pipeline as pipeline
+    from mmagic.core.engine import Engine
+    import_error = None
+except ImportError as e:
+    import_error = e
+
+@unittest.skipIf(import_error is not None, 'cannot import the engine: %s'%import_error)
+class MissingDependenciesTest(unittest.TestCase):
+
+    # 甲 and 乙 are made of each other. 丙 is made of 丁, which has no note
+    # and no components of its own.
+    NOTES = ((u'甲', u'乙'), (u'乙', u'甲'), (u'丙', u'丁'))
+
+    def setUp(self):
+        self.col = synthetic.Collection([synthetic.MANDARIN_MODEL])
+        self.note_ids = []
+        for word, decomposition in self.NOTES:
+            note = synthetic.Note(self.col, synthetic.MANDARIN_MODEL)
+            note[u'漢字'] = word
+            note['English'] = u'meaning of ' + word
+            note['Pinyin'] = u'pīnyīn'
+            note['Decomposition'] = decomposition
+            self.col.addNote(note)
+            self.note_ids.append(note.id)
+        self.col.save()
+        self.engine = Engine(self.col)
+        self.col.flush_callbacks.append(self.engine.note_flushed)
+
+    def test_get_missing_words_reports_cycles(self):
+        dependency_graph = {u'甲': [u'乙'], u'乙': [u'甲'], u'丙': [u'丁'], u'丁': []}
+        missing_words, errors = self.engine.get_missing_words(dependency_graph, [u'丙'])
+        self.assertEqual(missing_words, [u'丁'])
+        self.assertEqual(errors.count(exception.CYCLE), 1)
+
+    def test_notes_added_despite_cycle(self):
+        notes = [self.col.getNote(note_id) for note_id in self.note_ids]
+        try:
+            self.engine.add_missing_dependencies_for_notes(notes)
+        except exception.ErrorCollector as errors:
+            self.assertEqual(errors.count(exception.CYCLE), 1)
+        else:
+            self.fail('the cycle was not reported')
+        self.assertTrue(self.engine.word_has_notes(u'丁'))
+
+    def test_pipeline_adds_notes_despite_cycle(self):
+        result = pipeline.add_missing_dependencies(self.engine, self.note_ids)
+        self.assertEqual(result.errors.count(exception.CYCLE), 1)
+        self.assertTrue(self.engine.word_has_notes(u'丁'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import mmagic.core.exception as exception
+
+# Tests for ErrorCollector.
+
+class ErrorCollectorTest(unittest.TestCase):
+
+    def test_empty(self):
+        errors = exception.ErrorCollector()
+        self.assertEqual(len(errors), 0)
+        self.assertEqual(errors.summary(), [])
+        errors.raise_if_not_empty()
+
+    def test_categories_in_reporting_order(self):
+        errors = exception.ErrorCollector()
+        errors.append(exception.MagicException('odd'))
+        errors.append(exception.TooManyNotes(u'木'))
+        errors.append(exception.MissingNote(u'口'))
+        errors.append(ValueError('bad value'))
+        self.assertEqual(errors.categories(),
+                [exception.MISSING_NOTE, exception.TOO_MANY_NOTES, exception.OTHER])
+        self.assertEqual(errors.get_message_list(),
+                [u'No note for "口"', u'More than one note for "木"', 'odd', u'bad value'])
+        self.assertEqual(errors.summary(), [u'1 missing note', u'1 too many notes', u'2 other'])
+
+    def test_duplicates_ignored(self):
+        errors = exception.ErrorCollector()
+        self.assertTrue(errors.add(exception.CYCLE, u'a → b → a'))
+        self.assertFalse(errors.add(exception.CYCLE, u'a → b → a'))
+        errors.append(exception.MissingNote(u'口'))
+        errors.append(exception.MissingNote(u'口'))
+        self.assertEqual(len(errors), 2)
+
+    def test_bounded_examples(self):
+        errors = exception.ErrorCollector(max_examples=3)
+        for i in xrange(10):
+            errors.append(exception.MissingNote(unicode(i)))
+        self.assertEqual(len(errors), 10)
+        self.assertEqual(errors.count(exception.MISSING_NOTE), 10)
+        self.assertEqual(len(errors.get_message_list()), 3)
+        self.assertEqual(errors.omitted(), 7)
+
+    def test_merge_flattens(self):
+        inner = exception.ErrorCollector(max_examples=1)
+        inner.append(exception.MissingNote(u'木'))
+        inner.append(exception.MissingNote(u'口'))
+        outer = exception.ErrorCollector()
+        outer.append(exception.MissingNote(u'木'))
+        outer.append(inner)
+        self.assertEqual(len(outer), 2)
+        self.assertEqual(outer.get_problems(), [(exception.MISSING_NOTE, u'No note for "木"')])
+        self.assertEqual(outer.omitted(), 1)
+
+    def test_raises_itself(self):
+        errors = exception.ErrorCollector()
+        errors.append(exception.EmptyComponents(u'木'))
+        try:
+            errors.raise_if_not_empty()
+            self.fail('nothing raised')
+        except exception.MagicException as e:
+            self.assertTrue(e is errors)
+            self.assertEqual(str(e), u'1 empty components'.encode('utf-8'))
+
+    def test_args_follow_problems(self):
+        errors = exception.ErrorCollector()
+        self.assertEqual(errors.args, (u'',))
+        errors.append(exception.MissingNote(u'木'))
+        errors.append(exception.MissingNote(u'林'))
+        self.assertEqual(errors.args, (u'2 missing note',))
+        self.assertEqual(str(errors), errors.args[0].encode('utf-8'))
+
+    def test_exception_args(self):
+        error = exception.MissingNote(u'木')
+        self.assertEqual(error.args, (u'No note for "木"',))
+
+if __name__ == '__main__':
+    unittest.main()
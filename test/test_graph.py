@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import mmagic.core.exception as exception
+import mmagic.core.graph as graph
+
+# Tests for the graph walks and sorts.
+
+def successors_in(dependency_graph):
+    return lambda node: dependency_graph.get(node, [])
+
+class WalkTest(unittest.TestCase):
+
+    GRAPH = {'a': ['b', 'c'], 'b': ['d'], 'c': ['d', 'e'], 'd': [], 'e': ['b']}
+
+    def test_each_node_once_in_order_reached(self):
+        nodes, errors = graph.walk(['a'], successors_in(self.GRAPH))
+        self.assertEqual(nodes, ['a', 'b', 'd', 'c', 'e'])
+        self.assertEqual(len(errors), 0)
+
+    def test_shared_visited_set(self):
+        visited = set()
+        first, errors = graph.walk(['b'], successors_in(self.GRAPH), visited)
+        second, errors = graph.walk(['a'], successors_in(self.GRAPH), visited)
+        self.assertEqual(first, ['b', 'd'])
+        self.assertEqual(second, ['a', 'c', 'e'])
+
+    def test_cycle_terminates(self):
+        nodes, errors = graph.walk(['x'], successors_in({'x': ['y'], 'y': ['x']}))
+        self.assertEqual(nodes, ['x', 'y'])
+
+    def test_failing_node_has_no_successors(self):
+        def get_successors(node):
+            if node == 'c':
+                raise exception.MissingNote(node)
+            return self.GRAPH[node]
+        nodes, errors = graph.walk(['a'], get_successors)
+        self.assertEqual(nodes, ['a', 'b', 'd', 'c'])
+        self.assertEqual(errors.get_problems(), [(exception.MISSING_NOTE, 'No note for "c"')])
+
+    def test_prefetch_gives_same_result_a_level_at_a_time(self):
+        levels = []
+        nodes, errors = graph.walk(['a'], successors_in(self.GRAPH), prefetch=levels.append)
+        self.assertEqual(nodes, ['a', 'b', 'd', 'c', 'e'])
+        self.assertEqual(levels, [['a'], ['b', 'c'], ['d', 'e']])
+
+    def test_deep_chain(self):
+        chain = dict((i, [i+1]) for i in xrange(100000))
+        nodes, errors = graph.walk([0], successors_in(chain))
+        self.assertEqual(len(nodes), 100001)
+
+class FindCyclesTest(unittest.TestCase):
+
+    def test_acyclic(self):
+        self.assertEqual(graph.find_cycles(['a'], successors_in({'a': ['b'], 'b': []})), [])
+
+    def test_cycles(self):
+        dependency_graph = {'a': ['b'], 'b': ['c'], 'c': ['a', 'd'], 'd': ['d'], 'e': ['a']}
+        cycles = graph.find_cycles(['e'], successors_in(dependency_graph))
+        self.assertEqual(sorted(sorted(c) for c in cycles), [['a', 'b', 'c'], ['d']])
+
+    def test_cycle_path(self):
+        dependency_graph = {'a': ['b'], 'b': ['c'], 'c': ['a']}
+        component = graph.find_cycles(['a'], successors_in(dependency_graph))[0]
+        component.sort()
+        self.assertEqual(graph.find_cycle_path(component, successors_in(dependency_graph)),
+                ['a', 'b', 'c', 'a'])
+
+class SortLevelsTest(unittest.TestCase):
+
+    def test_levels(self):
+        ordering = graph.sort_levels({'ab': ['a', 'b'], 'b': ['c'], 'abc': ['ab', 'c']})
+        self.assertEqual(ordering.levels, [['a', 'c'], ['b'], ['ab'], ['abc']])
+        self.assertEqual(ordering.order(), ['a', 'c', 'b', 'ab', 'abc'])
+        self.assertEqual(len(ordering.get_errors()), 0)
+
+    def test_key(self):
+        ordering = graph.sort_levels({'x': ['b', 'a'], 'y': []}, key=lambda node: -ord(node))
+        self.assertEqual(ordering.levels, [['y', 'b', 'a'], ['x']])
+
+    def test_repeated_dependency(self):
+        ordering = graph.sort_levels({'aa': ['a', 'a']})
+        self.assertEqual(ordering.order(), ['a', 'aa'])
+
+    def test_cycles_and_blocked_nodes(self):
+        ordering = graph.sort_levels({
+            'a': ['b'], 'b': ['a'], 'c': ['a'], 'd': ['e'], 'e': [], 'f': ['f']})
+        self.assertEqual(ordering.order(), ['e', 'd'])
+        self.assertEqual(ordering.cycles, [['a', 'b', 'a'], ['f', 'f']])
+        self.assertEqual(ordering.blocked, ['c'])
+        errors = ordering.get_errors()
+        self.assertEqual(errors.count(exception.CYCLE), 2)
+
+    def test_topological_sort_raises_cycles(self):
+        self.assertEqual(graph.topological_sort({'b': ['a']}), ['a', 'b'])
+        self.assertRaises(exception.ErrorCollector, graph.topological_sort, {'a': ['a']})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import synthetic
+
+# Tests for the word and reference indexes, run against a small synthetic
+# collection.
+
+synthetic.install()
+import mmagic.core.index as index
+from mmagic.core.fields import MANDARIN_FIELDS, DECOMPOSITION_FIELDS
+
+def split_components(value):
+    return [word for word in value.split(u', ') if word and word != u'None']
+
+class FieldIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.col, self.words = synthetic.generate_collection(50, depth=2)
+        self.index = index.WordIndex(self.col, MANDARIN_FIELDS)
+        self.index.ensure_built()
+
+    def test_whole_value_is_one_word_by_default(self):
+        field_index = index.FieldIndex(self.col, MANDARIN_FIELDS)
+        self.assertEqual(field_index.extract_words(u'AB 字'), [u'AB 字'])
+
+    def test_current_after_build(self):
+        self.assertTrue(self.index.is_current())
+
+    def test_current_after_saves_that_change_no_notes(self):
+        self.col.db.mod = True
+        self.col.save()
+        self.assertTrue(self.index.is_current())
+
+    def test_not_current_after_direct_write(self):
+        note_id = self.index.find(self.words['words'][0])[0]
+        latest = self.index.signature[1]
+        self.col.db.write_field(note_id, u'漢字', u'新字', mod=latest + 1)
+        self.assertFalse(self.index.is_current())
+        self.col.save()
+        self.assertFalse(self.index.is_current())
+
+    def test_current_after_flushes_it_is_told_about(self):
+        note = self.col.getNote(self.index.find(self.words['words'][0])[0])
+        note[u'漢字'] = u'新字'
+        note.flush(mod=self.index.signature[1] + 1)
+        self.index.update_note(note)
+        added = synthetic.Note(self.col, synthetic.MANDARIN_MODEL)
+        added[u'漢字'] = u'新詞'
+        self.col.addNote(added)
+        self.index.update_note(added)
+        self.col.save()
+        self.assertTrue(self.index.is_current())
+        self.assertEqual(self.index.find(u'新字'), [note.id])
+
+    def test_removed_notes(self):
+        note_id = self.index.find(self.words['words'][0])[0]
+        del self.col.notes[note_id]
+        self.assertFalse(self.index.is_current())
+        self.index.remove_notes([note_id])
+        self.assertTrue(self.index.is_current())
+
+    def test_tagging_needs_mark_current(self):
+        note_id = self.index.find(self.words['words'][0])[0]
+        self.col.db.write_field(note_id, 'English', u'tagged', mod=self.index.signature[1] + 1)
+        self.assertFalse(self.index.is_current())
+        self.index.mark_current()
+        self.assertTrue(self.index.is_current())
+
+class WordIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.col, self.words = synthetic.generate_collection(50, depth=2)
+        self.index = index.WordIndex(self.col, MANDARIN_FIELDS)
+
+    def add_note(self, word):
+        note = synthetic.Note(self.col, synthetic.MANDARIN_MODEL)
+        note[u'漢字'] = word
+        self.col.addNote(note)
+        return note
+
+    def test_built_lazily_in_one_query(self):
+        self.assertFalse(self.index.is_built())
+        self.col.counters.reset()
+        word = self.words['level0'][0]
+        self.assertEqual(len(self.index.find(word)), 1)
+        self.assertTrue(self.index.contains(word))
+        self.assertEqual(self.col.counters.execute, 1)
+        self.assertEqual(sorted(self.index.note_ids()), sorted(self.col.notes))
+
+    def test_whole_value_ignoring_case(self):
+        note = self.add_note(u'AB字')
+        self.assertEqual(self.index.find(u'ab字'), [note.id])
+        self.assertEqual(self.index.find(u'AB'), [])
+        self.assertFalse(self.index.contains(u'字AB'))
+
+    def test_update_note_reports_first_and_last_notes(self):
+        self.index.ensure_built()
+        note = self.add_note(u'新')
+        self.assertEqual(self.index.update_note(note), [u'新'])
+        second = self.add_note(u'新')
+        self.assertEqual(self.index.update_note(second), [])
+        self.assertEqual(self.index.find(u'新'), sorted([note.id, second.id]))
+
+        note[u'漢字'] = u'舊'
+        note.flush()
+        self.assertEqual(self.index.update_note(note), [u'舊'])
+        self.assertEqual(self.index.find(u'新'), [second.id])
+
+    def test_remove_notes(self):
+        self.index.ensure_built()
+        note = self.add_note(u'新')
+        self.index.update_note(note)
+        self.assertEqual(self.index.remove_notes([note.id]), [u'新'])
+        self.assertFalse(self.index.contains(u'新'))
+        self.assertEqual(self.index.remove_notes([note.id]), [])
+
+    def test_unbuilt_index_ignores_updates(self):
+        note = self.add_note(u'新')
+        self.assertEqual(self.index.update_note(note), [])
+        self.assertFalse(self.index.is_built())
+        self.assertEqual(self.index.find(u'新'), [note.id])
+
+class ReferenceIndexTest(unittest.TestCase):
+
+    def test_notes_referring_to_a_word(self):
+        col, words = synthetic.generate_collection(50, depth=2)
+        reference_index = index.ReferenceIndex(col, DECOMPOSITION_FIELDS, split_components)
+        word_index = index.WordIndex(col, MANDARIN_FIELDS)
+        component = words['level0'][0]
+        expected = sorted(note_id for note_id, (mid, fields, tags) in col.notes.iteritems()
+                          if component in split_components(fields[4]))
+        self.assertTrue(expected)
+        self.assertEqual(reference_index.find(component), expected)
+
+        note = col.getNote(expected[0])
+        note['Decomposition'] = u'None'
+        note.flush()
+        reference_index.update_note(note)
+        self.assertEqual(reference_index.find(component), expected[1:])
+        self.assertEqual(word_index.find(note[u'漢字']), [note.id])
+
+if __name__ == '__main__':
+    unittest.main()
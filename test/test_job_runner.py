@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+# Tests for running jobs without an event loop.
+
+try:
+    import mmagic.core.exception as exception
+    import mmagic.gui.job_runner as job_runner
+    import_error = None
+except ImportError as e:
+    import_error = e
+
+@unittest.skipIf(import_error is not None, 'cannot import the job runner: %s'%import_error)
+class RunSynchronouslyTest(unittest.TestCase):
+
+    def test_failing_items_are_skipped(self):
+        applied = []
+        finished = []
+
+        def prepare(item):
+            if item == 2:
+                raise exception.MissingNote(u'二')
+            return item
+
+        def apply(item, prepared, result):
+            if item == 3:
+                raise ValueError('bad item')
+            applied.append(item)
+
+        job = job_runner.Job('Test', [1, 2, 3, 4], apply, finished.append, prepare)
+        job_runner.run_synchronously(job)
+        self.assertEqual(applied, [1, 4])
+        self.assertEqual(finished, [False])
+        self.assertEqual(job.errors.count(exception.MISSING_NOTE), 1)
+        self.assertEqual(job.errors.count(exception.OTHER), 1)
+
+if __name__ == '__main__':
+    unittest.main()
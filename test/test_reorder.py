@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import synthetic
+
+# Tests for ordering new cards by dependency, run against a synthetic
+# collection.
+
+synthetic.install()
+try:
+    import mmagic.core.reorder as reorder
+    from mmagic.core.note_cache import LOAD_CHUNK_SIZE
+    import_error = None
+except ImportError as e:
+    import_error = e
+
+@unittest.skipIf(import_error is not None, 'cannot import the reordering: %s'%import_error)
+class PlanTest(unittest.TestCase):
+
+    def test_queries_are_chunked(self):
+        col, words = synthetic.generate_collection(LOAD_CHUNK_SIZE * 2 + 100, depth=3)
+        queries = []
+        execute = col.db.execute
+
+        def recording_execute(query, *args):
+            queries.append(query)
+            return execute(query, *args)
+        col.db.execute = recording_execute
+
+        reordering = reorder.plan(col, sorted(col.notes))
+        self.assertEqual(len(queries), 6)
+        for query in queries:
+            self.assertTrue(query.split(' in ')[1].count(',') < LOAD_CHUNK_SIZE)
+        self.assertEqual(sorted(reordering.note_order), sorted(col.notes))
+
+        # Components come before the words made from them.
+        position = dict((col.notes[note_id][1][0], i)
+                        for i, note_id in enumerate(reordering.note_order))
+        for note_id, (mid, fields, tags) in col.notes.iteritems():
+            for component in fields[4].split(u', '):
+                if component in position:
+                    self.assertTrue(position[component] < position[fields[0]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import synthetic
+
+# Tests for BatchSession, run against a small synthetic collection.
+
+synthetic.install()
+try:
+    import mmagic.core.session as session
+    import_error = None
+except ImportError as e:
+    import_error = e
+
+@unittest.skipIf(import_error is not None, 'cannot import the session: %s'%import_error)
+class BatchSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.col, self.words = synthetic.generate_collection(20, depth=1)
+        self.note_ids = sorted(self.col.notes)
+
+    def changed_note(self, note_id, english):
+        note = self.col.getNote(note_id)
+        note['English'] = english
+        return note
+
+    def new_note(self, word):
+        note = synthetic.Note(self.col, synthetic.MANDARIN_MODEL)
+        note[u'漢字'] = word
+        return note
+
+    def test_changes_written_together_on_commit(self):
+        batch = session.BatchSession(self.col)
+        for note_id in self.note_ids[:3]:
+            batch.update_note(self.changed_note(note_id, u'changed'))
+        batch.add_note(self.new_note(u'新'))
+        batch.add_tags(self.note_ids[:2], 'marked')
+        batch.add_tags(self.note_ids[1:3], 'marked')
+        self.assertNotEqual(self.col.getNote(self.note_ids[0])['English'], u'changed')
+        self.col.counters.reset()
+
+        errors = batch.commit()
+        self.assertEqual(len(errors), 0)
+        counters = self.col.counters.as_dict()
+        self.assertEqual((counters['addNote'], counters['bulkAdd'], counters['save']), (1, 1, 1))
+        for note_id in self.note_ids[:3]:
+            self.assertEqual(self.col.getNote(note_id)['English'], u'changed')
+            self.assertTrue(self.col.getNote(note_id).hasTag('marked'))
+        self.assertFalse(batch.has_changes())
+
+    def test_later_changes_replace_earlier_ones(self):
+        batch = session.BatchSession(self.col)
+        batch.update_note(self.changed_note(self.note_ids[0], u'first'))
+        batch.update_note(self.changed_note(self.note_ids[0], u'second'))
+        self.assertEqual(batch.get_note(self.note_ids[0])['English'], u'second')
+        self.col.counters.reset()
+        batch.commit()
+        self.assertEqual(self.col.counters.flush, 1)
+        self.assertEqual(self.col.getNote(self.note_ids[0])['English'], u'second')
+
+    def test_added_words(self):
+        batch = session.BatchSession(self.col)
+        batch.add_note(self.new_note(u'AB字'))
+        self.assertTrue(batch.has_added_note_for(u'ab字'))
+        self.assertFalse(batch.has_added_note_for(u'字'))
+
+    def test_new_note_only_written_when_added(self):
+        batch = session.BatchSession(self.col)
+        note = self.new_note(u'新')
+        self.assertTrue(note.id)
+        batch.update_note(note)
+        batch.update_note(self.changed_note(self.note_ids[0], u'changed'))
+        self.assertEqual(len(batch.describe()), 1)
+        self.col.counters.reset()
+        batch.commit()
+        self.assertEqual((self.col.counters.flush, self.col.counters.execute), (1, 1))
+        self.assertFalse(note.id in self.col.notes)
+
+        batch.update_note(note)
+        batch.add_note(note)
+        self.assertEqual(batch.describe(), [u'add note "新"'])
+        self.col.counters.reset()
+        batch.commit()
+        self.assertEqual((self.col.counters.flush, self.col.counters.addNote), (1, 1))
+        self.assertTrue(note.id in self.col.notes)
+
+    def test_notes_made_together_keep_apart(self):
+        first = self.new_note(u'甲')
+        second = self.new_note(u'乙')
+        # As when both are made in the same millisecond.
+        second.id = first.id
+        batch = session.BatchSession(self.col)
+        batch.add_note(first)
+        batch.add_note(second)
+        self.assertNotEqual(first.id, second.id)
+        batch.commit()
+        self.assertEqual(self.col.getNote(first.id)[u'漢字'], u'甲')
+        self.assertEqual(self.col.getNote(second.id)[u'漢字'], u'乙')
+
+    def test_added_note_moved_past_stored_id(self):
+        stored = self.col.getNote(self.note_ids[-1])
+        note = self.new_note(u'新')
+        note.id = stored.id
+        batch = session.BatchSession(self.col)
+        batch.add_note(note)
+        batch.commit()
+        self.assertTrue(note.id > stored.id)
+        self.assertEqual(self.col.getNote(stored.id).fields, stored.fields)
+        self.assertEqual(self.col.getNote(note.id)[u'漢字'], u'新')
+
+    def test_nothing_to_commit(self):
+        self.col.counters.reset()
+        self.assertEqual(len(session.BatchSession(self.col).commit()), 0)
+        self.assertEqual(self.col.counters.save, 0)
+
+    def test_remove_tags(self):
+        self.col.tags.bulkAdd(self.note_ids[:3], 'marked')
+        batch = session.BatchSession(self.col)
+        batch.remove_tags(self.note_ids[:3], 'marked')
+        batch.add_tags(self.note_ids[2:4], 'marked')
+        self.assertEqual(batch.describe(), [
+            u'tag 2 notes with "marked"', u'remove "marked" from 2 notes'])
+        self.col.counters.reset()
+        batch.commit()
+        self.assertEqual(self.col.counters.bulkAdd, 2)
+        self.assertEqual([self.col.getNote(note_id).hasTag('marked') for note_id in self.note_ids[:5]],
+                [False, False, True, True, False])
+
+    def test_dry_run(self):
+        batch = session.BatchSession(self.col, dry_run=True)
+        note = self.changed_note(self.note_ids[0], u'changed')
+        batch.update_note(note)
+        batch.add_note(self.new_note(u'新'))
+        batch.add_tags(self.note_ids[:2], 'marked')
+        self.col.counters.reset()
+        batch.commit()
+        counters = self.col.counters.as_dict()
+        self.assertEqual((counters['flush'], counters['addNote'], counters['save']), (0, 0, 0))
+        self.assertEqual(batch.describe(), [
+            u'add note "新"',
+            u'update note %d "%s": English'%(note.id, note[u'漢字']),
+            u'tag 2 notes with "marked"'])
+
+if __name__ == '__main__':
+    unittest.main()
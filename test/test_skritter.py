@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import synthetic
+
+# Tests for the Skritter export ledger, run against a small synthetic
+# collection.
+
+synthetic.install()
+try:
+    import mmagic.core.skritter as skritter
+    from mmagic.core.engine import Engine
+    import_error = None
+except ImportError as e:
+    import_error = e
+
+@unittest.skipIf(import_error is not None, 'cannot import the engine: %s'%import_error)
+class ExportLedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.col, self.words = synthetic.generate_collection(20, depth=1)
+        self.directory = tempfile.mkdtemp()
+        self.col.path = os.path.join(self.directory, 'collection.anki2')
+        self.engine = Engine(self.col)
+        self.col.flush_callbacks.append(self.engine.note_flushed)
+        self.ledger = skritter.ExportLedger(self.col)
+        self.exported = self.words['level0'][:3]
+        self.note_ids = [self.engine.get_word_index().find(word)[0] for word in self.exported]
+        self.ledger.record(self.exported[:2])
+        self.engine.add_tags(self.note_ids[2:], skritter.EXPORTED_TAG)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_exported_words_left_out(self):
+        export = skritter.prepare_export(self.engine, self.words['level0'], self.ledger)
+        self.assertEqual(export.skipped, 3)
+        self.assertFalse(set(export.words) & set(self.exported))
+
+    def test_include_exported(self):
+        export = skritter.prepare_export(self.engine, self.words['level0'], self.ledger,
+                include_exported=True)
+        self.assertEqual(sorted(export.words), sorted(self.words['level0']))
+
+    def test_forget_exports(self):
+        skritter.forget_exports(self.engine, self.ledger, self.exported, self.note_ids)
+        self.assertEqual(len(skritter.ExportLedger(self.col)), 0)
+        self.assertFalse(self.col.getNote(self.note_ids[2]).hasTag(skritter.EXPORTED_TAG))
+        export = skritter.prepare_export(self.engine, self.words['level0'], self.ledger)
+        self.assertEqual(export.skipped, 0)
+
+    def test_ledger_kept_in_its_own_file(self):
+        self.assertNotIn(skritter.LEDGER_KEY, self.col.conf)
+        self.assertEqual(set(skritter.ExportLedger(self.col).words), set(self.exported[:2]))
+
+    def test_ledger_moved_out_of_configuration(self):
+        os.remove(skritter.get_ledger_path(self.col))
+        self.col.conf[skritter.LEDGER_KEY] = sorted(self.exported[:2])
+        ledger = skritter.ExportLedger(self.col)
+        self.assertEqual(len(ledger), 2)
+        ledger.record(self.exported[2:])
+        self.assertNotIn(skritter.LEDGER_KEY, self.col.conf)
+        self.assertEqual(len(skritter.ExportLedger(self.col)), 3)
+
+    def test_unchanged_ledger_not_written(self):
+        path = skritter.get_ledger_path(self.col)
+        os.remove(path)
+        self.ledger.record(self.exported[:1])
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import os
+import shutil
+import tempfile
+import unittest
+
+# Round-trip tests for the dictionary snapshot: a small CEDICT file is
+# compiled, memory-mapped and looked up.
+
+try:
+    import mmagic.core.lookup as lookup
+    import mmagic.core.snapshot as snapshot
+    import zhonglib as zl
+    import_error = None
+except ImportError as e:
+    import_error = e
+
+CEDICT = u'''# CC-CEDICT
+# A comment line.
+個 个 [ge4] /individual/this/that/
+張 张 [zhang1] /to open up/CL:個|个[ge4]/
+書 书 [shu1] /book/letter/CL:本[ben3],冊|册[ce4],部[bu4]/
+書 书 [Shu1] /abbr. for 書經|书经[Shu1 jing1]/
+人 人 [ren2] /person/people/
+this line is not an entry
+'''
+
+@unittest.skipIf(import_error is not None, 'cannot import the snapshot module: %s'%import_error)
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.directory, 'cedict_ts.u8')
+        self.snapshot_path = os.path.join(self.directory, 'cedict.snapshot')
+        self.write_source(CEDICT)
+        self.dictionaries = []
+        self.compiled = 0
+        self.compile_snapshot = snapshot.compile_snapshot
+
+        def counting_compile(source_path, snapshot_path):
+            self.compiled += 1
+            self.compile_snapshot(source_path, snapshot_path)
+        snapshot.compile_snapshot = counting_compile
+
+    def tearDown(self):
+        snapshot.compile_snapshot = self.compile_snapshot
+        for dictionary in self.dictionaries:
+            dictionary.close()
+        shutil.rmtree(self.directory)
+
+    def write_source(self, text):
+        with codecs.open(self.source_path, 'w', 'utf-8') as source:
+            source.write(text)
+
+    def load(self):
+        dictionary = snapshot.load_dictionary(self.source_path, self.snapshot_path)
+        self.dictionaries.append(dictionary)
+        return dictionary
+
+    def test_round_trip(self):
+        dictionary = self.load()
+        self.assertEqual(self.compiled, 1)
+        entries = dictionary.find(u'書', zl.TRADITIONAL)
+        self.assertEqual([e.pinyin for e in entries], [u'[shu1]', u'[Shu1]'])
+        self.assertEqual(entries[0].traditional, u'書')
+        self.assertEqual(entries[0].simplified, u'书')
+        self.assertEqual(entries[0].english, [u'book', u'letter'])
+        self.assertEqual(entries[0].traditional_measure_words, [u'本', u'冊', u'部'])
+        self.assertEqual(entries[1].english, [u'abbr. for 書經|书经[Shu1 jing1]'])
+
+    def test_simplified_lookup(self):
+        dictionary = self.load()
+        self.assertEqual([e.traditional for e in dictionary.find(u'张', zl.SIMPLIFIED)], [u'張'])
+        self.assertEqual(dictionary.find(u'张', zl.TRADITIONAL), [])
+        # The same entry is only returned once when both forms match.
+        self.assertEqual(len(dictionary.find(u'人', zl.TRADITIONAL | zl.SIMPLIFIED)), 1)
+
+    def test_missing_word(self):
+        dictionary = self.load()
+        self.assertEqual(dictionary.find(u'貓', zl.TRADITIONAL | zl.SIMPLIFIED), [])
+        self.assertEqual(dictionary.find(u'', zl.TRADITIONAL), [])
+
+    def test_reused_while_source_unchanged(self):
+        self.load()
+        self.assertEqual(self.load().find(u'人', zl.TRADITIONAL)[0].english, [u'person', u'people'])
+        self.assertEqual(self.compiled, 1)
+
+    def test_recompiled_when_source_changes(self):
+        self.load()
+        self.write_source(CEDICT + u'貓 猫 [mao1] /cat/CL:隻|只[zhi1]/\n')
+        dictionary = self.load()
+        self.assertEqual(self.compiled, 2)
+        self.assertEqual(dictionary.find(u'猫', zl.SIMPLIFIED)[0].traditional_measure_words, [u'隻'])
+
+    def test_recompiled_when_corrupt(self):
+        for data in ('', 'not a snapshot at all', None):
+            if data is None:
+                # A valid header with the rest cut off.
+                with open(self.snapshot_path, 'rb') as f:
+                    data = f.read(snapshot.HEADER.size + 8)
+            with open(self.snapshot_path, 'wb') as f:
+                f.write(data)
+            compiled = self.compiled
+            dictionary = self.load()
+            self.assertEqual(self.compiled, compiled + 1)
+            self.assertEqual(dictionary.find(u'個', zl.TRADITIONAL)[0].pinyin, u'[ge4]')
+
+    def test_lookup_is_memory_mapped(self):
+        self.assertTrue(lookup.Lookup(self.load()).is_memory_mapped())
+        self.assertFalse(lookup.Lookup(zl.standard_dictionary()).is_memory_mapped())
+
+    def test_no_source(self):
+        os.remove(self.source_path)
+        self.assertEqual(snapshot.load_dictionary(self.source_path, self.snapshot_path), None)
+
+    def test_source_found_in_data_directory(self):
+        data_directory = snapshot.DATA_DIRECTORY
+        snapshot.DATA_DIRECTORY = self.directory
+        try:
+            self.assertEqual(snapshot.find_source_path(), self.source_path)
+        finally:
+            snapshot.DATA_DIRECTORY = data_directory
+
+# Number of entries of each kind compared with zhonglib's dictionary.
+SAMPLE_SIZE = 200
+
+def describe_entries(entries):
+    return [(e.traditional, e.simplified, e.pinyin, list(e.english),
+             list(e.traditional_measure_words)) for e in entries]
+
+# Compares the snapshot of the CEDICT file installed with zhonglib with
+# zhonglib's own dictionary.
+@unittest.skipIf(import_error is not None, 'cannot import the snapshot module: %s'%import_error)
+class ZhonglibDictionaryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.source_path = snapshot.find_source_path()
+        if cls.source_path is None:
+            raise unittest.SkipTest('zhonglib has no CEDICT file to compare with')
+        cls.directory = tempfile.mkdtemp()
+        snapshot_path = os.path.join(cls.directory, 'cedict.snapshot')
+        cls.dictionary = snapshot.load_dictionary(cls.source_path, snapshot_path)
+        cls.standard = zl.standard_dictionary()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dictionary.close()
+        shutil.rmtree(cls.directory)
+
+    # Ordinary entries, entries with measure words, headwords with more than
+    # one entry, and entries whose simplified form differs.
+    def sample_words(self):
+        plain, measured, repeated, simplified = [], [], [], []
+        seen = set()
+        for traditional, simple, pinyin, english, measure_words in\
+                snapshot.parse_cedict(self.source_path):
+            if traditional in seen and len(repeated) < SAMPLE_SIZE:
+                repeated.append((traditional, zl.TRADITIONAL))
+            seen.add(traditional)
+            if len(plain) < SAMPLE_SIZE:
+                plain.append((traditional, zl.TRADITIONAL))
+            if measure_words and len(measured) < SAMPLE_SIZE:
+                measured.append((traditional, zl.TRADITIONAL))
+            if simple != traditional and len(simplified) < SAMPLE_SIZE:
+                simplified.append((simple, zl.SIMPLIFIED))
+        return plain + measured + repeated + simplified
+
+    def test_entries_match(self):
+        for word, flags in self.sample_words():
+            for flags in (flags, zl.TRADITIONAL | zl.SIMPLIFIED):
+                self.assertEqual(
+                    describe_entries(self.dictionary.find(word, flags)),
+                    describe_entries(self.standard.find(word, flags)), word)
+
+if __name__ == '__main__':
+    unittest.main()
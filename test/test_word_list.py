@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import synthetic
+
+# Tests for reading word lists.
+
+synthetic.install()
+try:
+    import mmagic.core.word_list as word_list
+    import_error = None
+except ImportError as e:
+    import_error = e
+
+@unittest.skipIf(import_error is not None, 'cannot import the word lists: %s'%import_error)
+class ParseWordListTest(unittest.TestCase):
+
+    def test_first_cjk_token_of_each_line(self):
+        lines = [
+            u'Word,Pinyin,English\n',
+            u'# comment\n',
+            u'\n',
+            u'卡拉OK\tkǎlā OK\tkaraoke\n',
+            u'"1","書","shū","book"\n',
+            u'人；rén；person\n',
+            u'書\n',
+            u'一、二\n',
+        ]
+        self.assertEqual(word_list.parse_word_list(lines), [u'卡拉OK', u'書', u'人', u'一'])
+
+if __name__ == '__main__':
+    unittest.main()